@@ -25,12 +25,12 @@ if os.path.isfile(ENV_PATH):
     environ.Env.read_env(ENV_PATH)
 
 
-def get_environment_var(key):
+def get_environment_var(key, default=environ.Env.NOTSET):
     """
     For Vercel deployment we must use os.getenv(), while for local development with
     a .env file we use env(). First check os.getenv(), then default to env()
     """
-    return os.getenv(key, env(key))
+    return os.getenv(key, env(key, default=default))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -63,9 +63,11 @@ INSTALLED_APPS = [
     'budgets',
     'expenses',
     'users',
+    'utils',
 ]
 
 MIDDLEWARE = [
+    'utils.middleware.ProfilingMiddleware',  # First, to time everything else
     'users.middleware.ShowCsrfTokenMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -85,10 +87,12 @@ SESSION_COOKIE_SAMESITE = 'None'
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_HEADERS = [
     'content-type',
+    'if-none-match',
     'x-csrftoken',
 ]
 CORS_EXPOSE_HEADERS = [
-    'X-Csrftoken'
+    'ETag',
+    'X-Csrftoken',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -122,16 +126,33 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated'
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'utils.renderers.ORJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'utils.parsers.ORJSONParser',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
 
+# Serve the hot read endpoints with async views (see utils.views.AsyncReadMixin).
+# asgi.py turns this on, since async views only pay off under an ASGI server.
+ASYNC_READ_VIEWS = get_environment_var('ASYNC_READ_VIEWS', default='False') == 'True'
+
+# Request profiling (see utils.middleware.ProfilingMiddleware): Server-Timing headers,
+# N+1 query warnings and per-route timings for "manage.py perf_report". The SQL
+# run this many times in one request counts as N+1 queries, and each process
+# copies its timings to the cache at most once per interval (in seconds).
+PROFILING_ENABLED = get_environment_var('PROFILING_ENABLED', default='False') == 'True'
+PROFILING_DUPLICATE_QUERY_THRESHOLD = 3
+PROFILING_FLUSH_INTERVAL = 10
+
+# Bulk expense creation: the most expenses accepted in one request, and how
+# many are inserted per INSERT statement
+EXPENSES_BULK_CREATE_MAX_COUNT = 10000
+EXPENSES_BULK_CREATE_BATCH_SIZE = 500
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Financial Aide Backend',
     'DESCRIPTION': 'API Backend for Financial Aide open-source budgeting system',
@@ -184,6 +205,41 @@ else:
         }
     }
 
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Shared between instances through Redis in production. Without Redis nothing is
+# cached: instances share nothing, so a process-local cache would keep serving
+# data changed through other instances.
+
+REDIS_URL = get_environment_var('REDIS_URL', default='')
+
+# Whether every instance uses the same cache. Responses are only cached, and
+# given ETags, when it is (see utils.caching).
+SHARED_CACHE = bool(REDIS_URL)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    }
+
+# How long cached responses are kept (writes invalidate them before that, see utils.caching)
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# How long each process keeps its snapshot of the budget categories, bounding how long
+# changes made through other processes go unseen without a shared cache (see budgets.catalogue)
+CATEGORY_CATALOGUE_MAX_AGE = 60
+
 AUTH_USER_MODEL = 'users.User'
 
 # Password validation
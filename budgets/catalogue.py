@@ -0,0 +1,177 @@
+"""
+Process-local cache of the budget category catalogue. Categories are reference
+data (loaded from budgetcategories.json) that almost never change, so they are
+read from the database once and then served from memory until a category is
+saved or deleted (see budgets.signals), which bumps the catalogue's version.
+Writes through other processes only bump their own catalogue's version, so
+with a shared cache (settings.SHARED_CACHE) snapshots also record the shared
+data version of the catalogue (see utils.caching), and are reloaded once it
+changes. Without one, snapshots are reloaded once they are older than
+settings.CATEGORY_CATALOGUE_MAX_AGE seconds, and lookups that find a category
+missing (e.g. spending in a category created elsewhere) reload them right away.
+"""
+
+import bisect
+import hashlib
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from budgets.models import BudgetCategory
+from utils.caching import CATALOGUE_SCOPE, get_data_versions
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def get_words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+class CatalogueSnapshot:
+    """
+    Immutable view of the categories as of one catalogue version
+    """
+    def __init__(self, version, shared_version, categories):
+        self.version = version
+        self.shared_version = shared_version
+        self.loaded_at = time.monotonic()
+        self.categories = categories  # In the model's default (alphabetical) order
+        self.by_id = {category.pk: category for category in categories}
+        self.by_name = {category.name.lower(): category for category in categories}
+        self.lower_names = [category.name.lower() for category in categories]
+        # Prefix index: the positions of the categories with each word, and the words
+        # sorted, so the ones starting with a prefix are next to each other
+        word_positions = defaultdict(set)
+        for position, name in enumerate(self.lower_names):
+            for word in get_words(name):
+                word_positions[word].add(position)
+        self.word_positions = {word: frozenset(positions) for word, positions in word_positions.items()}
+        self.sorted_words = sorted(self.word_positions)
+        self.etag = hashlib.md5(
+            '\n'.join(
+                f'{category.pk}|{category.name}|{category.typical_percentage}|{category.typical_monthly_amount}'
+                for category in categories
+            ).encode()
+        ).hexdigest()
+
+    def get_positions_with_prefix(self, prefix):
+        """
+        Positions of the categories with a word starting with the prefix
+        """
+        index = bisect.bisect_left(self.sorted_words, prefix)
+        words = []
+        while index < len(self.sorted_words) and self.sorted_words[index].startswith(prefix):
+            words.append(self.sorted_words[index])
+            index += 1
+        return frozenset().union(*(self.word_positions[word] for word in words))
+
+    def autocomplete(self, query, limit):
+        query_words = get_words(query)
+        if not query_words:
+            return []
+        positions = frozenset.intersection(*(self.get_positions_with_prefix(word) for word in set(query_words)))
+        # Names starting with the query first, then alphabetically
+        query = query.strip().lower()
+        positions = heapq.nsmallest(
+            limit,
+            positions,
+            key=lambda position: (not self.lower_names[position].startswith(query), position)
+        )
+        return [self.categories[position] for position in positions]
+
+
+class BudgetCategoryCatalogue:
+    def __init__(self):
+        self._version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        """
+        Bumps the version stamp, so the next lookup reloads the categories
+        """
+        with self._lock:
+            self._version += 1
+
+    def get_shared_version(self):
+        # Read before loading the categories, so a change made meanwhile bumps it again
+        return get_data_versions([CATALOGUE_SCOPE])[0] if settings.SHARED_CACHE else None
+
+    def get_snapshot(self):
+        shared_version = self.get_shared_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version and \
+                snapshot.shared_version == shared_version and \
+                time.monotonic() - snapshot.loaded_at < settings.CATEGORY_CATALOGUE_MAX_AGE:
+            return snapshot
+        with self._lock:
+            version = self._version
+            snapshot = CatalogueSnapshot(version, shared_version, list(BudgetCategory.objects.all()))
+            # Only keep it if the catalogue didn't change while it was being loaded
+            if version == self._version:
+                self._snapshot = snapshot
+        return snapshot
+
+    def get_snapshot_including(self, category_ids):
+        """
+        Gets a snapshot with every given category (None is ignored), reloading it once
+        if some are missing, since they were probably created through another process
+        """
+        snapshot = self.get_snapshot()
+        if any(pk is not None and pk not in snapshot.by_id for pk in category_ids):
+            self.invalidate()
+            snapshot = self.get_snapshot()
+        return snapshot
+
+    def all(self):
+        return self.get_snapshot().categories
+
+    def get(self, pk):
+        """
+        Gets a category by primary key, or None if there is no such category
+        """
+        return self.get_snapshot().by_id.get(pk)
+
+    def get_by_name(self, name):
+        """
+        Gets a category by (case-insensitive) name, or None if there is no such category
+        """
+        return self.get_snapshot().by_name.get(name.strip().lower())
+
+    def search(self, terms):
+        """
+        Filters categories the same way SearchFilter does for search_fields = ['name']:
+        every term must be contained (case-insensitively) in the name
+        """
+        terms = [term.lower() for term in terms]
+        return [
+            category for category in self.all()
+            if all(term in category.name.lower() for term in terms)
+        ]
+
+    def autocomplete(self, query, limit=10):
+        """
+        Gets up to limit categories with a name that has a word starting with each
+        word of the query (case-insensitively), the ones starting with the whole
+        query first, using a prefix index rather than scanning every name
+        """
+        return self.get_snapshot().autocomplete(query, limit)
+
+    @property
+    def etag(self):
+        """
+        Digest of the catalogue's contents. It doesn't depend on the version
+        stamp, so it's the same across processes serving the same data.
+        """
+        return self.get_snapshot().etag
+
+
+category_catalogue = BudgetCategoryCatalogue()
@@ -0,0 +1,13 @@
+from django_filters import rest_framework as filters
+
+from budgets.models import BudgetCategoryRelation
+
+
+class BudgetCategoryRelationsFilter(filters.FilterSet):
+    # planned_total is annotated by BudgetCategoryRelationQuerySet.with_planned_total()
+    planned_total__gte = filters.NumberFilter(field_name='planned_total', lookup_expr='gte')
+    planned_total__lte = filters.NumberFilter(field_name='planned_total', lookup_expr='lte')
+
+    class Meta:
+        model = BudgetCategoryRelation
+        fields = ['budget', 'category']
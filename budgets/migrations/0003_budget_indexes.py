@@ -0,0 +1,29 @@
+# Generated by Django 4.2.4 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgets', '0002_rename_typical_raw_amount_budgetcategory_typical_monthly_amount'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='budget',
+            options={'ordering': ['-end_time']},
+        ),
+        migrations.AlterModelOptions(
+            name='budgetcategory',
+            options={'ordering': ['name']},
+        ),
+        migrations.AlterModelOptions(
+            name='budgetcategoryrelation',
+            options={'ordering': ['-budget__start_time', '-category__name']},
+        ),
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['user', '-end_time'], name='budget_user_end_time_idx'),
+        ),
+    ]
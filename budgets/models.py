@@ -1,10 +1,12 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import FloatField, Subquery, OuterRef, Sum
-from django.db.models.functions import Coalesce
+from django.db.models import Case, DecimalField, F, FilteredRelation, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
 from django.utils.timezone import make_aware
 
-from utils.choices import TimeInterval
+from utils.choices import TIME_INTERVAL_DAYS, TimeInterval
+from utils.functions import DurationDays
 
 
 class Budget(models.Model):
@@ -45,29 +47,80 @@ class Budget(models.Model):
 
     class Meta:
         ordering = ['-end_time'] # show most recent first by default
+        indexes = [
+            # Serves listing a user's budgets, including keyset pagination on (end_time, id)
+            models.Index(fields=['user', '-end_time'], name='budget_user_end_time_idx'),
+        ]
 
 
 class BudgetCategoriesManager(models.Manager):
-    def get_actual_spending_by_category(self, expenses_queryset):
-        return self.annotate(  # for each category
-            total_amount=Coalesce(
-                # find the total amount among expenses under that category
-                Subquery(
-                    # use existing queryset (may be filtered if desired)
-                    expenses_queryset.filter(
-                        category_id=OuterRef('id')
-                        # by filtering by the category's ID
-                    )
-                    .values(
-                        'category_id')  # necessary for GROUP BY category_id to work correctly
-                    .annotate(total=Sum('amount'))
-                    .values('total'),  # take the total
-                    output_field=FloatField()
-                ),
-                0,  # Default to 0 if no expenses under category
-                output_field=FloatField()
-            )
-        ).values('id', 'total_amount').order_by('-total_amount')
+    def bulk_create(self, objs, *args, **kwargs):
+        categories = super().bulk_create(objs, *args, **kwargs)
+        self.invalidate_catalogue()
+        return categories
+
+    def bulk_update(self, objs, *args, **kwargs):
+        updated_count = super().bulk_update(objs, *args, **kwargs)
+        self.invalidate_catalogue()
+        return updated_count
+
+    def invalidate_catalogue(self):
+        """
+        Bulk writes don't send signals, so they invalidate the category catalogue
+        (and the responses depending on it) themselves. QuerySet.update() doesn't:
+        call this after updating categories that way.
+        """
+        # Imported here because the signals module imports this one
+        from budgets.signals import invalidate_category_catalogue
+
+        invalidate_category_catalogue(sender=BudgetCategory)
+
+    def get_actual_spending_by_category(self, expenses_queryset, amount_field='amount'):
+        """
+        Gets the total amount among the given expenses (may be filtered if desired)
+        for every category, as a list of {id, total_amount} sorted highest to lowest.
+        The totals come from a single GROUP BY over the expenses, and categories
+        without any expenses are filled in from the catalogue with a total of 0
+        (which is reloaded if the totals have categories it doesn't know yet).
+        amount_field is the field summed, for querysets of pre-aggregated rows.
+        """
+        # Imported here because the catalogue module imports this one
+        from budgets.catalogue import category_catalogue
+
+        totals = dict(self.get_category_totals_queryset(expenses_queryset, amount_field))
+        return self.get_spending_by_category(totals, category_catalogue.get_snapshot_including(totals).categories)
+
+    async def aget_actual_spending_by_category(self, expenses_queryset, amount_field='amount'):
+        """
+        Async version of get_actual_spending_by_category()
+        """
+        from budgets.catalogue import category_catalogue
+
+        totals = {
+            category_id: total
+            async for category_id, total in self.get_category_totals_queryset(expenses_queryset, amount_field)
+        }
+        snapshot = await sync_to_async(category_catalogue.get_snapshot_including)(totals)
+        return self.get_spending_by_category(totals, snapshot.categories)
+
+    def get_category_totals_queryset(self, expenses_queryset, amount_field):
+        return (
+            expenses_queryset
+            .order_by()  # ordering would otherwise be added to the GROUP BY
+            .values_list('category_id')
+            .annotate(total=Sum(amount_field))
+        )
+
+    def get_spending_by_category(self, totals, categories):
+        spending = [
+            {
+                'id': category.pk,
+                'total_amount': float(totals.get(category.pk) or 0),
+            } for category in categories
+        ]
+        # Stable sort, so categories with equal totals stay in alphabetical order
+        spending.sort(key=lambda category_spending: category_spending['total_amount'], reverse=True)
+        return spending
 
 
 class BudgetCategory(models.Model):
@@ -84,12 +137,62 @@ class BudgetCategory(models.Model):
         ordering = ['name'] # show alphabetical order by default
 
 
+class BudgetCategoryRelationQuerySet(models.QuerySet):
+    def with_actual_spending(self, budget):
+        """
+        Annotates each relation (of the given budget) with actual_amount: the total
+        of the budget owner's expenses under the relation's category within the
+        budget's time window. The expenses are joined and grouped in the same query.
+        """
+        return self.annotate(
+            window_expenses=FilteredRelation(
+                'category__expenses',
+                condition=Q(
+                    category__expenses__user_id=budget.user_id,
+                    category__expenses__timestamp__gte=budget.start_time,
+                    category__expenses__timestamp__lte=budget.end_time,
+                )
+            ),
+            actual_amount=Coalesce(
+                Sum('window_expenses__amount'),
+                Value(0),  # Default to 0 if no expenses under category
+                output_field=DecimalField(max_digits=14, decimal_places=2)
+            )
+        ).select_related('category')
+
+    def with_planned_total(self):
+        """
+        Annotates each relation with planned_total: the amount allocated to it across
+        its whole budget, like get_total_amount() but computed by the database, so
+        relations can be ordered, filtered and aggregated by it. Rounded to the cent
+        (the arithmetic is in floating point, so exact half cents may round either way).
+        """
+        duration_days = DurationDays(F('budget__end_time') - F('budget__start_time'))
+        interval_days = Case(
+            *[When(budget__interval=interval, then=Value(days)) for interval, days in TIME_INTERVAL_DAYS.items()],
+            default=Value(1),
+        )
+        # Floats, because SQLite would otherwise use integer division for whole amounts
+        amount = Cast('amount', FloatField())
+        interval_amount = Case(
+            When(is_percentage=True, then=amount * Cast('budget__income', FloatField()) / Value(100.0)),
+            default=amount,
+        )
+        return self.annotate(planned_total=Round(
+            interval_amount * duration_days / interval_days,
+            2,
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ))
+
+
 class BudgetCategoryRelation(models.Model):
     budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='categories')
     category = models.ForeignKey(BudgetCategory, on_delete=models.CASCADE, related_name='relations')
     amount = models.DecimalField(max_digits=12, decimal_places=2, )
     is_percentage = models.BooleanField()
 
+    objects = BudgetCategoryRelationQuerySet.as_manager()
+
     def get_total_amount(self):
         """
         Gets the total amount (raw amount) allocated to this
@@ -9,7 +9,7 @@ class IsMyBudget(permissions.BasePermission):
     they own it
     """
     def has_object_permission(self, request, view, obj):
-        return request.user.pk == obj.user.pk
+        return request.user.pk == obj.user_id
 
 
 class IsMyBudgetCategoryRelationCreation(permissions.BasePermission):
@@ -20,8 +20,10 @@ class IsMyBudgetCategoryRelationCreation(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True # Read-only is always OK
-        budget = Budget.objects.get(pk=request.data.get('budget'))
-        return budget.user.pk == request.user.pk
+        try:
+            return Budget.objects.filter(pk=request.data.get('budget'), user=request.user).exists()
+        except (TypeError, ValueError):
+            return False # Not a valid budget ID
 
 
 class IsMyBudgetCategoryRelationDetail(permissions.BasePermission):
@@ -30,4 +32,4 @@ class IsMyBudgetCategoryRelationDetail(permissions.BasePermission):
     only if they own the budget that it relates to
     """
     def has_object_permission(self, request, view, obj):
-        return request.user.pk == obj.budget.user.pk
+        return request.user.pk == obj.budget.user_id
@@ -0,0 +1,158 @@
+"""
+Batched projections of budgets: planned totals, pacing and remaining allowance
+for every category relation of any number of budgets. Everything is computed
+with Decimals and rounded to the cent once, at the end, so the results match
+what a person would get by hand (unlike Budget.get_multiplier() and
+BudgetCategoryRelation.get_total_amount(), which go through floats).
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.utils import timezone
+
+from utils.choices import TIME_INTERVAL_DAYS
+
+CENT = Decimal('0.01')
+
+
+def round_cents(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_interval_days(interval):
+    return TIME_INTERVAL_DAYS.get(interval, 1)
+
+
+class CategoryProjection:
+    """
+    Planned and actual spending of one category relation, and how it's pacing
+    """
+    __slots__ = ('budget_projection', 'category_relation', 'planned_amount', 'actual_amount')
+
+    def __init__(self, budget_projection, category_relation, planned_amount, actual_amount):
+        self.budget_projection = budget_projection
+        self.category_relation = category_relation
+        self.planned_amount = planned_amount
+        self.actual_amount = actual_amount
+
+    @property
+    def category(self):
+        return self.category_relation.category
+
+    @property
+    def remaining_amount(self):
+        return self.planned_amount - self.actual_amount
+
+    @property
+    def daily_allowance(self):
+        """
+        How much could be spent per day
+        """
+        duration_days = self.budget_projection.duration_days
+        return round_cents(self.planned_amount / duration_days) if duration_days else None
+
+    @property
+    def expected_amount(self):
+        """
+        How much would have been spent by now, if spending were spread evenly across the budget
+        """
+        duration_days = self.budget_projection.duration_days
+        if not duration_days:
+            return self.planned_amount
+        return round_cents(self.planned_amount * self.budget_projection.elapsed_days / duration_days)
+
+    @property
+    def remaining_daily_allowance(self):
+        """
+        How much can still be spent per day for the rest of the budget
+        """
+        remaining_days = self.budget_projection.remaining_days
+        return round_cents(self.remaining_amount / remaining_days) if remaining_days else None
+
+
+class BudgetProjection:
+    """
+    Projections of all of a budget's category relations, as of a point in time
+    """
+    def __init__(self, budget, now):
+        self.budget = budget
+        self.duration_days = budget.get_duration_days()
+        self.elapsed_days = min(max((now - budget.start_time).days, 0), self.duration_days)
+        self.remaining_days = self.duration_days - self.elapsed_days
+        # A relation's planned total is amount * (duration / interval days), or for
+        # percentages amount * income / 100 * (duration / interval days). Only the
+        # numerators and denominators are computed here, so the only inexact step
+        # is the division for each relation, right before rounding.
+        interval_days = get_interval_days(budget.interval)
+        self.fixed_factor = (self.duration_days, interval_days)
+        self.percentage_factor = (budget.income * self.duration_days, interval_days * 100)
+        self.category_projections = []
+
+    def add(self, category_relation, actual_amount):
+        numerator, denominator = self.percentage_factor if category_relation.is_percentage else self.fixed_factor
+        planned_amount = round_cents(category_relation.amount * numerator / denominator)
+        self.category_projections.append(
+            CategoryProjection(self, category_relation, planned_amount, round_cents(Decimal(actual_amount)))
+        )
+
+    def get_total(self, field_name):
+        return sum(
+            (getattr(category_projection, field_name) for category_projection in self.category_projections),
+            Decimal(0)
+        )
+
+    @property
+    def planned_amount(self):
+        return self.get_total('planned_amount')
+
+    @property
+    def actual_amount(self):
+        return self.get_total('actual_amount')
+
+    @property
+    def remaining_amount(self):
+        return self.get_total('remaining_amount')
+
+    @property
+    def expected_amount(self):
+        return self.get_total('expected_amount')
+
+
+def project_budgets(budgets, category_relations, now=None):
+    """
+    Projects the given budgets' category relations in one pass. Relations should
+    be annotated with actual_amount (see BudgetCategoryRelationQuerySet.with_actual_spending),
+    otherwise nothing counts as spent yet. Returns {budget ID: BudgetProjection},
+    with each budget's relations in the order they were given.
+    """
+    now = now or timezone.now()
+    budget_projections = {budget.pk: BudgetProjection(budget, now) for budget in budgets}
+    for category_relation in category_relations:
+        budget_projections[category_relation.budget_id].add(
+            category_relation,
+            getattr(category_relation, 'actual_amount', 0),
+        )
+    return budget_projections
+
+
+def get_budget_projection(budget, now=None, ordering=('category__name',)):
+    """
+    Projects one budget, with its relations in the given order (alphabetically by
+    category by default) and their actual spending within the budget's time
+    window (in one query)
+    """
+    return project_budgets([budget], get_projected_category_relations(budget, ordering), now=now)[budget.pk]
+
+
+async def aget_budget_projection(budget, now=None, ordering=('category__name',)):
+    """
+    Async version of get_budget_projection()
+    """
+    category_relations = [
+        category_relation async for category_relation in get_projected_category_relations(budget, ordering)
+    ]
+    return project_budgets([budget], category_relations, now=now)[budget.pk]
+
+
+def get_projected_category_relations(budget, ordering):
+    return budget.categories.with_actual_spending(budget).order_by(*ordering)
@@ -1,8 +1,10 @@
 from rest_framework import serializers
 
+from budgets.catalogue import category_catalogue
 from budgets.models import *
 
 from users.serializers import UserResponseSerializer
+from utils.serializers import CompiledSerializer
 
 
 class BudgetCreationSerializer(serializers.ModelSerializer):
@@ -38,6 +40,9 @@ class BudgetResponseSerializer(serializers.ModelSerializer):
     user = UserResponseSerializer()
 
 
+compiled_budget_response_serializer = CompiledSerializer(BudgetResponseSerializer)
+
+
 class BudgetCategoryResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = BudgetCategory
@@ -49,6 +54,46 @@ class BudgetCategoryResponseSerializer(serializers.ModelSerializer):
         ]
 
 
+class BudgetCategoryAutocompleteRequestSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'q',
+            'limit',
+        ]
+
+    q = serializers.CharField(allow_blank=True, trim_whitespace=False, default='')
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class CatalogueCategoryField(serializers.PrimaryKeyRelatedField):
+    """
+    Budget category primary key field that resolves categories from the
+    in-memory catalogue, instead of running a query for each one. Categories
+    missing from it are looked up in the database, since they may have been
+    created through another process, whose writes only invalidate its own
+    catalogue.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(queryset=BudgetCategory.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        # One snapshot for every category in the request, since checking that it's
+        # current can take a round trip to the cache
+        if getattr(self, 'catalogue_snapshot', None) is None:
+            self.catalogue_snapshot = category_catalogue.get_snapshot()
+        category = self.catalogue_snapshot.by_id.get(pk)
+        if category is None:
+            category = super().to_internal_value(pk)  # Fails if the database doesn't have it either
+            category_catalogue.invalidate()  # It's out of date, so reload it next time
+        return category
+
+
 class BudgetCategoryRelationCreationSerializer(serializers.ModelSerializer):
     class Meta:
         model = BudgetCategoryRelation
@@ -59,6 +104,10 @@ class BudgetCategoryRelationCreationSerializer(serializers.ModelSerializer):
             'is_percentage'
         ]
 
+    # The budget's user is serialized in the response, so fetch it along with the budget
+    budget = serializers.PrimaryKeyRelatedField(queryset=Budget.objects.select_related('user'))
+    category = CatalogueCategoryField()
+
 
 class BudgetCategoryRelationResponseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -75,6 +124,16 @@ class BudgetCategoryRelationResponseSerializer(serializers.ModelSerializer):
     category = BudgetCategoryResponseSerializer()
 
 
+class BudgetCategoryRelationPlannedTotalResponseSerializer(BudgetCategoryRelationResponseSerializer):
+    class Meta(BudgetCategoryRelationResponseSerializer.Meta):
+        fields = BudgetCategoryRelationResponseSerializer.Meta.fields + [
+            'planned_total',
+        ]
+
+    # Annotated by BudgetCategoryRelationQuerySet.with_planned_total()
+    planned_total = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+
+
 class BudgetCategoryRelationBulkUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = BudgetCategoryRelation
@@ -87,6 +146,8 @@ class BudgetCategoryRelationBulkUpdateSerializer(serializers.ModelSerializer):
 
     # Need to manually set this, by default ID is readonly
     id = serializers.IntegerField(required=False)
+    # Categories are looked up all at once by the view, rather than one query per relation
+    category = serializers.IntegerField()
 
 
 class BudgetCategoryRelationsBulkUpdateSerializer(serializers.Serializer):
@@ -96,3 +157,69 @@ class BudgetCategoryRelationsBulkUpdateSerializer(serializers.Serializer):
         ]
 
     category_relations = BudgetCategoryRelationBulkUpdateSerializer(many=True)
+
+
+class PlannedActualSpendingSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'category',
+            'planned_amount',
+            'actual_amount',
+        ]
+
+    category = BudgetCategoryResponseSerializer()
+    planned_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    actual_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class BudgetDashboardCategoryRelationSerializer(PlannedActualSpendingSerializer):
+    class Meta:
+        fields = [
+            'id',
+            'category',
+            'amount',
+            'is_percentage',
+            'planned_amount',
+            'actual_amount',
+            'remaining_amount',
+            'expected_amount',
+            'daily_allowance',
+            'remaining_daily_allowance',
+        ]
+
+    id = serializers.IntegerField(source='category_relation.pk')
+    amount = serializers.DecimalField(source='category_relation.amount', max_digits=12, decimal_places=2)
+    is_percentage = serializers.BooleanField(source='category_relation.is_percentage')
+    remaining_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    # Planned spending up to now, if spending were spread evenly across the budget
+    expected_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    daily_allowance = serializers.DecimalField(max_digits=14, decimal_places=2, allow_null=True)
+    # Remaining amount per remaining day of the budget
+    remaining_daily_allowance = serializers.DecimalField(max_digits=14, decimal_places=2, allow_null=True)
+
+
+class BudgetDashboardSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'budget',
+            'category_relations',
+            'planned_amount',
+            'actual_amount',
+            'remaining_amount',
+            'expected_amount',
+            'elapsed_days',
+            'remaining_days',
+            'total_actual_amount',
+        ]
+
+    budget = BudgetResponseSerializer()
+    category_relations = BudgetDashboardCategoryRelationSerializer(many=True)
+    # Totals over the budget's category relations
+    planned_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    actual_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    remaining_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expected_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    elapsed_days = serializers.IntegerField()
+    remaining_days = serializers.IntegerField()
+    # Every expense within the budget's time window, including categories the budget doesn't plan for
+    total_actual_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from budgets.catalogue import category_catalogue
+from budgets.models import Budget, BudgetCategory, BudgetCategoryRelation
+from utils.caching import CATALOGUE_SCOPE, bump_data_version, bump_user_data_version, get_budget_scope
+
+
+@receiver(post_save, sender=BudgetCategory)
+@receiver(post_delete, sender=BudgetCategory)
+def invalidate_category_catalogue(sender, **kwargs):
+    category_catalogue.invalidate()
+    bump_data_version(CATALOGUE_SCOPE)
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def invalidate_cached_budget_responses(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_data_version(get_budget_scope(instance.pk))
+        bump_user_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=BudgetCategoryRelation)
+@receiver(post_delete, sender=BudgetCategoryRelation)
+def invalidate_cached_category_relation_responses(sender, instance, raw=False, origin=None, **kwargs):
+    if raw:
+        return
+    bump_data_version(get_budget_scope(instance.budget_id))
+    if BudgetCategoryRelation.budget.is_cached(instance):
+        user_id = instance.budget.user_id
+    elif isinstance(origin, Budget) and origin.pk == instance.budget_id:
+        # Deleted along with its budget, whose owner is known
+        user_id = origin.user_id
+    else:
+        user_id = Budget.objects.filter(pk=instance.budget_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        bump_user_data_version(user_id)
@@ -1,13 +1,30 @@
-from datetime import datetime
-from django.test import TestCase
+import json
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.test import AsyncRequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import force_authenticate
 
+from budgets.catalogue import category_catalogue
 from budgets.models import Budget, BudgetCategory, BudgetCategoryRelation
+from budgets.projections import get_budget_projection, project_budgets
+from budgets.serializers import BudgetResponseSerializer, compiled_budget_response_serializer
+from budgets.views import AsyncBudgetDashboardView, AsyncBudgetDetailView
+from expenses.models import Expense
 
 from users.models import User
+from utils.caching import CATALOGUE_SCOPE, bump_data_version
 from utils.choices import TimeInterval
+from utils.testing import benchmark, report, shared_cache, time_call
 
 
 class BudgetTests(TestCase):
@@ -66,6 +83,9 @@ class BudgetTests(TestCase):
             is_percentage=True
         )
 
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+
     def test_create_budget_valid(self):
         self.client.login(username='user1', password='password1')
         response = self.client.post(
@@ -120,6 +140,32 @@ class BudgetTests(TestCase):
         self.assertEqual(response.json()['count'], 1) # Only 1 budget owned by user 1
         self.assertEqual(response.json()['results'][0]['id'], self.budget1.pk)
 
+    def test_list_budgets_keyset_pagination(self):
+        Budget.objects.bulk_create([
+            Budget(
+                name=f'Budget {i}',
+                start_time=self.budget1.start_time,
+                # Pairs of budgets share an end time, so pages have to break ties by ID
+                end_time=self.budget1.end_time - timedelta(days=i // 2),
+                interval=TimeInterval.MONTHLY,
+                income=1000,
+                user=self.user1,
+            ) for i in range(24)
+        ])
+        self.client.login(username='user1', password='password1')
+        url = reverse('budget_list') + '?cursor='
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.json())
+            ids += [budget['id'] for budget in response.json()['results']]
+            url = response.json()['next']
+        expected_ids = list(
+            Budget.objects.filter(user=self.user1).order_by('-end_time', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected_ids)
+
     def test_list_budgets_unauthorized(self):
         response = self.client.get(
             reverse('budget_list')
@@ -219,6 +265,104 @@ class BudgetTests(TestCase):
         )
         self.assertEqual(response.json()['count'], 1)
 
+    def test_list_budget_categories_from_catalogue(self):
+        self.client.login(username='user1', password='password1')
+        self.client.get(reverse('budget_category_list'))  # Warm the catalogue
+        # session + user, but no query for the categories themselves
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('budget_category_list'),
+                {
+                    'search': 'CATEGORY x'
+                }
+            )
+        self.assertEqual(response.json()['count'], 0)  # Every term has to match
+        response = self.client.get(
+            reverse('budget_category_list'),
+            {
+                'search': 'gory2'
+            }
+        )
+        self.assertEqual(response.json()['results'][0]['id'], self.budget_category2.pk)
+
+    def test_list_budget_categories_not_modified(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(
+            reverse('budget_category_list')
+        )
+        etag = response.headers['ETag']
+        response = self.client.get(
+            reverse('budget_category_list'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Different query parameters mean a different response
+        response = self.client.get(
+            reverse('budget_category_list'),
+            {
+                'search': 'category1'
+            },
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # So does any change to the catalogue
+        BudgetCategory.objects.create(name='category4')
+        response = self.client.get(
+            reverse('budget_category_list'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 4)
+        category_catalogue.invalidate()  # The new category is rolled back after this test
+
+    def test_category_catalogue_lookups(self):
+        self.assertEqual(category_catalogue.get(self.budget_category3.pk), self.budget_category3)
+        self.assertEqual(category_catalogue.get_by_name(' Category1'), self.budget_category1)
+        self.assertIsNone(category_catalogue.get_by_name('category4'))
+
+        self.budget_category3.name = 'renamed'
+        self.budget_category3.save()
+        self.assertEqual(category_catalogue.get(self.budget_category3.pk).name, 'renamed')
+        self.budget_category3.delete()
+        self.assertIsNone(category_catalogue.get(self.budget_category3.pk))
+        # Bulk writes don't send signals, but still invalidate the catalogue
+        [category4] = BudgetCategory.objects.bulk_create([BudgetCategory(name='category4')])
+        self.assertEqual(category_catalogue.get_by_name('category4'), category4)
+        category4.name = 'category5'
+        BudgetCategory.objects.bulk_update([category4], ['name'])
+        self.assertEqual(category_catalogue.get(category4.pk).name, 'category5')
+        category_catalogue.invalidate()
+
+    def test_category_catalogue_max_age(self):
+        category_catalogue.all()
+        # Renamed through another process, which only invalidates its own catalogue
+        BudgetCategory.objects.filter(pk=self.budget_category3.pk).update(name='renamed')
+        self.assertEqual(category_catalogue.get(self.budget_category3.pk).name, 'category3')
+        with override_settings(CATEGORY_CATALOGUE_MAX_AGE=0):
+            self.assertEqual(category_catalogue.get(self.budget_category3.pk).name, 'renamed')
+        category_catalogue.invalidate()  # The rename is rolled back after this test
+
+    def test_create_budget_category_relation_category_missing_from_catalogue(self):
+        category_catalogue.all()
+        # Created through another process, which only invalidates its own catalogue
+        [budget_category4] = BudgetCategory.objects.get_queryset().bulk_create([BudgetCategory(name='category4')])
+        self.client.login(username='user1', password='password1')
+        response = self.client.post(
+            reverse('budget_category_relation_list'),
+            {
+                'budget': self.budget1.pk,
+                'category': budget_category4.pk,
+                'amount': 375,
+                'is_percentage': False,
+            },
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(category_catalogue.get(budget_category4.pk), budget_category4)
+        category_catalogue.invalidate()  # The new category is rolled back after this test
+
     def test_create_budget_category_relation_duplicate(self):
         self.client.login(username='user1', password='password1')
         response = self.client.post(
@@ -247,6 +391,22 @@ class BudgetTests(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_create_budget_category_relation_invalid_budget(self):
+        self.client.login(username='user1', password='password1')
+        for budget in (None, 'abc', self.budget2.pk + 1000):
+            with self.subTest(budget=budget):
+                response = self.client.post(
+                    reverse('budget_category_relation_list'),
+                    {
+                        'budget': budget,
+                        'category': self.budget_category1.pk,
+                        'amount': 375,
+                        'is_percentage': False,
+                    },
+                    'application/json'
+                )
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_create_budget_category_relation_ok(self):
         self.client.login(username='user2', password='password2')
         response = self.client.post(
@@ -390,6 +550,78 @@ class BudgetTests(TestCase):
         self.assertEqual(category_relation.is_percentage, True)
         self.assertNotEqual(category_relation.pk, self.budget_category_relation1.pk)
 
+    def test_bulk_update_invalid_category(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.patch(
+            reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+            {
+                'category_relations': [
+                    {
+                        'category': self.budget_category1.pk,
+                        'amount': 35,
+                        'is_percentage': True,
+                    },
+                    {
+                        'category': 0,
+                        'amount': 35,
+                        'is_percentage': True,
+                    },
+                ]
+            },
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Nothing changed
+        self.assertEqual(
+            list(BudgetCategoryRelation.objects.filter(budget=self.budget1)),
+            [self.budget_category_relation1]
+        )
+
+    def test_bulk_update_duplicate_category(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.patch(
+            reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+            {
+                'category_relations': [
+                    {
+                        'category': self.budget_category2.pk,
+                        'amount': 35,
+                        'is_percentage': True,
+                    },
+                    {
+                        'category': self.budget_category2.pk,
+                        'amount': 40,
+                        'is_percentage': True,
+                    },
+                ]
+            },
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(BudgetCategoryRelation.objects.filter(budget=self.budget1).count(), 1)
+
+    def test_bulk_update_cant_touch_other_budgets_relations(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.patch(
+            reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+            {
+                'category_relations': [
+                    {
+                        'category': self.budget_category2.pk,
+                        'amount': 1,
+                        'is_percentage': False,
+                        'id': self.budget_category_relation2.pk,  # Belongs to budget 2
+                    },
+                ]
+            },
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.budget_category_relation2.refresh_from_db()
+        self.assertEqual(self.budget_category_relation2.budget, self.budget2)
+        self.assertEqual(float(self.budget_category_relation2.amount), 17.6)
+        self.assertEqual(BudgetCategoryRelation.objects.get(budget=self.budget1).category, self.budget_category2)
+
     def test_get_planned_actual_spending_valid(self):
         self.client.login(username='user1', password='password1')
         response = self.client.get(reverse('planned_actual_spending', kwargs={
@@ -397,6 +629,88 @@ class BudgetTests(TestCase):
         }))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def create_spending_budget(self):
+        budget = Budget.objects.create(
+            name='August',
+            start_time=datetime(2023, 8, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 8, 31, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=self.user1,
+        )
+        BudgetCategoryRelation.objects.create(
+            budget=budget,
+            category=self.budget_category1,
+            amount=10,
+            is_percentage=True
+        )
+        BudgetCategoryRelation.objects.create(
+            budget=budget,
+            category=self.budget_category2,
+            amount=500,
+            is_percentage=False
+        )
+        for user, timestamp, amount in [
+            (self.user1, datetime(2023, 8, 5, tzinfo=timezone.utc), 20),
+            (self.user1, datetime(2023, 8, 31, tzinfo=timezone.utc), 5.5),
+            (self.user1, datetime(2023, 7, 31, tzinfo=timezone.utc), 100),  # Before the budget
+            (self.user2, datetime(2023, 8, 5, tzinfo=timezone.utc), 7),  # Someone else's
+        ]:
+            Expense.objects.create(
+                category=self.budget_category1,
+                timestamp=timestamp,
+                amount=amount,
+                user=user,
+            )
+        return budget
+
+    def test_get_planned_actual_spending_csv(self):
+        budget = self.create_spending_budget()
+        self.client.login(username='user1', password='password1')
+        # session + user + budget + spending
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('planned_actual_spending', kwargs={
+                'pk': budget.pk
+            }))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response.content.decode().splitlines(), [
+            'Category,Planned ($),Actual ($)',
+            # Reverse alphabetical order
+            'category2,500.00,0.00',
+            'category1,300.00,25.50',
+        ])
+
+    def test_get_planned_actual_spending_json(self):
+        budget = self.create_spending_budget()
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('planned_actual_spending', kwargs={
+            'pk': budget.pk
+        }), {'format': 'json'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {
+                'category': {
+                    'name': 'category2',
+                    'typical_percentage': '26.75',
+                    'typical_monthly_amount': None,
+                    'id': self.budget_category2.pk,
+                },
+                'planned_amount': '500.00',
+                'actual_amount': '0.00',
+            },
+            {
+                'category': {
+                    'name': 'category1',
+                    'typical_percentage': '15.50',
+                    'typical_monthly_amount': '400.00',
+                    'id': self.budget_category1.pk,
+                },
+                'planned_amount': '300.00',
+                'actual_amount': '25.50',
+            },
+        ])
+
     def test_cant_get_planned_actual_spending_other_users_budget(self):
         self.client.login(username='user2', password='password2')
         response = self.client.get(reverse('planned_actual_spending', kwargs={
@@ -409,3 +723,1027 @@ class BudgetTests(TestCase):
             'pk': self.budget1.pk
         }))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_budget_dashboard(self):
+        budget = self.create_spending_budget()
+        # Counts towards the total, but the budget has no relation for the category
+        Expense.objects.create(
+            category=self.budget_category3,
+            timestamp=datetime(2023, 8, 10, tzinfo=timezone.utc),
+            amount=4,
+            user=self.user1,
+        )
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('budget_dashboard', kwargs={
+            'pk': budget.pk
+        }))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['budget']['id'], budget.pk)
+        self.assertEqual(response.json()['budget']['user']['username'], 'user1')
+        self.assertEqual([
+            (
+                category_relation['category']['name'],
+                category_relation['amount'],
+                category_relation['is_percentage'],
+                category_relation['planned_amount'],
+                category_relation['actual_amount'],
+            ) for category_relation in response.json()['category_relations']
+        ], [
+            ('category1', '10.00', True, '300.00', '25.50'),
+            ('category2', '500.00', False, '500.00', '0.00'),
+        ])
+        self.assertEqual(response.json()['planned_amount'], '800.00')
+        self.assertEqual(response.json()['actual_amount'], '25.50')
+        self.assertEqual(response.json()['total_actual_amount'], '29.50')
+        # The budget is over, so all of it should have been spent by now
+        self.assertEqual(response.json()['remaining_days'], 0)
+        self.assertEqual(response.json()['expected_amount'], '800.00')
+        self.assertEqual(response.json()['remaining_amount'], '774.50')
+        self.assertEqual(response.json()['category_relations'][0]['remaining_daily_allowance'], None)
+        self.assertEqual(response.json()['category_relations'][0]['daily_allowance'], '10.00')
+
+    def test_get_budget_dashboard_query_count_constant(self):
+        budget = self.create_spending_budget()
+        self.client.login(username='user1', password='password1')
+        for category_count in (2, 10, 30):
+            for i in range(budget.categories.count(), category_count):
+                category = BudgetCategory.objects.create(name=f'dashboard category {i}')
+                BudgetCategoryRelation.objects.create(budget=budget, category=category, amount=i, is_percentage=False)
+                Expense.objects.create(
+                    category=category,
+                    timestamp=datetime(2023, 8, 10, tzinfo=timezone.utc),
+                    amount=i,
+                    user=self.user1,
+                )
+            # session + user + budget (with its user) + relations with spending + total spending
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('budget_dashboard', kwargs={
+                    'pk': budget.pk
+                }))
+            self.assertEqual(len(response.json()['category_relations']), category_count)
+
+    def test_cant_get_other_users_budget_dashboard(self):
+        self.client.login(username='user2', password='password2')
+        response = self.client.get(reverse('budget_dashboard', kwargs={
+            'pk': self.budget1.pk
+        }))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_budget_dashboard_unauthorized(self):
+        response = self.client.get(reverse('budget_dashboard', kwargs={
+            'pk': self.budget1.pk
+        }))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BudgetCategoryAutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.insurance = BudgetCategory.objects.create(name='Insurance')
+        cls.home_insurance = BudgetCategory.objects.create(name='Home insurance')
+        cls.car_insurance = BudgetCategory.objects.create(name='Car Insurance')
+        cls.home_repairs = BudgetCategory.objects.create(name='Home repairs')
+        cls.internet = BudgetCategory.objects.create(name='Internet')
+
+    def setUp(self):
+        category_catalogue.invalidate()  # Categories are rolled back after each test
+        self.client.login(username='user1', password='password1')
+
+    def autocomplete(self, q, **params):
+        response = self.client.get(reverse('budget_category_autocomplete'), {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [category['name'] for category in response.json()]
+
+    def test_autocomplete_word_prefixes(self):
+        # Names starting with the query first, then alphabetically
+        self.assertEqual(self.autocomplete('ins'), ['Insurance', 'Car Insurance', 'Home insurance'])
+        self.assertEqual(self.autocomplete('IN'), ['Insurance', 'Internet', 'Car Insurance', 'Home insurance'])
+        self.assertEqual(self.autocomplete('home'), ['Home insurance', 'Home repairs'])
+        self.assertEqual(self.autocomplete('surance'), [])
+        self.assertEqual(self.autocomplete(''), [])
+
+    def test_autocomplete_every_word(self):
+        self.assertEqual(self.autocomplete('home ins'), ['Home insurance'])
+        self.assertEqual(self.autocomplete('ins  ho'), ['Home insurance'])
+        self.assertEqual(self.autocomplete('car rep'), [])
+
+    def test_autocomplete_limit(self):
+        self.assertEqual(self.autocomplete('i', limit=2), ['Insurance', 'Internet'])
+        response = self.client.get(reverse('budget_category_autocomplete'), {'q': 'i', 'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_from_catalogue(self):
+        self.autocomplete('ins')  # Warm the catalogue
+        # session + user, but no query for the categories themselves
+        with self.assertNumQueries(2):
+            self.assertEqual(self.autocomplete('car'), ['Car Insurance'])
+        # The index is rebuilt when the catalogue changes
+        self.car_insurance.name = 'Vehicle insurance'
+        self.car_insurance.save()
+        self.assertEqual(self.autocomplete('car'), [])
+        self.assertEqual(self.autocomplete('veh'), ['Vehicle insurance'])
+
+    def test_autocomplete_unauthorized(self):
+        self.client.logout()
+        response = self.client.get(reverse('budget_category_autocomplete'), {'q': 'ins'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@benchmark
+class BudgetCategoryAutocompleteBenchmarkTests(TestCase):
+    """
+    Compares autocompleting from the catalogue's prefix index and querying the
+    database the way SearchFilter does, over a large catalogue
+    """
+    CATEGORY_COUNT = 10_000
+
+    @classmethod
+    def setUpTestData(cls):
+        words = ['home', 'car', 'insurance', 'food', 'gas', 'travel', 'health', 'gifts', 'savings', 'utilities']
+        BudgetCategory.objects.bulk_create(
+            BudgetCategory(name=f'{words[i % 10]} {words[i // 10 % 10]} {i}') for i in range(cls.CATEGORY_COUNT)
+        )
+
+    def test_benchmark_autocomplete(self):
+        category_catalogue.invalidate()
+        self.assertEqual(len(category_catalogue.autocomplete('trav heal', limit=50)), 50)
+        index_seconds = time_call(category_catalogue.autocomplete, 'trav heal', repeat=100)
+        database_seconds = time_call(
+            lambda: list(BudgetCategory.objects.filter(name__icontains='trav').filter(name__icontains='heal')[:10]),
+            repeat=100
+        )
+        report(
+            'budget category autocomplete',
+            index_us=f'{index_seconds * 1_000_000:.1f}',
+            database_us=f'{database_seconds * 1_000_000:.1f}',
+        )
+        category_catalogue.invalidate()
+
+
+class BudgetQueryCountTests(TestCase):
+    """
+    Query budgets for every budgets endpoint. List endpoints must not issue more
+    queries as they return more objects (no N+1 lookups of related objects).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=datetime(2023, 1, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 12, 31, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=5000,
+            user=cls.user1,
+        )
+        cls.budget_categories = [
+            BudgetCategory.objects.create(name=f'category{i}') for i in range(20)
+        ]
+        cls.budget_category_relation1 = BudgetCategoryRelation.objects.create(
+            budget=cls.budget1,
+            category=cls.budget_categories[0],
+            amount=100,
+            is_percentage=False,
+        )
+
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+        self.client.login(username='user1', password='password1')
+
+    def create_budgets(self, count):
+        budgets = Budget.objects.bulk_create([
+            Budget(
+                name=f'Budget {i}',
+                start_time=self.budget1.start_time,
+                end_time=self.budget1.end_time,
+                interval=TimeInterval.MONTHLY,
+                income=1000,
+                user=self.user1,
+            ) for i in range(count)
+        ])
+        # Each budget gets a different category, so relations can't share cached objects
+        BudgetCategoryRelation.objects.bulk_create([
+            BudgetCategoryRelation(
+                budget=budget,
+                category=self.budget_categories[(i + 1) % len(self.budget_categories)],
+                amount=10,
+                is_percentage=True,
+            ) for i, budget in enumerate(budgets)
+        ])
+
+    def test_list_budgets(self):
+        created = 1
+        for budget_count in (1, 5, 20):
+            self.create_budgets(budget_count - created)
+            created = budget_count
+            # session + user + count + page
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('budget_list'))
+            self.assertEqual(len(response.json()['results']), budget_count)
+            # session + user + page
+            with self.assertNumQueries(3):
+                self.client.get(reverse('budget_list'), {'cursor': ''})
+
+    def test_create_budget(self):
+        # session + user + user lookup + insert
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('budget_list'), {
+                'name': 'New Budget',
+                'start_time': '2023-01-01T00:00:00Z',
+                'end_time': '2023-12-31T00:00:00Z',
+                'interval': TimeInterval.WEEKLY,
+                'income': 1100,
+            }, 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_retrieve_update_delete_budget(self):
+        url = reverse('budget_detail', kwargs={'pk': self.budget1.pk})
+        # session + user + budget (with its user)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        # session + user + budget + update
+        with self.assertNumQueries(4):
+            self.client.patch(url, {'income': 575}, 'application/json')
+        # session + user + budget + relations (for their signals) + delete relations + delete budget
+        with self.assertNumQueries(6):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_budget_dashboard_and_spending_export(self):
+        # session + user + budget (with its user) + relations with spending + total spending
+        with self.assertNumQueries(5):
+            self.client.get(reverse('budget_dashboard', kwargs={'pk': self.budget1.pk}))
+        # session + user + budget + relations with spending
+        with self.assertNumQueries(4):
+            self.client.get(reverse('planned_actual_spending', kwargs={'pk': self.budget1.pk}))
+
+    def test_bulk_update_category_relations(self):
+        # session + user + budget + categories + savepoint + relations to delete (for their signals)
+        # + delete + upsert + release savepoint
+        with self.assertNumQueries(9):
+            response = self.client.patch(
+                reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+                {'category_relations': [
+                    {'category': category.pk, 'amount': 10, 'is_percentage': False}
+                    for category in self.budget_categories
+                ]},
+                'application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_budget_categories(self):
+        category_catalogue.all()  # Categories are served from the catalogue once it's loaded
+        # session + user
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('budget_category_list'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('budget_category_list'), HTTP_IF_NONE_MATCH=response.headers['ETag'])
+
+    def test_list_category_relations(self):
+        created = 1
+        for relation_count in (1, 5, 20):
+            self.create_budgets(relation_count - created)
+            created = relation_count
+            # session + user + count + page (with budgets, their users and categories)
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('budget_category_relation_list'))
+            self.assertEqual(len(response.json()['results']), relation_count)
+
+    def test_create_category_relation(self):
+        category_catalogue.all()
+        # session + user + budget ownership + budget (with its user) + unique check + insert
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('budget_category_relation_list'), {
+                'budget': self.budget1.pk,
+                'category': self.budget_categories[1].pk,
+                'amount': 50,
+                'is_percentage': False,
+            }, 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_retrieve_update_delete_category_relation(self):
+        url = reverse('budget_category_relation_detail', kwargs={'pk': self.budget_category_relation1.pk})
+        # session + user + relation (with its budget, budget's user and category)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        # session + user + relation + unique check + update
+        with self.assertNumQueries(5):
+            self.client.patch(url, {'amount': 75}, 'application/json')
+        # session + user + relation + delete
+        with self.assertNumQueries(4):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+@shared_cache
+class BudgetResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=datetime(2023, 9, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 10, 1, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=cls.user1,
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        cls.budget_category_relation1 = BudgetCategoryRelation.objects.create(
+            budget=cls.budget1,
+            category=cls.budget_category1,
+            amount=300,
+            is_percentage=False,
+        )
+
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+        self.client.login(username='user1', password='password1')
+
+    def get_planned_amounts(self):
+        response = self.client.get(reverse('planned_actual_spending', kwargs={'pk': self.budget1.pk}), {
+            'format': 'json',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(spending['category']['name'], spending['planned_amount']) for spending in response.json()]
+
+    def test_spending_export_cached(self):
+        url = reverse('planned_actual_spending', kwargs={'pk': self.budget1.pk})
+        first_response = self.client.get(url)
+        # session + user + budget (for the permission check)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.content, first_response.content)
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment;filename="spending_comparison.csv"')
+        # JSON is cached separately
+        self.assertEqual(self.get_planned_amounts(), [('category1', '300.00')])
+
+    def test_budget_writes_invalidate_spending_export(self):
+        self.assertEqual(self.get_planned_amounts(), [('category1', '300.00')])
+        self.client.patch(reverse('budget_category_relation_detail', kwargs={
+            'pk': self.budget_category_relation1.pk
+        }), {'amount': 200}, 'application/json')
+        self.assertEqual(self.get_planned_amounts(), [('category1', '200.00')])
+        self.client.patch(reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}), {
+            'category_relations': [
+                {'category': self.budget_category2.pk, 'amount': 10, 'is_percentage': True},
+            ],
+        }, 'application/json')
+        self.assertEqual(self.get_planned_amounts(), [('category2', '300.00')])
+        self.client.patch(reverse('budget_detail', kwargs={'pk': self.budget1.pk}), {
+            'income': 6000,
+        }, 'application/json')
+        self.assertEqual(self.get_planned_amounts(), [('category2', '600.00')])
+        # Categories are part of the export too
+        self.budget_category2.name = 'renamed'
+        self.budget_category2.save()
+        self.assertEqual(self.get_planned_amounts(), [('renamed', '600.00')])
+
+    def test_budget_category_list_cached(self):
+        response = self.client.get(reverse('budget_category_list'))
+        self.assertEqual(response.json()['count'], 2)
+        category_catalogue.invalidate()  # Cached responses don't need the catalogue
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('budget_category_list'))
+        self.assertEqual(response.json()['count'], 2)
+        with self.assertNumQueries(2):
+            not_modified_response = self.client.get(
+                reverse('budget_category_list'), HTTP_IF_NONE_MATCH=response.headers['ETag']
+            )
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        BudgetCategory.objects.create(name='category3')
+        response = self.client.get(reverse('budget_category_list'))
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_category_changes_through_other_processes(self):
+        self.assertEqual(self.client.get(reverse('budget_category_list')).json()['results'][0]['name'], 'category1')
+        # Another process renames a category: it invalidates its own catalogue and
+        # bumps the shared version, but this process's catalogue is left as it was
+        BudgetCategory.objects.filter(pk=self.budget_category1.pk).update(name='renamed')
+        bump_data_version(CATALOGUE_SCOPE)
+        # Otherwise the stale catalogue would be cached under the new version
+        response = self.client.get(reverse('budget_category_list'))
+        self.assertEqual(response.json()['results'][1]['name'], 'renamed')
+        self.assertEqual(category_catalogue.get(self.budget_category1.pk).name, 'renamed')
+        category_catalogue.invalidate()  # The rename is rolled back after this test
+
+
+@shared_cache
+class BudgetConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=datetime(2023, 9, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 10, 1, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=cls.user1,
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        cls.budget_category_relation1 = BudgetCategoryRelation.objects.create(
+            budget=cls.budget1,
+            category=cls.budget_category1,
+            amount=300,
+            is_percentage=False,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='user1', password='password1')
+
+    def assertModified(self, url, etag, modified=True):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK if modified else status.HTTP_304_NOT_MODIFIED
+        )
+        return response.headers['ETag']
+
+    def test_budget_list_not_modified(self):
+        url = reverse('budget_list')
+        etag = self.client.get(url).headers['ETag']
+        # session + user, and no budgets
+        with self.assertNumQueries(2):
+            self.assertModified(url, etag, modified=False)
+        self.client.patch(reverse('budget_detail', kwargs={'pk': self.budget1.pk}), {
+            'income': 6000,
+        }, 'application/json')
+        etag = self.assertModified(url, etag)
+        self.assertModified(url, etag, modified=False)
+
+    def test_relation_writes_change_etag(self):
+        urls = [
+            reverse('budget_list'),
+            reverse('budget_detail', kwargs={'pk': self.budget1.pk}),
+            reverse('budget_category_relation_list'),
+            reverse('budget_category_relation_detail', kwargs={'pk': self.budget_category_relation1.pk}),
+            reverse('planned_actual_spending', kwargs={'pk': self.budget1.pk}),
+        ]
+        etags = [self.client.get(url).headers['ETag'] for url in urls]
+        self.assertEqual(len(set(etags)), len(urls))
+        self.client.patch(reverse('budget_category_relation_detail', kwargs={
+            'pk': self.budget_category_relation1.pk
+        }), {'amount': 200}, 'application/json')
+        etags = [self.assertModified(url, etag) for url, etag in zip(urls, etags)]
+        self.client.patch(reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}), {
+            'category_relations': [
+                {'category': self.budget_category2.pk, 'amount': 10, 'is_percentage': True},
+            ],
+        }, 'application/json')
+        self.assertModified(urls[0], etags[0])
+
+    def test_budget_delete_changes_etag(self):
+        url = reverse('budget_list')
+        etag = self.client.get(url).headers['ETag']
+        self.client.delete(reverse('budget_detail', kwargs={'pk': self.budget1.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [])
+
+
+class BudgetCompiledSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        now = timezone.now()
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            description='Monthly budget',
+            start_time=now - timedelta(days=10),
+            end_time=now + timedelta(days=20),
+            interval=TimeInterval.MONTHLY,
+            income=Decimal('3000.50'),
+            user=cls.user1,
+        )
+        cls.budget2 = Budget.objects.create(
+            name='Budget 2',
+            start_time=now - timedelta(days=400),
+            end_time=now - timedelta(days=35),
+            interval=TimeInterval.YEARLY,
+            income=40000,
+            user=cls.user1,
+        )
+
+    def test_same_json_as_serializer(self):
+        queryset = Budget.objects.select_related('user').order_by('id')
+        expected = JSONRenderer().render(BudgetResponseSerializer(queryset, many=True).data)
+        rows = compiled_budget_response_serializer.get_values_queryset(queryset)
+        self.assertEqual(JSONRenderer().render(compiled_budget_response_serializer.serialize(rows)), expected)
+
+    def test_list_same_json_as_serializer(self):
+        self.client.login(username='user1', password='password1')
+        queryset = Budget.objects.select_related('user')
+        for params, expected_data in [
+            ({}, BudgetResponseSerializer(queryset, many=True).data),
+            ({'cursor': ''}, BudgetResponseSerializer(queryset.order_by('-end_time', '-id'), many=True).data),
+        ]:
+            response = self.client.get(reverse('budget_list'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Decimals are rendered as strings, so the results can be rendered again as they were
+            self.assertEqual(JSONRenderer().render(response.json()['results']), JSONRenderer().render(expected_data))
+
+
+class AsyncBudgetViewTests(TestCase):
+    """
+    The async views serve the same responses as the sync ones (the test client
+    is routed to whichever settings.ASYNC_READ_VIEWS selects)
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        now = timezone.now()
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=now - timedelta(days=10),
+            end_time=now + timedelta(days=20),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=cls.user1,
+        )
+        cls.budget2 = Budget.objects.create(
+            name='Budget 2',
+            start_time=now - timedelta(days=10),
+            end_time=now + timedelta(days=20),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=cls.user2,
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        BudgetCategoryRelation.objects.create(
+            budget=cls.budget1, category=cls.budget_category1, amount=300, is_percentage=False
+        )
+        BudgetCategoryRelation.objects.create(
+            budget=cls.budget1, category=cls.budget_category2, amount=10, is_percentage=True
+        )
+        Expense.objects.create(
+            name='Expense 1', timestamp=now - timedelta(days=1), category=cls.budget_category1, amount=45,
+            user=cls.user1,
+        )
+        Expense.objects.create(name='Expense 2', timestamp=now, amount=5, user=cls.user1)
+
+    def setUp(self):
+        self.async_client.login(username='user1', password='password1')
+
+    async def assertSameResponses(self, view_class, url_name, pk):
+        url = reverse(url_name, kwargs={'pk': pk})
+        response = await self.async_client.get(url)
+        request = AsyncRequestFactory().get(url)
+        force_authenticate(request, self.user1)
+        async_response = await view_class.as_view()(request, pk=pk)
+        async_response.render()
+        self.assertEqual(async_response.status_code, response.status_code)
+        self.assertEqual(json.loads(async_response.content), response.json())
+        return async_response
+
+    async def test_async_budget_detail(self):
+        response = await self.assertSameResponses(AsyncBudgetDetailView, 'budget_detail', self.budget1.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.assertSameResponses(AsyncBudgetDetailView, 'budget_detail', self.budget2.pk)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.assertSameResponses(AsyncBudgetDetailView, 'budget_detail', 0)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_budget_dashboard(self):
+        response = await self.assertSameResponses(AsyncBudgetDashboardView, 'budget_dashboard', self.budget1.pk)
+        dashboard = json.loads(response.content)
+        self.assertEqual(dashboard['actual_amount'], '45.00')
+        self.assertEqual(dashboard['total_actual_amount'], '50.00')
+        self.assertEqual(len(dashboard['category_relations']), 2)
+        response = await self.assertSameResponses(AsyncBudgetDashboardView, 'budget_dashboard', self.budget2.pk)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BudgetCategoryRelationBulkUpdateTests(TestCase):
+    """
+    Bulk updates of budgets with many (50) category relations
+    """
+    CATEGORY_COUNT = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=datetime.now(tz=timezone.utc),
+            end_time=datetime.now(tz=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=5000,
+            user=cls.user1,
+        )
+        cls.budget_categories = BudgetCategory.objects.bulk_create([
+            BudgetCategory(name=f'category{i}') for i in range(cls.CATEGORY_COUNT)
+        ])
+        # Budget starts out with relations for half of the categories
+        cls.budget_category_relations = BudgetCategoryRelation.objects.bulk_create([
+            BudgetCategoryRelation(
+                budget=cls.budget1,
+                category=category,
+                amount=10,
+                is_percentage=False,
+            ) for category in cls.budget_categories[::2]
+        ])
+
+    def get_bulk_update_data(self, category_count):
+        relation_ids = {relation.category_id: relation.pk for relation in self.budget_category_relations}
+        category_relations = []
+        for i, category in enumerate(self.budget_categories[:category_count]):
+            category_relation_data = {
+                'category': category.pk,
+                'amount': 100 + i,
+                'is_percentage': False,
+            }
+            if category.pk in relation_ids:
+                category_relation_data['id'] = relation_ids[category.pk]
+            category_relations.append(category_relation_data)
+        return {'category_relations': category_relations}
+
+    def bulk_update(self, category_count):
+        return self.client.patch(
+            reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+            self.get_bulk_update_data(category_count),
+            'application/json'
+        )
+
+    def test_bulk_update_many_categories(self):
+        self.client.login(username='user1', password='password1')
+        response = self.bulk_update(self.CATEGORY_COUNT)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        category_relations = BudgetCategoryRelation.objects.filter(budget=self.budget1)
+        self.assertEqual(category_relations.count(), self.CATEGORY_COUNT)
+        for i, category in enumerate(self.budget_categories):
+            self.assertEqual(category_relations.get(category=category).amount, 100 + i)
+        # Relations that were sent with their IDs were updated in place
+        kept_ids = {relation.pk for relation in self.budget_category_relations}
+        self.assertEqual(category_relations.filter(pk__in=kept_ids).count(), len(kept_ids))
+
+    def test_bulk_update_query_count_constant(self):
+        self.client.login(username='user1', password='password1')
+        # Every update starts from the same relations, and leaves some of them out
+        for category_count in (1, 10, self.CATEGORY_COUNT - 10):
+            with transaction.atomic():
+                # session + user + budget + categories + savepoint + relations to delete (for their
+                # signals) + delete + upsert + release savepoint
+                with self.assertNumQueries(9):
+                    response = self.bulk_update(category_count)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                transaction.set_rollback(True)
+
+    @benchmark
+    def test_bulk_update_benchmark(self):
+        self.client.login(username='user1', password='password1')
+        data = self.get_bulk_update_data(self.CATEGORY_COUNT)
+        seconds = time_call(
+            self.client.patch,
+            reverse('budget_category_relation_bulk_update', kwargs={'pk': self.budget1.pk}),
+            data,
+            'application/json',
+            repeat=20,
+        )
+        report('bulk update, 50 categories', ms_per_request=f'{seconds * 1000:.2f}')
+
+
+def get_actual_spending_by_category_correlated(expenses_queryset):
+    """
+    The original implementation of BudgetCategoriesManager.get_actual_spending_by_category,
+    which runs a correlated subquery for every category. Kept as a baseline.
+    """
+    return BudgetCategory.objects.annotate(
+        total_amount=Coalesce(
+            Subquery(
+                expenses_queryset.filter(
+                    category_id=OuterRef('id')
+                )
+                .values('category_id')
+                .annotate(total=Sum('amount'))
+                .values('total'),
+                output_field=FloatField()
+            ),
+            0,
+            output_field=FloatField()
+        )
+    ).values('id', 'total_amount').order_by('-total_amount')
+
+
+class BudgetProjectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        cls.budget1 = Budget.objects.create(
+            name='Budget 1',
+            start_time=datetime(2023, 9, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 10, 1, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=3000,
+            user=cls.user1,
+        )
+        cls.budget2 = Budget.objects.create(
+            name='Budget 2',
+            start_time=datetime(2023, 1, 1, tzinfo=timezone.utc),
+            end_time=datetime(2023, 1, 2, tzinfo=timezone.utc),
+            interval=TimeInterval.MONTHLY,
+            income=1000,
+            user=cls.user1,
+        )
+        BudgetCategoryRelation.objects.create(
+            budget=cls.budget1, category=cls.budget_category1, amount=300, is_percentage=False
+        )
+        BudgetCategoryRelation.objects.create(
+            budget=cls.budget1, category=cls.budget_category2, amount=5, is_percentage=True
+        )
+        # 0.15 for one day of a 30 day interval is exactly half a cent
+        BudgetCategoryRelation.objects.create(
+            budget=cls.budget2, category=cls.budget_category1, amount=0.15, is_percentage=False
+        )
+        Expense.objects.create(
+            category=cls.budget_category1,
+            timestamp=datetime(2023, 9, 5, tzinfo=timezone.utc),
+            amount=150,
+            user=cls.user1,
+        )
+
+    def test_project_budgets_in_one_pass(self):
+        category_relations = BudgetCategoryRelation.objects\
+            .filter(budget__user=self.user1)\
+            .select_related('category')\
+            .order_by('budget_id', 'category__name')
+        with self.assertNumQueries(1):
+            projections = project_budgets([self.budget1, self.budget2], category_relations)
+        self.assertEqual(
+            [projection.planned_amount for projection in projections[self.budget1.pk].category_projections],
+            [Decimal('300.00'), Decimal('150.00')]
+        )
+        # Exactly half a cent is rounded up
+        self.assertEqual(projections[self.budget2.pk].planned_amount, Decimal('0.01'))
+        # Relations without an actual_amount annotation haven't spent anything
+        self.assertEqual(projections[self.budget1.pk].actual_amount, 0)
+
+    def test_planned_amounts_match_get_total_amount(self):
+        random.seed(15)
+        for interval in TimeInterval.values:
+            for _ in range(20):
+                budget = Budget(
+                    start_time=datetime(2023, 1, 1, tzinfo=timezone.utc),
+                    end_time=datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(days=random.randint(0, 800)),
+                    interval=interval,
+                    income=Decimal(random.randint(0, 10 ** 7)) / 100,
+                    user=self.user1,
+                    pk=1,
+                )
+                category_relation = BudgetCategoryRelation(
+                    budget=budget,
+                    category=self.budget_category1,
+                    amount=Decimal(random.randint(0, 10 ** 5)) / 100,
+                    is_percentage=random.random() < 0.5,
+                )
+                projection = project_budgets([budget], [category_relation])[budget.pk]
+                self.assertAlmostEqual(
+                    projection.planned_amount,
+                    Decimal(category_relation.get_total_amount()),
+                    delta=Decimal('0.01'),
+                )
+
+    def test_pacing(self):
+        projection = get_budget_projection(self.budget1, now=datetime(2023, 9, 11, 12, tzinfo=timezone.utc))
+        self.assertEqual((projection.elapsed_days, projection.remaining_days), (10, 20))
+        category_projection = projection.category_projections[0]
+        self.assertEqual(category_projection.category, self.budget_category1)
+        self.assertEqual(category_projection.planned_amount, Decimal('300.00'))
+        self.assertEqual(category_projection.actual_amount, Decimal('150.00'))
+        self.assertEqual(category_projection.remaining_amount, Decimal('150.00'))
+        self.assertEqual(category_projection.daily_allowance, Decimal('10.00'))
+        self.assertEqual(category_projection.expected_amount, Decimal('100.00'))
+        self.assertEqual(category_projection.remaining_daily_allowance, Decimal('7.50'))
+        self.assertEqual(projection.expected_amount, Decimal('150.00'))
+
+        # Before the budget starts nothing is expected yet, and after it ends everything is
+        projection = get_budget_projection(self.budget1, now=datetime(2023, 8, 1, tzinfo=timezone.utc))
+        self.assertEqual((projection.elapsed_days, projection.expected_amount), (0, 0))
+        projection = get_budget_projection(self.budget1, now=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual((projection.remaining_days, projection.expected_amount), (0, Decimal('450.00')))
+        self.assertIsNone(projection.category_projections[0].remaining_daily_allowance)
+
+    def test_planned_total_annotation_matches_projections(self):
+        random.seed(16)
+        budgets = []
+        for i in range(60):
+            start_time = datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=random.randint(0, 10 ** 7))
+            budgets.append(Budget.objects.create(
+                name=f'Random budget {i}',
+                start_time=start_time,
+                end_time=start_time + timedelta(seconds=random.randint(0, 10 ** 8)),
+                interval=TimeInterval.values[i % len(TimeInterval.values)],
+                income=Decimal(random.randint(0, 10 ** 7)) / 100,
+                user=self.user1,
+            ))
+            BudgetCategoryRelation.objects.create(
+                budget=budgets[-1],
+                category=self.budget_category1,
+                amount=Decimal(random.randint(0, 10 ** 5)) / 100,
+                is_percentage=i % 2 == 0,
+            )
+        category_relations = list(
+            BudgetCategoryRelation.objects.filter(budget__in=budgets).with_planned_total()
+        )
+        projections = project_budgets(budgets, category_relations)
+        for category_relation in category_relations:
+            self.assertEqual(category_relation.budget.get_duration_days(),
+                             projections[category_relation.budget_id].duration_days)
+            self.assertAlmostEqual(
+                category_relation.planned_total,
+                projections[category_relation.budget_id].planned_amount,
+                delta=Decimal('0.01'),
+            )
+
+    def test_planned_total_in_database(self):
+        category_relations = BudgetCategoryRelation.objects.filter(budget=self.budget1).with_planned_total()
+        self.assertEqual(
+            list(category_relations.order_by('planned_total').values_list('planned_total', flat=True)),
+            [Decimal('150.00'), Decimal('300.00')]
+        )
+        self.assertEqual(category_relations.filter(planned_total__gt=200).get().category, self.budget_category1)
+        self.assertEqual(category_relations.aggregate(total=Sum('planned_total'))['total'], Decimal('450.00'))
+
+    def test_list_category_relations_by_planned_total(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('budget_category_relation_list'), {
+            'budget': self.budget1.pk,
+            'ordering': 'planned_total',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(relation['category']['name'], relation['planned_total']) for relation in response.json()['results']],
+            [('category2', '150.00'), ('category1', '300.00')]
+        )
+        response = self.client.get(reverse('budget_category_relation_list'), {
+            'planned_total__gte': 200,
+        })
+        self.assertEqual([relation['planned_total'] for relation in response.json()['results']], ['300.00'])
+
+    @benchmark
+    def test_benchmark_against_get_total_amount(self):
+        budgets = [
+            Budget(
+                pk=i,
+                start_time=datetime(2023, 1, 1, tzinfo=timezone.utc),
+                end_time=datetime(2023, 12, 31, tzinfo=timezone.utc),
+                interval=TimeInterval.MONTHLY,
+                income=Decimal(5000),
+            ) for i in range(100)
+        ]
+        category_relations = [
+            BudgetCategoryRelation(
+                budget=budget,
+                category=self.budget_category1,
+                amount=Decimal(i % 50),
+                is_percentage=i % 2 == 0,
+            ) for budget in budgets for i in range(100)
+        ]
+        scalar_seconds = time_call(lambda: [
+            round(Decimal(category_relation.get_total_amount()), 2) for category_relation in category_relations
+        ])
+        batched_seconds = time_call(project_budgets, budgets, category_relations)
+        report(
+            f'planned totals, {len(category_relations)} relations',
+            get_total_amount_ms=f'{scalar_seconds * 1000:.1f}',
+            project_budgets_ms=f'{batched_seconds * 1000:.1f}',
+        )
+
+
+class ActualSpendingByCategoryTests(TestCase):
+    CATEGORY_COUNT = 11  # As many as budgetcategories.json
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_categories = BudgetCategory.objects.bulk_create([
+            BudgetCategory(name=f'category{i:02}') for i in range(cls.CATEGORY_COUNT)
+        ])
+        cls.start_time = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        cls.random = random.Random(2204)
+        cls.create_expenses(1000)
+
+    @classmethod
+    def create_expenses(cls, count, batch_size=10000):
+        for batch_start in range(0, count, batch_size):
+            Expense.objects.bulk_create([
+                Expense(
+                    name=f'Expense {i}',
+                    # Leave the last category without expenses, and some expenses uncategorized
+                    category=cls.random.choice(cls.budget_categories[:-1] + [None]),
+                    timestamp=cls.start_time + timedelta(minutes=cls.random.randrange(3 * 365 * 24 * 60)),
+                    amount=cls.random.randrange(1, 100000) / 100,
+                    user=cls.random.choice([cls.user1, cls.user2]),
+                ) for i in range(batch_start, min(batch_start + batch_size, count))
+            ])
+
+    def assertSameSpending(self, expenses_queryset):
+        spending = BudgetCategory.objects.get_actual_spending_by_category(expenses_queryset)
+        # An explicit ordering ends up in the correlated subquery's GROUP BY and breaks its totals
+        correlated_spending = get_actual_spending_by_category_correlated(expenses_queryset.order_by())
+        self.assertEqual(
+            {category_spending['id']: round(category_spending['total_amount'], 2) for category_spending in spending},
+            {category_spending['id']: round(category_spending['total_amount'], 2) for category_spending in correlated_spending},
+        )
+        totals = [category_spending['total_amount'] for category_spending in spending]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        self.assertEqual(len(spending), self.CATEGORY_COUNT)
+        self.assertEqual(spending[-1], {'id': self.budget_categories[-1].pk, 'total_amount': 0})
+
+    def test_same_as_correlated_subquery(self):
+        self.assertSameSpending(Expense.objects.filter(user=self.user1))
+        self.assertSameSpending(Expense.objects.filter(
+            user=self.user2,
+            timestamp__gte=datetime(2021, 3, 1, tzinfo=timezone.utc),
+            amount__lte=500,
+        ).order_by('amount'))
+
+    def test_single_query(self):
+        BudgetCategory.objects.get_actual_spending_by_category(Expense.objects.all())  # Warm the catalogue
+        with self.assertNumQueries(1):
+            BudgetCategory.objects.get_actual_spending_by_category(Expense.objects.filter(user=self.user1))
+
+    def test_category_missing_from_catalogue(self):
+        BudgetCategory.objects.get_actual_spending_by_category(Expense.objects.all())  # Warm the catalogue
+        # Created through another process, which only invalidates its own catalogue
+        [budget_category] = BudgetCategory.objects.get_queryset().bulk_create([BudgetCategory(name='category99')])
+        Expense.objects.create(
+            name='Expense', category=budget_category, timestamp=self.start_time, amount=100000, user=self.user1
+        )
+        spending = BudgetCategory.objects.get_actual_spending_by_category(Expense.objects.filter(user=self.user1))
+        self.assertEqual(spending[0], {'id': budget_category.pk, 'total_amount': 100000})
+        self.assertEqual(len(spending), self.CATEGORY_COUNT + 1)
+        category_catalogue.invalidate()  # The new category is rolled back after this test
+
+    @benchmark
+    def test_benchmark_against_correlated_subquery(self):
+        created = Expense.objects.count()
+        for expense_count in (10000, 100000, 1000000):
+            self.create_expenses(expense_count - created)
+            created = expense_count
+            expenses = Expense.objects.filter(user=self.user1)
+            group_by_seconds = time_call(
+                lambda: BudgetCategory.objects.get_actual_spending_by_category(expenses),
+                repeat=3
+            )
+            correlated_seconds = time_call(
+                lambda: list(get_actual_spending_by_category_correlated(expenses)),
+                repeat=3
+            )
+            report(
+                f'actual spending by category, {expense_count} expenses',
+                group_by_ms=f'{group_by_seconds * 1000:.1f}',
+                correlated_subquery_ms=f'{correlated_seconds * 1000:.1f}',
+            )
@@ -1,16 +1,30 @@
-import csv
+import hashlib
+from decimal import Decimal
 
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema
-from rest_framework import generics, permissions, status, views
-from rest_framework.filters import SearchFilter
+from rest_framework import generics, permissions, serializers, status, views
+from rest_framework.filters import OrderingFilter, SearchFilter
 
+from budgets.catalogue import category_catalogue
+from budgets.filters import BudgetCategoryRelationsFilter
 from budgets.models import *
 from budgets.permissions import *
+from budgets.projections import aget_budget_projection, get_budget_projection
 from budgets.serializers import *
 from expenses.models import Expense
-from utils.serializers import EmptySerializer
+from utils.caching import (
+    CATALOGUE_SCOPE, CachedResponseMixin, ConditionalGetMixin, bump_data_version, bump_user_data_version,
+    get_budget_scope
+)
+from utils.pagination import KeysetPagination
+from utils.renderers import CSVRenderer, ORJSONRenderer
+from utils.views import AsyncReadMixin, CompiledListMixin
 
 
 @extend_schema(
@@ -18,9 +32,12 @@ from utils.serializers import EmptySerializer
     description='List/create budgets',
     responses=BudgetResponseSerializer
 )
-class BudgetListCreateView(generics.ListCreateAPIView):
+class BudgetListCreateView(ConditionalGetMixin, CompiledListMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Budget.objects.all()
+    queryset = Budget.objects.select_related('user')
+    compiled_serializer = compiled_budget_response_serializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-end_time', '-id')
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
@@ -47,9 +64,9 @@ class BudgetListCreateView(generics.ListCreateAPIView):
     description='Retrieve, update, or delete a budget',
     responses=BudgetResponseSerializer
 )
-class BudgetDetailView(generics.RetrieveUpdateDestroyAPIView):
+class BudgetDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (permissions.IsAuthenticated, IsMyBudget)
-    queryset = Budget.objects.all()
+    queryset = Budget.objects.select_related('user')
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -57,35 +74,92 @@ class BudgetDetailView(generics.RetrieveUpdateDestroyAPIView):
         return BudgetCreationSerializer
 
 
+class AsyncBudgetDetailView(AsyncReadMixin, BudgetDetailView):
+    """
+    BudgetDetailView with an async GET, served instead under ASGI (see settings.ASYNC_READ_VIEWS)
+    """
+    async def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(await self.aget_object())
+        return views.Response(serializer.data)
+
+
 @extend_schema(
     tags=['Budget Categories'],
     description='Get a list of all budget categories'
 )
-class BudgetCategoryListView(generics.ListAPIView):
+class BudgetCategoryListView(CachedResponseMixin, generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = BudgetCategoryResponseSerializer
     queryset = BudgetCategory.objects.all()
     filter_backends = (SearchFilter,)
     search_fields = ['name']
 
+    def get_response_cache_scopes(self, request):
+        return [CATALOGUE_SCOPE]
+
+    def list(self, request, *args, **kwargs):
+        # The response only depends on the catalogue and the query parameters
+        etag = quote_etag(hashlib.md5(
+            f'{category_catalogue.etag}|{request.get_full_path()}'.encode()
+        ).hexdigest())
+        not_modified_response = get_conditional_response(request, etag=etag)
+        if not_modified_response is not None:
+            return not_modified_response
+
+        # Categories come from the in-memory catalogue rather than the database
+        categories = category_catalogue.search(SearchFilter().get_search_terms(request))
+        page = self.paginate_queryset(categories)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response.headers['ETag'] = etag
+        return response
+
+
+@extend_schema(
+    tags=['Budget Categories'],
+    description='Autocomplete budget categories: the ones with a word starting with each word of q, '
+                'names starting with q first',
+    parameters=[BudgetCategoryAutocompleteRequestSerializer],
+    responses=BudgetCategoryResponseSerializer(many=True)
+)
+class BudgetCategoryAutocompleteView(generics.ListAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = BudgetCategoryResponseSerializer
+    queryset = BudgetCategory.objects.all()
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        request_serializer = BudgetCategoryAutocompleteRequestSerializer(data=request.query_params)
+        request_serializer.is_valid(raise_exception=True)
+        # Categories come from the catalogue's prefix index rather than the database
+        categories = category_catalogue.autocomplete(
+            request_serializer.validated_data['q'],
+            request_serializer.validated_data['limit'],
+        )
+        serializer = self.get_serializer(categories, many=True)
+        return views.Response(serializer.data)
+
 
 @extend_schema(
     tags=['Budget Category Relations'],
-    description='List/create budget category relations',
-    responses=BudgetCategoryRelationResponseSerializer
+    description='List/create budget category relations. Listed relations include their planned total across '
+                'the whole budget, which they can be ordered and filtered by.',
+    responses=BudgetCategoryRelationPlannedTotalResponseSerializer
 )
-class BudgetCategoryRelationListCreateView(generics.ListCreateAPIView):
+class BudgetCategoryRelationListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated, IsMyBudgetCategoryRelationCreation,)
-    queryset = BudgetCategoryRelation.objects.all()
-    filter_backends = (DjangoFilterBackend,)
-    filterset_fields = ['budget', 'category']
+    # Relations are serialized with their budget (and its user) and category
+    queryset = BudgetCategoryRelation.objects.select_related('budget__user', 'category').with_planned_total()
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
+    filterset_class = BudgetCategoryRelationsFilter
+    ordering_fields = ['amount', 'planned_total']
 
     def get_queryset(self):
         return self.queryset.filter(budget__user=self.request.user)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
-            return BudgetCategoryRelationResponseSerializer
+            return BudgetCategoryRelationPlannedTotalResponseSerializer
         return BudgetCategoryRelationCreationSerializer
 
     def create(self, request, *args, **kwargs):
@@ -100,15 +174,15 @@ class BudgetCategoryRelationListCreateView(generics.ListCreateAPIView):
 @extend_schema(
     tags=['Budget Category Relations'],
     description='Retrieve, update, or delete a budget category relation',
-    responses=BudgetCategoryRelationResponseSerializer
+    responses=BudgetCategoryRelationPlannedTotalResponseSerializer
 )
-class BudgetCategoryRelationDetailView(generics.RetrieveUpdateDestroyAPIView):
+class BudgetCategoryRelationDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (permissions.IsAuthenticated, IsMyBudgetCategoryRelationDetail)
-    queryset = BudgetCategoryRelation.objects.all()
+    queryset = BudgetCategoryRelation.objects.select_related('budget__user', 'category').with_planned_total()
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
-            return BudgetCategoryRelationResponseSerializer
+            return BudgetCategoryRelationPlannedTotalResponseSerializer
         return BudgetCategoryRelationCreationSerializer
 
 
@@ -125,61 +199,134 @@ class BudgetCategoryRelationBulkUpdateView(generics.UpdateAPIView):
         budget = self.get_object()
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        to_update = []
-        to_create = []
-        existing_ids = []
-        for category_relation_data in serializer.data['category_relations']:
-            category_relation = BudgetCategoryRelation(
-                category=BudgetCategory.objects.get(pk=category_relation_data['category']),
+        category_relations_data = serializer.validated_data['category_relations']
+
+        # Resolve every category in one query
+        category_ids = [category_relation_data['category'] for category_relation_data in category_relations_data]
+        categories = BudgetCategory.objects.in_bulk(category_ids)
+        missing_category_ids = sorted(set(category_ids) - categories.keys())
+        if missing_category_ids:
+            raise serializers.ValidationError({
+                'category_relations': [f'Invalid category "{pk}" - object does not exist.' for pk in missing_category_ids]
+            })
+        if len(set(category_ids)) != len(category_ids):
+            raise serializers.ValidationError({
+                'category_relations': ['Each category can only be included once.']
+            })
+
+        existing_ids = [
+            category_relation_data['id'] for category_relation_data in category_relations_data
+            if 'id' in category_relation_data
+        ]
+        category_relations = [
+            BudgetCategoryRelation(
+                category=categories[category_relation_data['category']],
                 amount=category_relation_data['amount'],
                 is_percentage=category_relation_data['is_percentage'],
                 budget=budget,
+            ) for category_relation_data in category_relations_data
+        ]
+        with transaction.atomic():
+            # Delete any category relations that are not in request. Relations are
+            # unique by category within a budget, so the ones that are kept get
+            # updated in place by the upsert below, and the rest get created.
+            budget.categories.exclude(id__in=existing_ids, category_id__in=category_ids).delete()
+            BudgetCategoryRelation.objects.bulk_create(
+                category_relations,
+                update_conflicts=True,
+                unique_fields=['budget', 'category'],
+                update_fields=['amount', 'is_percentage'],
             )
-            if 'id' in category_relation_data:
-                category_relation.id = category_relation_data['id']
-                to_update.append(category_relation)
-                existing_ids.append(category_relation.id)
-            else:
-                to_create.append(category_relation)
-
-        # Delete any category relations that are not in request
-        budget.categories.exclude(id__in=existing_ids).delete()
-
-        BudgetCategoryRelation.objects.bulk_create(to_create)
-        BudgetCategoryRelation.objects.bulk_update(to_update, ['category', 'amount', 'is_percentage'])
+            # Bulk inserts don't send signals
+            bump_data_version(get_budget_scope(budget.pk))
+            bump_user_data_version(budget.user_id)
         return views.Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @extend_schema(
     tags=['Budgets'],
-    description='Get a CSV file of planned and actual spending by category for this budget'
+    description='Get planned and actual spending (within the budget\'s time window) by category for this budget, '
+                'as a CSV file by default, or as JSON with ?format=json',
+    responses={(200, 'text/csv'): str, (200, 'application/json'): PlannedActualSpendingSerializer(many=True)}
 )
-class PlannedActualSpendingExportView(generics.RetrieveAPIView):
+class PlannedActualSpendingExportView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     permission_classes = (permissions.IsAuthenticated, IsMyBudget)
-    serializer_class = EmptySerializer
+    renderer_classes = (CSVRenderer, ORJSONRenderer)
+    serializer_class = PlannedActualSpendingSerializer
     queryset = Budget.objects.all()
 
-    def get(self, request, *args, **kwargs):
-        response = HttpResponse(
-            content_type="text/csv",
-            headers={
-                'Content-Disposition': 'attachment;filename="spending_comparison.csv"'
-            }
-        )
+    def get_response_cache_scopes(self, request):
+        return super().get_response_cache_scopes(request) + [get_budget_scope(self.kwargs['pk'])]
+
+    def retrieve(self, request, *args, **kwargs):
+        budget = self.get_object()
+        # Same order as the CSV export has always had (the relations' default ordering within a budget)
+        spending = get_budget_projection(budget, ordering=('-category__name',)).category_projections
+
+        if request.accepted_renderer.format == 'json':
+            serializer = self.get_serializer(spending, many=True)
+            return views.Response(serializer.data)
+
+        rows = [['Category', 'Planned ($)', 'Actual ($)']] + [
+            [
+                category_spending.category.name,
+                f'{category_spending.planned_amount:.2f}',
+                f'{category_spending.actual_amount:.2f}',
+            ] for category_spending in spending
+        ]
+        return views.Response(rows, headers={
+            'Content-Disposition': 'attachment;filename="spending_comparison.csv"'
+        })
+
+
+@extend_schema(
+    tags=['Budgets'],
+    description='Get everything needed to show a budget: the budget, its category relations with planned '
+                'and actual spending (within the budget\'s time window) and pacing, and the totals',
+    responses=BudgetDashboardSerializer
+)
+class BudgetDashboardView(generics.RetrieveAPIView):
+    permission_classes = (permissions.IsAuthenticated, IsMyBudget)
+    serializer_class = BudgetDashboardSerializer
+    queryset = Budget.objects.select_related('user')
+    # All of the budget owner's spending in the budget's time window, in any category
+    total_aggregate = {'total': Coalesce(Sum('amount'), Decimal(0))}
+
+    def retrieve(self, request, *args, **kwargs):
         budget = self.get_object()
-        expenses = Expense.objects.filter(user=request.user)
-        actual_spending_by_category = BudgetCategory.objects.get_actual_spending_by_category(expenses)
-        categories_to_actual_spending = {
-            spending['id']: spending['total_amount'] for spending in actual_spending_by_category
+        projection = get_budget_projection(budget)
+        total_actual_amount = self.get_window_expenses(budget).aggregate(**self.total_aggregate)['total']
+        serializer = self.get_serializer(self.get_dashboard(budget, projection, total_actual_amount))
+        return views.Response(serializer.data)
+
+    def get_window_expenses(self, budget):
+        return Expense.objects.filter(
+            user_id=budget.user_id,
+            timestamp__gte=budget.start_time,
+            timestamp__lte=budget.end_time,
+        )
+
+    def get_dashboard(self, budget, projection, total_actual_amount):
+        return {
+            'budget': budget,
+            'category_relations': projection.category_projections,
+            'planned_amount': projection.planned_amount,
+            'actual_amount': projection.actual_amount,
+            'remaining_amount': projection.remaining_amount,
+            'expected_amount': projection.expected_amount,
+            'elapsed_days': projection.elapsed_days,
+            'remaining_days': projection.remaining_days,
+            'total_actual_amount': total_actual_amount,
         }
-        writer = csv.writer(response)
-        writer.writerow(['Category', 'Planned ($)', 'Actual ($)'])
-        for category_relation in budget.categories.all():
-            amount = f'{(category_relation.get_total_amount()):.2f}'
-            writer.writerow([
-                category_relation.category.name,
-                amount,
-                categories_to_actual_spending[category_relation.category.id]
-            ])
 
-        return response
+
+class AsyncBudgetDashboardView(AsyncReadMixin, BudgetDashboardView):
+    """
+    BudgetDashboardView with an async GET, served instead under ASGI (see settings.ASYNC_READ_VIEWS)
+    """
+    async def get(self, request, *args, **kwargs):
+        budget = await self.aget_object()
+        projection = await aget_budget_projection(budget)
+        total = await self.get_window_expenses(budget).aaggregate(**self.total_aggregate)
+        serializer = self.get_serializer(self.get_dashboard(budget, projection, total['total']))
+        return views.Response(serializer.data)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        import expenses.checks  # noqa: F401 (registers system checks)
+        import expenses.signals  # noqa: F401 (registers signal receivers)
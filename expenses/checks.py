@@ -0,0 +1,42 @@
+from django.core.checks import Error, Tags, register
+from django.db import connections
+
+from expenses.filters import EXPENSE_SEARCH_FTS_TABLE
+
+# Keep the SQLite full-text index up to date (see migration 0004)
+EXPENSE_SEARCH_TRIGGERS = {
+    f'{EXPENSE_SEARCH_FTS_TABLE}_insert',
+    f'{EXPENSE_SEARCH_FTS_TABLE}_delete',
+    f'{EXPENSE_SEARCH_FTS_TABLE}_update',
+}
+
+
+@register(Tags.database)
+def check_expense_search_triggers(app_configs=None, databases=None, **kwargs):
+    """
+    Migrations that make SQLite rebuild expenses_expense (e.g. altering or removing
+    a field) silently drop the search index's triggers, after which new and edited
+    expenses stop showing up in searches
+    """
+    errors = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE %s", [f'{EXPENSE_SEARCH_FTS_TABLE}%'])
+            names_by_type = {}
+            for object_type, name in cursor.fetchall():
+                names_by_type.setdefault(object_type, set()).add(name)
+        if EXPENSE_SEARCH_FTS_TABLE not in names_by_type.get('table', set()):
+            continue  # Not migrated yet
+        missing_triggers = EXPENSE_SEARCH_TRIGGERS - names_by_type.get('trigger', set())
+        if missing_triggers:
+            errors.append(Error(
+                f'The expense search index is missing its triggers {", ".join(sorted(missing_triggers))} '
+                f'in the {alias!r} database.',
+                hint='A migration rebuilt expenses_expense. Create the triggers again in a migration '
+                     '(see SQLITE_CREATE_STATEMENTS in migration 0004), running it with --skip-checks.',
+                id='expenses.E001',
+            ))
+    return errors
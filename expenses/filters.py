@@ -1,7 +1,21 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models.expressions import RawSQL
 from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
 
 from expenses.models import Expense
 
+# Full-text index over expenses' names and descriptions (see migration 0004):
+# an expression GIN index on Postgres, and this FTS5 table on SQLite
+EXPENSE_SEARCH_FTS_TABLE = 'expenses_expense_fts'
+EXPENSE_SEARCH_CONFIG = 'simple'  # No stemming or stop words, like icontains
+
+# Words, the way both Postgres' parser and FTS5's unicode61 tokenizer split text
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
 
 class ExpensesFilter(filters.FilterSet):
     class Meta:
@@ -10,3 +24,68 @@ class ExpensesFilter(filters.FilterSet):
             'category': ['exact', 'in'],
             'timestamp': ['exact', 'lte', 'gte']
         }
+
+
+def get_expense_search_vector():
+    # Must match the indexed expression exactly for Postgres to use the index
+    return SearchVector('name', 'description', config=EXPENSE_SEARCH_CONFIG)
+
+
+class ExpenseSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter over expenses' names and descriptions,
+    backed by a full-text index instead of scanning for substrings. Every word of
+    the search must start a word of the name or description (so "groc" finds
+    "Groceries"), and results are ordered by relevance unless another ordering
+    is requested. Falls back to SearchFilter on other databases.
+    """
+    def get_search_words(self, request):
+        return [word.lower() for term in self.get_search_terms(request) for word in WORD_PATTERN.findall(term)]
+
+    def filter_queryset(self, request, queryset, view):
+        if not self.get_search_terms(request):
+            return queryset
+        vendor = connections[queryset.db].vendor
+        if vendor == 'postgresql':
+            filter_method = self.filter_postgresql
+        elif vendor == 'sqlite':
+            filter_method = self.filter_sqlite
+        else:
+            return super().filter_queryset(request, queryset, view)
+
+        words = self.get_search_words(request)
+        if not words:
+            # Only punctuation, which isn't indexed
+            return queryset.none()
+        # Most relevant first, then in the existing order
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return filter_method(queryset, words).order_by('-search_rank', *ordering)
+
+    def filter_postgresql(self, queryset, words):
+        query = SearchQuery(
+            ' & '.join(f"'{word}':*" for word in words),
+            search_type='raw',
+            config=EXPENSE_SEARCH_CONFIG,
+        )
+        return queryset\
+            .alias(search_vector=get_expense_search_vector())\
+            .filter(search_vector=query)\
+            .alias(search_rank=SearchRank(get_expense_search_vector(), query))
+
+    def filter_sqlite(self, queryset, words):
+        query = ' AND '.join(f'"{word}"*' for word in words)
+        table = queryset.model._meta.db_table
+        fts_table = EXPENSE_SEARCH_FTS_TABLE
+        matches = f'SELECT rowid FROM "{fts_table}" WHERE "{fts_table}" MATCH %s'
+        # bm25() is lower for better matches. LIMIT -1 keeps SQLite from flattening the
+        # ranked matches into the outer query, which would run the full-text query
+        # again for each expense, so it runs once and ranks every match.
+        ranked_matches = f'SELECT rowid, -bm25("{fts_table}") AS rank FROM "{fts_table}" ' \
+                         f'WHERE "{fts_table}" MATCH %s LIMIT -1'
+        return queryset\
+            .filter(pk__in=RawSQL(matches, (query,)))\
+            .alias(search_rank=RawSQL(
+                f'SELECT ranked_matches.rank FROM ({ranked_matches}) AS ranked_matches '
+                f'WHERE ranked_matches.rowid = "{table}"."id"',
+                (query,)
+            ))
@@ -0,0 +1,294 @@
+"""
+Import of expenses from bank statement files (CSV, including the format written
+by ExpensesCSVExportView, and OFX). The import is a pipeline of generators:
+
+    parse -> normalize -> map categories -> batch -> dedupe -> insert
+
+so only one batch of expenses is held in memory at a time, however large the file.
+"""
+
+import csv
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from budgets.catalogue import category_catalogue
+from expenses import rollups
+from expenses.models import Expense
+from utils.caching import bump_user_data_version
+
+FORMAT_CSV = 'csv'
+FORMAT_OFX = 'ofx'
+FORMATS = [FORMAT_CSV, FORMAT_OFX]
+
+# Maps the column names used by ExpensesCSVExportView and common bank exports
+# to the fields of a parsed row
+CSV_COLUMN_ALIASES = {
+    'name': 'name',
+    'payee': 'name',
+    'merchant': 'name',
+    'date': 'date',
+    'transaction date': 'date',
+    'posted date': 'date',
+    'time': 'time',
+    'description': 'description',
+    'memo': 'description',
+    'category': 'category',
+    'amount': 'amount',
+}
+CSV_DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y']
+CSV_TIME_FORMATS = ['%I:%M %p', '%H:%M', '%H:%M:%S']
+EMPTY_VALUES = ('', '-')  # ExpensesCSVExportView writes '-' for missing values
+
+OFX_TAG_REGEX = re.compile(r'<(/?)([A-Z0-9.]+)>([^<]*)')
+OFX_DATE_REGEX = re.compile(r'^(\d{8})(\d{6})?(?:\.\d+)?(?:\[([+-]?\d+(?:\.\d+)?)(?::\w+)?\])?')
+
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportRowError(Exception):
+    pass
+
+
+class ImportResult:
+    """
+    Counts of what happened to the rows of an import
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []  # Only the first MAX_REPORTED_ERRORS are kept
+        self.started_at = time.perf_counter()
+        self.elapsed_seconds = 0
+
+    def add_error(self, line_number, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def finish(self):
+        self.elapsed_seconds = time.perf_counter() - self.started_at
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed_seconds:
+            return 0
+        return self.rows / self.elapsed_seconds
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'elapsed_seconds': round(self.elapsed_seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def parse_csv(lines):
+    """
+    Yields (line number, row) for each row of a CSV file, with the columns
+    renamed to the keys of CSV_COLUMN_ALIASES' values
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_COLUMN_ALIASES.get(column.strip().lower()) for column in header]
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        yield reader.line_num, {
+            column: value.strip() for column, value in zip(columns, values) if column is not None
+        }
+
+
+def parse_ofx(lines):
+    """
+    Yields (line number, row) for each transaction (<STMTTRN>) of an OFX file.
+    Only debits are expenses, so credits are skipped.
+    """
+    transaction_data = None
+    for line_number, line in enumerate(lines, start=1):
+        for closing, tag, value in OFX_TAG_REGEX.findall(line):
+            if tag == 'STMTTRN':
+                if not closing:
+                    transaction_data = {}
+                elif transaction_data is not None:
+                    amount = transaction_data.get('TRNAMT', '')
+                    if not amount.startswith('-'):
+                        transaction_data = None
+                        continue
+                    yield line_number, {
+                        'name': transaction_data.get('NAME') or transaction_data.get('PAYEE', ''),
+                        'date': transaction_data.get('DTPOSTED', ''),
+                        'description': transaction_data.get('MEMO', ''),
+                        'amount': amount[1:],
+                        'format': FORMAT_OFX,
+                    }
+                    transaction_data = None
+            elif transaction_data is not None and not closing:
+                transaction_data[tag] = value.strip()
+
+
+def parse_csv_timestamp(date_value, time_value):
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            date = datetime.strptime(date_value, date_format)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ImportRowError(f'Invalid date "{date_value}"')
+    if time_value in EMPTY_VALUES:
+        return timezone.make_aware(date)
+    for time_format in CSV_TIME_FORMATS:
+        try:
+            parsed_time = datetime.strptime(time_value, time_format).time()
+            return timezone.make_aware(datetime.combine(date.date(), parsed_time))
+        except ValueError:
+            continue
+    raise ImportRowError(f'Invalid time "{time_value}"')
+
+
+def parse_ofx_timestamp(value):
+    match = OFX_DATE_REGEX.match(value)
+    if match is None:
+        raise ImportRowError(f'Invalid date "{value}"')
+    date_value, time_value, offset = match.groups()
+    timestamp = datetime.strptime(date_value + (time_value or '000000'), '%Y%m%d%H%M%S')
+    if offset is None:
+        return timestamp.replace(tzinfo=dt_timezone.utc)  # OFX dates default to GMT
+    return timestamp.replace(tzinfo=dt_timezone(timedelta(hours=float(offset))))
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(value.replace('$', '').replace(',', ''))
+    except InvalidOperation:
+        raise ImportRowError(f'Invalid amount "{value}"')
+    if not amount.is_finite() or abs(amount) >= 10 ** 10:
+        raise ImportRowError(f'Invalid amount "{value}"')
+    return amount.quantize(Decimal('0.01'))
+
+
+def normalize(rows, result):
+    """
+    Converts parsed rows to expense fields, recording (and dropping) invalid rows
+    """
+    for line_number, row in rows:
+        result.rows += 1
+        try:
+            if row.get('format') == FORMAT_OFX:
+                timestamp = parse_ofx_timestamp(row['date'])
+            else:
+                timestamp = parse_csv_timestamp(row.get('date', ''), row.get('time', ''))
+            amount = parse_amount(row.get('amount', ''))
+        except ImportRowError as e:
+            result.add_error(line_number, str(e))
+            continue
+        name = row.get('name', '')
+        description = row.get('description', '')
+        yield {
+            'name': None if name in EMPTY_VALUES else name[:256],
+            'timestamp': timestamp,
+            'description': None if description in EMPTY_VALUES else description[:2048],
+            'category': row.get('category', ''),
+            'amount': amount,
+        }
+
+
+def map_categories(rows):
+    """
+    Replaces category names with categories from the catalogue (names that
+    don't match a category leave the expense uncategorized)
+    """
+    for row in rows:
+        category_name = row['category']
+        row['category'] = None if category_name in EMPTY_VALUES else category_catalogue.get_by_name(category_name)
+        yield row
+
+
+def batch(rows, batch_size):
+    rows_batch = []
+    for row in rows:
+        rows_batch.append(row)
+        if len(rows_batch) == batch_size:
+            yield rows_batch
+            rows_batch = []
+    if rows_batch:
+        yield rows_batch
+
+
+def get_duplicate_key(name, timestamp, amount):
+    return name, timestamp, amount
+
+
+def dedupe(batches, user, result):
+    """
+    Drops expenses that are already in the database, or repeated within a batch.
+    Earlier batches are inserted before later ones are deduplicated, so the
+    database check also catches repeats across batches.
+    """
+    for rows_batch in batches:
+        existing_keys = {
+            get_duplicate_key(*values) for values in Expense.objects.filter(
+                user=user,
+                timestamp__in={row['timestamp'] for row in rows_batch},
+            ).values_list('name', 'timestamp', 'amount')
+        }
+        expenses = []
+        for row in rows_batch:
+            key = get_duplicate_key(row['name'], row['timestamp'], row['amount'])
+            if key in existing_keys:
+                result.duplicates += 1
+                continue
+            existing_keys.add(key)
+            expenses.append(Expense(**row, user=user))
+        yield expenses
+
+
+def parse(lines, file_format):
+    if file_format == FORMAT_OFX:
+        return parse_ofx(lines)
+    return parse_csv(lines)
+
+
+def import_expenses(lines, user, file_format=FORMAT_CSV, batch_size=None):
+    """
+    Imports expenses for the user from the lines of a bank statement file, and
+    returns an ImportResult. Runs in one transaction, so an unexpected error
+    leaves no expenses behind.
+    """
+    batch_size = batch_size or settings.EXPENSES_BULK_CREATE_BATCH_SIZE
+    result = ImportResult()
+    rows = map_categories(normalize(parse(lines, file_format), result))
+    with transaction.atomic():
+        for expenses in dedupe(batch(rows, batch_size), user, result):
+            Expense.objects.bulk_create(expenses)
+            rollups.add_expenses(expenses)
+            result.created += len(expenses)
+        bump_user_data_version(user.pk)
+    result.finish()
+    return result
+
+
+def get_file_format(file_name, default=FORMAT_CSV):
+    """
+    Guesses the format of a file from its extension
+    """
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if extension in ('ofx', 'qfx'):
+        return FORMAT_OFX
+    if extension == 'csv':
+        return FORMAT_CSV
+    return default
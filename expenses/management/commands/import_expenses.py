@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importers import FORMATS, get_file_format, import_expenses
+
+
+class Command(BaseCommand):
+    help = 'Imports expenses for a user from a bank statement file (CSV or OFX)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Path of the CSV or OFX file')
+        parser.add_argument('--user', required=True, help='Username of the user the expenses belong to')
+        parser.add_argument('--format', choices=FORMATS, help='File format (guessed from the extension by default)')
+        parser.add_argument('--batch-size', type=int, help='Number of expenses inserted at a time')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist')
+
+        file_format = options['format'] or get_file_format(options['file'])
+        try:
+            with open(options['file'], encoding='utf-8-sig', errors='replace', newline='') as lines:
+                result = import_expenses(lines, user, file_format, batch_size=options['batch_size'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in result.errors:
+            self.stderr.write(f'Line {error["line"]}: {error["error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {result.rows} rows in {result.elapsed_seconds:.2f}s ({result.rows_per_second:.0f} rows/s): '
+            f'{result.created} created, {result.duplicates} duplicates, {result.invalid} invalid'
+        ))
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from expenses import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the monthly expense rollups from the expenses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', help='Only rebuild rollups for this username (repeatable)')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['users']:
+            users = get_user_model().objects.filter(username__in=options['users'])
+        count = rollups.rebuild(users)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollups'))
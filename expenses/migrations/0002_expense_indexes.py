@@ -0,0 +1,32 @@
+# Generated by Django 4.2.4 on 2026-10-18 08:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgets', '0002_rename_typical_raw_amount_budgetcategory_typical_monthly_amount'),
+        ('expenses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='expense',
+            options={'ordering': ['-timestamp']},
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='expenses', to='budgets.budgetcategory'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', '-timestamp'], name='expense_user_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'category', '-timestamp', 'amount'], name='expense_user_cat_timestamp_idx'),
+        ),
+    ]
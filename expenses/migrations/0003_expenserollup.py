@@ -0,0 +1,51 @@
+# Generated by Django 4.2.4 on 2026-10-18 08:39
+
+from datetime import timezone
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import TruncMonth
+
+
+def build_rollups(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseRollup = apps.get_model('expenses', 'ExpenseRollup')
+    totals = Expense.objects\
+        .order_by()\
+        .annotate(month=TruncMonth('timestamp', output_field=models.DateField(), tzinfo=timezone.utc))\
+        .values('user_id', 'category_id', 'month')\
+        .annotate(total_amount=models.Sum('amount'), count=models.Count('id'))
+    ExpenseRollup.objects.bulk_create(ExpenseRollup(**total) for total in totals.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budgets', '0002_rename_typical_raw_amount_budgetcategory_typical_monthly_amount'),
+        ('expenses', '0002_expense_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to='budgets.budgetcategory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('user', 'category', 'month'), name='unique_expense_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'month'), name='unique_uncategorized_expense_rollup'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
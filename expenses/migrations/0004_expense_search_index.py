@@ -0,0 +1,82 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+FTS_TABLE = 'expenses_expense_fts'
+
+# External content FTS5 table (it only stores the index, and reads the text from
+# expenses_expense), kept up to date by triggers on every write, including bulk ones.
+# Migrations that make SQLite rebuild expenses_expense drop its triggers, so they
+# have to create them again (the expenses.E001 system check reports missing ones).
+SQLITE_CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, description, content='expenses_expense', content_rowid='id'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF name, description ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_STATEMENTS = [
+    f'DROP TRIGGER {FTS_TABLE}_insert',
+    f'DROP TRIGGER {FTS_TABLE}_delete',
+    f'DROP TRIGGER {FTS_TABLE}_update',
+    f'DROP TABLE {FTS_TABLE}',
+]
+
+
+def get_postgresql_index():
+    # Same expression as expenses.filters.get_expense_search_vector(), so searches can use it.
+    # Being an expression index, Postgres keeps it up to date on every write.
+    return GinIndex(SearchVector('name', 'description', config='simple'), name='expense_search_idx')
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('expenses', 'Expense'), get_postgresql_index())
+    elif vendor == 'sqlite':
+        for statement in SQLITE_CREATE_STATEMENTS:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('expenses', 'Expense'), get_postgresql_index())
+    elif vendor == 'sqlite':
+        for statement in SQLITE_DROP_STATEMENTS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index over expenses' names and descriptions, for ExpenseSearchFilter.
+    It depends on the database, so it isn't part of the model's state.
+    """
+
+    dependencies = [
+        ('expenses', '0003_expenserollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,7 +1,35 @@
+from datetime import timezone as dt_timezone
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Count, DateField, F, FloatField, Sum
+from django.db.models.functions import Cast, TruncDay, TruncMonth, TruncWeek
 
 from budgets.models import BudgetCategory
+from utils.choices import TimeBucket
+
+
+TIME_BUCKET_FUNCTIONS = {
+    TimeBucket.DAY: TruncDay,
+    TimeBucket.WEEK: TruncWeek,  # Weeks start on Monday
+    TimeBucket.MONTH: TruncMonth,
+}
+
+
+class ExpenseQuerySet(models.QuerySet):
+    def get_spending_time_series(self, bucket):
+        """
+        Gets the total and number of expenses in each (UTC) day, week or month,
+        per category, ordered by bucket then category. The expenses are truncated
+        and grouped in one query.
+        """
+        truncate = TIME_BUCKET_FUNCTIONS[bucket]
+        return self\
+            .order_by()\
+            .annotate(bucket=truncate('timestamp', output_field=DateField(), tzinfo=dt_timezone.utc))\
+            .values('bucket', 'category_id')\
+            .annotate(total_amount=Cast(Sum('amount'), FloatField()), count=Count('id'))\
+            .order_by('bucket', F('category_id').asc(nulls_last=True))
 
 
 class Expense(models.Model):
@@ -12,5 +40,44 @@ class Expense(models.Model):
     category = models.ForeignKey(BudgetCategory, on_delete=models.SET_NULL, null=True, related_name='expenses')
     amount = models.DecimalField(max_digits=12, decimal_places=2)
 
+    objects = ExpenseQuerySet.as_manager()
+
     class Meta:
         ordering = ['-timestamp'] # show most recent first by default
+        indexes = [
+            # Every expense endpoint filters by user and orders by most recent first,
+            # optionally bounded by timestamp__gte/lte
+            models.Index(fields=['user', '-timestamp'], name='expense_user_timestamp_idx'),
+            # Same access pattern narrowed by category/category__in, and the
+            # per-category aggregates (amount is included so they can be served from the index)
+            models.Index(fields=['user', 'category', '-timestamp', 'amount'], name='expense_user_cat_timestamp_idx'),
+        ]
+
+
+class ExpenseRollup(models.Model):
+    """
+    Total and number of a user's expenses in one category (or uncategorized) and one
+    month. Kept up to date as expenses are written (see expenses.rollups), so
+    monthly totals can be read without aggregating every expense.
+    """
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='expense_rollups')
+    category = models.ForeignKey(BudgetCategory, on_delete=models.CASCADE, null=True, related_name='expense_rollups')
+    month = models.DateField()  # First day of the month (UTC)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # NULLs aren't equal to each other in unique constraints, so uncategorized
+            # expenses need a separate constraint
+            models.UniqueConstraint(
+                fields=['user', 'category', 'month'],
+                condition=models.Q(category__isnull=False),
+                name='unique_expense_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'month'],
+                condition=models.Q(category__isnull=True),
+                name='unique_uncategorized_expense_rollup',
+            ),
+        ]
@@ -9,4 +9,4 @@ class IsMyExpense(permissions.BasePermission):
     they own it
     """
     def has_object_permission(self, request, view, obj):
-        return request.user.pk == obj.user.pk
+        return request.user.pk == obj.user_id
@@ -0,0 +1,138 @@
+"""
+Maintenance of ExpenseRollup rows: monthly totals of each user's expenses by
+category. Single expense writes are picked up by signals (see expenses.signals),
+while bulk inserts (which don't send signals) call add_expenses() themselves.
+"""
+
+from collections import defaultdict
+from datetime import time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+
+from expenses.models import Expense, ExpenseRollup
+
+
+def get_month(timestamp):
+    """
+    Gets the first day of the (UTC) month a timestamp is in
+    """
+    return timestamp.astimezone(dt_timezone.utc).date().replace(day=1)
+
+
+def is_month_start(timestamp):
+    timestamp = timestamp.astimezone(dt_timezone.utc)
+    return timestamp.day == 1 and timestamp.time() == time()
+
+
+def get_rollup_key(user_id, category_id, timestamp):
+    return user_id, category_id, get_month(timestamp)
+
+
+def apply_deltas(deltas):
+    """
+    Adds {(user ID, category ID, month): [amount, count]} to the matching rollups.
+    Rollups are only created for additions, so removing expenses of a user or
+    category that is being deleted (whose rollups may already be gone) is a no-op.
+    """
+    with transaction.atomic():
+        for (user_id, category_id, month), (amount, count) in deltas.items():
+            if not amount and not count:
+                continue
+            rollups = ExpenseRollup.objects.filter(user_id=user_id, category_id=category_id, month=month)
+            updated = rollups.update(total_amount=F('total_amount') + amount, count=F('count') + count)
+            if updated or count <= 0:
+                continue
+            try:
+                with transaction.atomic():
+                    ExpenseRollup.objects.create(
+                        user_id=user_id,
+                        category_id=category_id,
+                        month=month,
+                        total_amount=amount,
+                        count=count,
+                    )
+            except IntegrityError:
+                # Created concurrently since the update above
+                rollups.update(total_amount=F('total_amount') + amount, count=F('count') + count)
+
+
+def get_amount(expense):
+    """
+    Gets an expense's amount as a Decimal (unsaved amounts may still be floats or strings)
+    """
+    return Expense._meta.get_field('amount').to_python(expense.amount).quantize(Decimal('0.01'))
+
+
+def get_deltas(expenses, sign=1):
+    deltas = defaultdict(lambda: [0, 0])
+    for expense in expenses:
+        delta = deltas[get_rollup_key(expense.user_id, expense.category_id, expense.timestamp)]
+        delta[0] += sign * get_amount(expense)
+        delta[1] += sign
+    return deltas
+
+
+def add_expenses(expenses):
+    apply_deltas(get_deltas(expenses))
+
+
+def remove_expenses(expenses):
+    apply_deltas(get_deltas(expenses, sign=-1))
+
+
+def move_category_to_uncategorized(category):
+    """
+    Deleting a category leaves its expenses uncategorized (through an UPDATE,
+    which doesn't send signals), so its rollups have to be added to the
+    uncategorized ones before they're deleted along with the category
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for rollup in category.expense_rollups.all():
+        delta = deltas[(rollup.user_id, None, rollup.month)]
+        delta[0] += rollup.total_amount
+        delta[1] += rollup.count
+    apply_deltas(deltas)
+
+
+def rebuild(users=None):
+    """
+    Recomputes the rollups from scratch (for all users, or the given ones)
+    """
+    rollups = ExpenseRollup.objects.all()
+    expenses = Expense.objects.all()
+    if users is not None:
+        rollups = rollups.filter(user__in=users)
+        expenses = expenses.filter(user__in=users)
+    with transaction.atomic():
+        rollups.delete()
+        totals = expenses\
+            .order_by()\
+            .annotate(month=TruncMonth('timestamp', output_field=DateField(), tzinfo=dt_timezone.utc))\
+            .values('user_id', 'category_id', 'month')\
+            .annotate(total_amount=Sum('amount'), count=Count('id'))
+        return len(ExpenseRollup.objects.bulk_create(
+            ExpenseRollup(**total) for total in totals.iterator()
+        ))
+
+
+def get_month_range(timestamp__gte=None, timestamp__lte=None):
+    """
+    Converts expense timestamp filters to the (first, last) months of rollups
+    covering exactly the same expenses, or returns None if the filters don't
+    line up with month boundaries (gte must be the start of a month, and lte
+    the very last instant of a month). Either month is None when unbounded.
+    """
+    first_month = last_month = None
+    if timestamp__gte is not None:
+        if not is_month_start(timestamp__gte):
+            return None
+        first_month = get_month(timestamp__gte)
+    if timestamp__lte is not None:
+        next_instant = timestamp__lte + timedelta(microseconds=1)
+        if not is_month_start(next_instant):
+            return None
+        last_month = get_month(timestamp__lte)
+    return first_month, last_month
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 
-from budgets.serializers import BudgetCategoryResponseSerializer
+from budgets.serializers import BudgetCategoryResponseSerializer, CatalogueCategoryField
+from expenses.importers import FORMATS
 from expenses.models import *
 from users.serializers import UserResponseSerializer
+from utils.choices import TimeBucket
+from utils.serializers import CompiledSerializer
 
 
 class ExpenseCreationSerializer(serializers.ModelSerializer):
@@ -17,6 +20,66 @@ class ExpenseCreationSerializer(serializers.ModelSerializer):
             'amount',
         ]
 
+    category = CatalogueCategoryField(allow_null=True, required=False)
+
+
+class ExpenseBulkCreationSerializer(ExpenseCreationSerializer):
+    class Meta(ExpenseCreationSerializer.Meta):
+        # Every expense created in bulk belongs to the current user
+        fields = [field for field in ExpenseCreationSerializer.Meta.fields if field != 'user']
+
+
+class ExpenseBulkCreationResponseSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'count',
+        ]
+
+    count = serializers.IntegerField()
+
+
+class ExpenseImportRequestSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'file',
+            'format',
+        ]
+
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMATS, required=False)
+
+
+class ExpenseImportErrorSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'line',
+            'error',
+        ]
+
+    line = serializers.IntegerField()
+    error = serializers.CharField()
+
+
+class ExpenseImportResponseSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'rows',
+            'created',
+            'duplicates',
+            'invalid',
+            'errors',
+            'elapsed_seconds',
+            'rows_per_second',
+        ]
+
+    rows = serializers.IntegerField()
+    created = serializers.IntegerField()
+    duplicates = serializers.IntegerField()
+    invalid = serializers.IntegerField()
+    errors = ExpenseImportErrorSerializer(many=True)
+    elapsed_seconds = serializers.FloatField()
+    rows_per_second = serializers.FloatField()
+
 
 class ExpenseResponseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -35,6 +98,9 @@ class ExpenseResponseSerializer(serializers.ModelSerializer):
     category = BudgetCategoryResponseSerializer()
 
 
+compiled_expense_response_serializer = CompiledSerializer(ExpenseResponseSerializer)
+
+
 class ExpensesByCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = BudgetCategory
@@ -43,4 +109,28 @@ class ExpensesByCategorySerializer(serializers.ModelSerializer):
             'id'
         ]
 
-    total_amount = serializers.FloatField()
\ No newline at end of file
+    total_amount = serializers.FloatField()
+
+
+class ExpenseTimeSeriesRequestSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'bucket',
+        ]
+
+    bucket = serializers.ChoiceField(choices=TimeBucket.choices, default=TimeBucket.MONTH)
+
+
+class ExpenseTimeSeriesSerializer(serializers.Serializer):
+    class Meta:
+        fields = [
+            'bucket',
+            'category',
+            'total_amount',
+            'count',
+        ]
+
+    bucket = serializers.DateField()  # First day of the bucket
+    category = serializers.IntegerField(source='category_id', allow_null=True)
+    total_amount = serializers.FloatField()
+    count = serializers.IntegerField()
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from budgets.models import BudgetCategory
+from expenses import rollups
+from expenses.models import Expense
+from utils.caching import bump_user_data_version
+
+
+@receiver(pre_save, sender=Expense)
+def remember_previous_expense(sender, instance, raw=False, **kwargs):
+    # The expense as it was before this save, to take it out of its old rollup
+    instance._previous_expense = None
+    if instance.pk is not None and not raw:
+        instance._previous_expense = Expense.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Expense)
+def update_rollups_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous_expense = getattr(instance, '_previous_expense', None)
+    if previous_expense is not None:
+        rollups.remove_expenses([previous_expense])
+    rollups.add_expenses([instance])
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    rollups.remove_expenses([instance])
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def invalidate_cached_responses(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_user_data_version(instance.user_id)
+
+
+@receiver(pre_delete, sender=BudgetCategory)
+def move_category_rollups(sender, instance, **kwargs):
+    rollups.move_category_to_uncategorized(instance)
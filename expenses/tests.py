@@ -1,12 +1,44 @@
-from datetime import datetime
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from rest_framework import status
+from django.utils.http import http_date
+from rest_framework import serializers, status
+from rest_framework.filters import SearchFilter
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import force_authenticate
 
+from budgets.catalogue import category_catalogue
+from expenses.checks import check_expense_search_triggers
+from expenses.filters import ExpenseSearchFilter, ExpensesFilter
 from expenses.models import *
+from expenses.serializers import ExpenseResponseSerializer, compiled_expense_response_serializer
+from expenses.views import AsyncExpenseListCreateView, AsyncExpensesByCategoryView, ExpenseListCreateView
 from users.models import User
 from utils.choices import *
+from utils.pagination import KeysetPagination
+from utils.parsers import ORJSONParser
+from utils.renderers import ORJSONRenderer
+from utils.serializers import CompiledSerializer
+from utils.testing import benchmark, report, shared_cache, time_call
 
 
 class ExpensesTests(TestCase):
@@ -50,6 +82,9 @@ class ExpensesTests(TestCase):
             user=cls.user2,
         )
 
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+
     def test_create_expense_valid(self):
         self.client.login(username='user1', password='password1')
         response = self.client.post(
@@ -92,6 +127,108 @@ class ExpensesTests(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_bulk_create_expenses_valid(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.post(
+            reverse('expense_bulk_create'),
+            [
+                {
+                    'name': f'Imported Expense {i}',
+                    'category': self.budget_category3.pk,
+                    'timestamp': datetime.now(tz=timezone.utc),
+                    'amount': 10 + i,
+                    'user': self.user2.pk,  # Ignored
+                } for i in range(3)
+            ] + [
+                {
+                    'timestamp': datetime.now(tz=timezone.utc),
+                    'amount': 1,
+                }
+            ],
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['count'], 4)
+        self.assertEqual(Expense.objects.filter(user=self.user1, name__startswith='Imported').count(), 3)
+        self.assertEqual(Expense.objects.filter(user=self.user1, category__isnull=True).count(), 1)
+        self.assertEqual(Expense.objects.filter(user=self.user2).count(), 1)
+
+    def test_bulk_create_expenses_errors_per_row(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.post(
+            reverse('expense_bulk_create'),
+            [
+                {
+                    'name': 'Valid',
+                    'category': self.budget_category3.pk,
+                    'timestamp': datetime.now(tz=timezone.utc),
+                    'amount': 10,
+                },
+                {
+                    'name': 'Missing amount',
+                    'timestamp': datetime.now(tz=timezone.utc),
+                },
+                {
+                    'name': 'Invalid category',
+                    'category': 0,
+                    'timestamp': datetime.now(tz=timezone.utc),
+                    'amount': 10,
+                },
+            ],
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1].keys()), ['amount'])
+        self.assertEqual(list(errors[2].keys()), ['category'])
+        # None of the expenses were created
+        self.assertEqual(Expense.objects.filter(user=self.user1).count(), 1)
+
+    @override_settings(EXPENSES_BULK_CREATE_BATCH_SIZE=2)
+    def test_bulk_create_expenses_batches(self):
+        self.client.login(username='user1', password='password1')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('expense_bulk_create'),
+                [
+                    {
+                        'category': category.pk,
+                        'timestamp': datetime.now(tz=timezone.utc),
+                        'amount': 10,
+                    } for category in [self.budget_category1, self.budget_category2, self.budget_category3] * 2
+                ],
+                'application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(len([sql for sql in queries if sql.startswith('INSERT INTO "expenses_expense"')]), 3)
+        # Categories are resolved through the catalogue, loaded by at most one query
+        self.assertLessEqual(len([sql for sql in queries if 'budgets_budgetcategory' in sql]), 1)
+
+    @override_settings(EXPENSES_BULK_CREATE_MAX_COUNT=2)
+    def test_bulk_create_expenses_too_many(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.post(
+            reverse('expense_bulk_create'),
+            [
+                {
+                    'timestamp': datetime.now(tz=timezone.utc),
+                    'amount': 10,
+                } for _ in range(3)
+            ],
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_expenses_unauthorized(self):
+        response = self.client.post(
+            reverse('expense_bulk_create'),
+            [],
+            'application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_list_expenses_valid(self):
         self.client.login(username='user1', password='password1')
         response = self.client.get(
@@ -256,6 +393,24 @@ class ExpensesTests(TestCase):
         self.assertEqual(response.json()['results'][1]['id'], self.budget_category1.pk)
         self.assertEqual(response.json()['results'][2]['id'], self.budget_category3.pk)
 
+    def test_get_expenses_by_category_with_ordering(self):
+        Expense.objects.create(
+            name='Expense 3',
+            category=self.budget_category1,
+            timestamp=datetime.now(tz=timezone.utc),
+            amount=25.00,
+            user=self.user1
+        )
+        self.client.login(username='user1', password='password1')
+        # Ordering the expenses doesn't change the totals
+        response = self.client.get(
+            reverse('expenses_by_category'),
+            {'ordering': 'amount'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['id'], self.budget_category1.pk)
+        self.assertEqual(response.json()['results'][0]['total_amount'], 75)
+
     def test_get_expenses_by_category_unauthorized(self):
         response = self.client.get(
             reverse('expenses_by_category')
@@ -269,8 +424,1432 @@ class ExpensesTests(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_expenses_csv_streams_own_expenses(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(
+            reverse('expenses_csv_export')
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 2)  # Header, and only this user's expense
+        self.assertEqual(rows[0], 'Name,Date,Time,Description,Category,Amount,ID')
+        self.assertTrue(rows[1].startswith('Expense 1,'))
+        self.assertTrue(rows[1].endswith(f',category1,50.00,{self.expense1.pk}'))
+
+    def test_get_expenses_csv_filtered(self):
+        Expense.objects.create(
+            name='Expense 3',
+            category=self.budget_category2,
+            timestamp=datetime.now(tz=timezone.utc),
+            amount=20.00,
+            user=self.user1,
+        )
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(
+            reverse('expenses_csv_export'),
+            {'category': self.budget_category2.pk}
+        )
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith('Expense 3,'))
+
+        response = self.client.get(
+            reverse('expenses_csv_export'),
+            {'ordering': 'amount'}
+        )
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(rows[1].startswith('Expense 3,'))
+        self.assertTrue(rows[2].startswith('Expense 1,'))
+
     def test_get_expenses_csv_unauthorized(self):
         response = self.client.get(
             reverse('expenses_csv_export')
         )
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExpenseImportTests(TestCase):
+    OFX_STATEMENT = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20230805120000[-5:EST]
+<TRNAMT>-12.34
+<FITID>1
+<NAME>Coffee Shop
+<MEMO>Latte
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20230806<TRNAMT>1000.00<FITID>2<NAME>Paycheck</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20230807<TRNAMT>-60.00<FITID>3<NAME>Gas Station</STMTTRN>
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='Food')
+        cls.budget_category2 = BudgetCategory.objects.create(name='Gas')
+        Expense.objects.create(
+            name='Groceries',
+            category=cls.budget_category1,
+            timestamp=datetime(2023, 8, 1, 17, 30, tzinfo=timezone.utc),
+            amount=85.20,
+            user=cls.user1,
+        )
+        Expense.objects.create(
+            name=None,
+            description='Fill up',
+            category=cls.budget_category2,
+            timestamp=datetime(2023, 8, 3, 8, 5, tzinfo=timezone.utc),
+            amount=40,
+            user=cls.user1,
+        )
+
+    def import_file(self, name, content, **data):
+        return self.client.post(
+            reverse('expense_import'),
+            {
+                'file': SimpleUploadedFile(name, content.encode()),
+                **data,
+            }
+        )
+
+    def test_import_csv_export_round_trip(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('expenses_csv_export'))
+        exported = b''.join(response.streaming_content).decode()
+
+        # Importing into the same account finds only duplicates
+        response = self.import_file('expenses.csv', exported)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['rows'], 2)
+        self.assertEqual(response.json()['duplicates'], 2)
+        self.assertEqual(response.json()['created'], 0)
+
+        # But into another account, the expenses are recreated
+        self.client.login(username='user2', password='password2')
+        response = self.import_file('expenses.csv', exported)
+        self.assertEqual(response.json()['created'], 2)
+        imported = Expense.objects.filter(user=self.user2).order_by('timestamp')
+        self.assertEqual(
+            [(expense.name, expense.description, expense.category, expense.amount, expense.timestamp) for expense in imported],
+            [
+                ('Groceries', None, self.budget_category1, Decimal('85.20'), datetime(2023, 8, 1, 17, 30, tzinfo=timezone.utc)),
+                (None, 'Fill up', self.budget_category2, Decimal('40.00'), datetime(2023, 8, 3, 8, 5, tzinfo=timezone.utc)),
+            ]
+        )
+
+    @override_settings(EXPENSES_BULK_CREATE_BATCH_SIZE=2)
+    def test_import_bank_csv(self):
+        self.client.login(username='user2', password='password2')
+        response = self.import_file(
+            'statement.csv',
+            'Transaction Date,Payee,Memo,Amount,Category\n'
+            '2023-08-10,Diner,,"$1,012.50",food\n'
+            '2023-08-10,Diner,,"$1,012.50",food\n'  # Repeated row
+            'not a date,Diner,,5,\n'
+            '2023-08-11,Unknown,,abc,\n'
+            '2023-08-12,Hardware Store,Nails,7.25,Hardware\n'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        result = response.json()
+        self.assertEqual(result['rows'], 5)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['duplicates'], 1)
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual([error['line'] for error in result['errors']], [4, 5])
+        self.assertEqual(Expense.objects.get(user=self.user2, name='Diner').category, self.budget_category1)
+        self.assertEqual(Expense.objects.get(user=self.user2, name='Hardware Store').category, None)
+
+    def test_import_ofx(self):
+        self.client.login(username='user2', password='password2')
+        response = self.import_file('statement.ofx', self.OFX_STATEMENT)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['created'], 2)  # The credit isn't an expense
+        coffee = Expense.objects.get(user=self.user2, name='Coffee Shop')
+        self.assertEqual(coffee.amount, Decimal('12.34'))
+        self.assertEqual(coffee.description, 'Latte')
+        self.assertEqual(coffee.timestamp, datetime(2023, 8, 5, 17, 0, tzinfo=timezone.utc))
+
+    def test_import_unauthorized(self):
+        response = self.import_file('statement.ofx', self.OFX_STATEMENT)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_expenses_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ofx', delete=False) as statement:
+            statement.write(self.OFX_STATEMENT)
+        stdout = StringIO()
+        try:
+            call_command('import_expenses', statement.name, user='user2', stdout=stdout)
+        finally:
+            os.remove(statement.name)
+        self.assertIn('2 created', stdout.getvalue())
+        self.assertIn('rows/s', stdout.getvalue())
+        self.assertEqual(Expense.objects.filter(user=self.user2).count(), 2)
+
+
+class ExpenseTimeSeriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        for timestamp, category, amount in [
+            (datetime(2023, 1, 2, 9, tzinfo=timezone.utc), cls.budget_category1, 10),  # Monday
+            (datetime(2023, 1, 2, 18, tzinfo=timezone.utc), cls.budget_category1, 5),
+            (datetime(2023, 1, 8, 23, tzinfo=timezone.utc), cls.budget_category1, 1),  # Sunday
+            (datetime(2023, 1, 9, tzinfo=timezone.utc), cls.budget_category2, 20),  # Monday
+            (datetime(2023, 1, 31, 23, 59, tzinfo=timezone.utc), None, 7.5),
+            (datetime(2023, 2, 1, tzinfo=timezone.utc), cls.budget_category1, 100),
+        ]:
+            Expense.objects.create(name='Expense', timestamp=timestamp, category=category, amount=amount, user=cls.user1)
+        Expense.objects.create(name='Other user', timestamp=datetime(2023, 1, 2, tzinfo=timezone.utc),
+                               category=cls.budget_category1, amount=1000, user=cls.user2)
+
+    def get_time_series(self, **params):
+        response = self.client.get(reverse('expenses_timeseries'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (entry['bucket'], entry['category'], entry['total_amount'], entry['count'])
+            for entry in response.json()
+        ]
+
+    def test_time_series_by_month(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_time_series(bucket='month'), [
+            ('2023-01-01', self.budget_category1.pk, 16, 3),
+            ('2023-01-01', self.budget_category2.pk, 20, 1),
+            ('2023-01-01', None, 7.5, 1),
+            ('2023-02-01', self.budget_category1.pk, 100, 1),
+        ])
+        # Monthly buckets are the default
+        self.assertEqual(self.get_time_series(), self.get_time_series(bucket='month'))
+
+    def test_time_series_by_week(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_time_series(bucket='week'), [
+            ('2023-01-02', self.budget_category1.pk, 16, 3),
+            ('2023-01-09', self.budget_category2.pk, 20, 1),
+            ('2023-01-30', self.budget_category1.pk, 100, 1),
+            ('2023-01-30', None, 7.5, 1),
+        ])
+
+    def test_time_series_by_day(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_time_series(bucket='day'), [
+            ('2023-01-02', self.budget_category1.pk, 15, 2),
+            ('2023-01-08', self.budget_category1.pk, 1, 1),
+            ('2023-01-09', self.budget_category2.pk, 20, 1),
+            ('2023-01-31', None, 7.5, 1),
+            ('2023-02-01', self.budget_category1.pk, 100, 1),
+        ])
+
+    def test_time_series_filtered(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_time_series(
+            bucket='month',
+            category=self.budget_category1.pk,
+            timestamp__lte='2023-01-31T00:00:00Z',
+        ), [
+            ('2023-01-01', self.budget_category1.pk, 16, 3),
+        ])
+
+    def test_time_series_single_query(self):
+        self.client.login(username='user1', password='password1')
+        # session + user + time series
+        with self.assertNumQueries(3):
+            self.client.get(reverse('expenses_timeseries'), {'bucket': 'day'})
+
+    def test_time_series_invalid_bucket(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('expenses_timeseries'), {'bucket': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('bucket', response.json())
+
+    def test_time_series_unauthorized(self):
+        response = self.client.get(reverse('expenses_timeseries'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExpenseRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        cls.expense1 = Expense.objects.create(
+            category=cls.budget_category1,
+            timestamp=datetime(2023, 7, 31, 23, 59, tzinfo=timezone.utc),
+            amount=10.10,
+            user=cls.user1,
+        )
+        cls.expense2 = Expense.objects.create(
+            category=cls.budget_category1,
+            timestamp=datetime(2023, 8, 1, tzinfo=timezone.utc),
+            amount=20,
+            user=cls.user1,
+        )
+        cls.expense3 = Expense.objects.create(
+            category=cls.budget_category2,
+            timestamp=datetime(2023, 8, 15, tzinfo=timezone.utc),
+            amount=5.5,
+            user=cls.user1,
+        )
+
+    def get_rollups(self):
+        return {
+            (rollup.category_id, rollup.month.isoformat()): (rollup.total_amount, rollup.count)
+            for rollup in ExpenseRollup.objects.filter(count__gt=0)
+        }
+
+    def assertRollupsRebuildTheSame(self):
+        rollups = self.get_rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(rollups, self.get_rollups())
+
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+
+    def test_rollups_follow_expense_writes(self):
+        self.assertEqual(self.get_rollups(), {
+            (self.budget_category1.pk, '2023-07-01'): (Decimal('10.10'), 1),
+            (self.budget_category1.pk, '2023-08-01'): (Decimal('20.00'), 1),
+            (self.budget_category2.pk, '2023-08-01'): (Decimal('5.50'), 1),
+        })
+        self.expense2.amount = 25
+        self.expense2.category = None
+        self.expense2.save()
+        self.expense3.timestamp = datetime(2023, 7, 1, tzinfo=timezone.utc)
+        self.expense3.save()
+        self.expense1.delete()
+        self.assertEqual(self.get_rollups(), {
+            (None, '2023-08-01'): (Decimal('25.00'), 1),
+            (self.budget_category2.pk, '2023-07-01'): (Decimal('5.50'), 1),
+        })
+        self.assertRollupsRebuildTheSame()
+
+    def test_rollups_follow_bulk_create(self):
+        self.client.login(username='user1', password='password1')
+        self.client.post(
+            reverse('expense_bulk_create'),
+            [
+                {
+                    'category': self.budget_category2.pk,
+                    'timestamp': datetime(2023, 8, day, tzinfo=timezone.utc),
+                    'amount': 1.25,
+                } for day in range(1, 5)
+            ],
+            'application/json'
+        )
+        self.assertEqual(self.get_rollups()[(self.budget_category2.pk, '2023-08-01')], (Decimal('10.50'), 5))
+        self.assertRollupsRebuildTheSame()
+
+    def test_rollups_follow_category_deletion(self):
+        self.budget_category1.delete()
+        category_catalogue.invalidate()
+        self.assertEqual(self.get_rollups(), {
+            (None, '2023-07-01'): (Decimal('10.10'), 1),
+            (None, '2023-08-01'): (Decimal('20.00'), 1),
+            (self.budget_category2.pk, '2023-08-01'): (Decimal('5.50'), 1),
+        })
+        self.assertRollupsRebuildTheSame()
+
+    def get_expenses_by_category(self, params, uses_rollups):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('expenses_by_category'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queried_expenses = any('FROM "expenses_expense"' in query['sql'] for query in context.captured_queries)
+        self.assertEqual(queried_expenses, not uses_rollups, params)
+        return {category['id']: category['total_amount'] for category in response.json()['results']}
+
+    def test_expenses_by_category_from_rollups(self):
+        self.client.login(username='user1', password='password1')
+        for params, totals in [
+            ({}, {self.budget_category1.pk: 30.1, self.budget_category2.pk: 5.5}),
+            (
+                {'timestamp__gte': '2023-08-01T00:00:00Z'},
+                {self.budget_category1.pk: 20, self.budget_category2.pk: 5.5}
+            ),
+            (
+                {'timestamp__lte': '2023-07-31T23:59:59.999999Z', 'category': self.budget_category1.pk},
+                {self.budget_category1.pk: 10.1, self.budget_category2.pk: 0}
+            ),
+            (
+                {'timestamp__gte': '2023-08-01T00:00:00Z', 'category__in': f'{self.budget_category2.pk}'},
+                {self.budget_category1.pk: 0, self.budget_category2.pk: 5.5}
+            ),
+        ]:
+            self.assertEqual(self.get_expenses_by_category(params, uses_rollups=True), totals)
+
+    def test_expenses_by_category_not_month_aligned(self):
+        self.client.login(username='user1', password='password1')
+        for params, totals in [
+            (
+                {'timestamp__gte': '2023-08-01T00:00:01Z'},
+                {self.budget_category1.pk: 0, self.budget_category2.pk: 5.5}
+            ),
+            (
+                {'timestamp__lte': '2023-07-31T23:59:00Z'},
+                {self.budget_category1.pk: 10.1, self.budget_category2.pk: 0}
+            ),
+            (
+                {'search': 'expense'},
+                {self.budget_category1.pk: 0, self.budget_category2.pk: 0}
+            ),
+        ]:
+            self.assertEqual(self.get_expenses_by_category(params, uses_rollups=False), totals)
+
+
+@shared_cache
+class ExpenseResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        Expense.objects.create(
+            name='Expense 1',
+            timestamp=datetime(2023, 5, 10, tzinfo=timezone.utc),
+            category=cls.budget_category1,
+            amount=10,
+            user=cls.user1,
+        )
+
+    def setUp(self):
+        cache.clear()  # Cached responses would outlive the data rolled back after each test
+
+    def get_spending(self, **params):
+        response = self.client.get(reverse('expenses_by_category'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {category['id']: category['total_amount'] for category in response.json()['results']}
+
+    def test_expenses_by_category_cached(self):
+        self.client.login(username='user1', password='password1')
+        url = reverse('expenses_by_category')
+        first_response = self.client.get(url + f'?category={self.budget_category1.pk}&search=Expense')
+        # Same parameters in another order: session + user, and nothing else
+        with self.assertNumQueries(2):
+            response = self.client.get(url + f'?search=Expense&category={self.budget_category1.pk}')
+        self.assertEqual(response.json(), first_response.json())
+        # Different parameters aren't served from the cache
+        self.assertEqual(self.get_spending(search='Nothing')[self.budget_category1.pk], 0)
+
+    def test_expense_writes_invalidate_cache(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_spending()[self.budget_category1.pk], 10)
+        self.client.post(reverse('expense_list'), {
+            'name': 'Expense 2',
+            'timestamp': '2023-05-11T00:00:00Z',
+            'category': self.budget_category1.pk,
+            'amount': 5,
+        }, 'application/json')
+        self.assertEqual(self.get_spending()[self.budget_category1.pk], 15)
+        self.client.post(reverse('expense_bulk_create'), [{
+            'name': 'Expense 3',
+            'timestamp': '2023-05-12T00:00:00Z',
+            'category': self.budget_category2.pk,
+            'amount': 7,
+        }], 'application/json')
+        self.assertEqual(self.get_spending()[self.budget_category2.pk], 7)
+        Expense.objects.filter(name='Expense 3').delete()
+        self.assertEqual(self.get_spending()[self.budget_category2.pk], 0)
+
+    def test_cache_is_per_user(self):
+        self.client.login(username='user1', password='password1')
+        self.assertEqual(self.get_spending()[self.budget_category1.pk], 10)
+        self.client.login(username='user2', password='password2')
+        self.assertEqual(self.get_spending()[self.budget_category1.pk], 0)
+        # Other users' writes don't invalidate the cache
+        Expense.objects.create(
+            name='Expense 4',
+            timestamp=datetime(2023, 5, 10, tzinfo=timezone.utc),
+            category=self.budget_category1,
+            amount=3,
+            user=self.user2,
+        )
+        self.client.login(username='user1', password='password1')
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_spending()[self.budget_category1.pk], 10)
+
+    @override_settings(SHARED_CACHE=False, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    })
+    def test_not_cached_without_shared_cache(self):
+        # Without Redis, other instances couldn't invalidate this one's responses
+        self.client.login(username='user1', password='password1')
+        url = reverse('expenses_by_category')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertGreater(len(queries), 2)
+        self.assertNotIn('ETag', response.headers)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@shared_cache
+class ExpenseConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.expense1 = Expense.objects.create(
+            name='Expense 1',
+            timestamp=datetime(2023, 5, 10, tzinfo=timezone.utc),
+            category=cls.budget_category1,
+            amount=10,
+            user=cls.user1,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='user1', password='password1')
+
+    def test_list_not_modified(self):
+        url = reverse('expense_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+        # session + user, and no expenses
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['ETag'], etag)
+        # Dates only have whole seconds, so they can't tell writes in the same second apart
+        self.assertNotIn('Last-Modified', response.headers)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Other pages and formats are other representations
+        response = self.client.get(url + '?cursor=', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_change_etag(self):
+        url = reverse('expense_list')
+        etag = self.client.get(url).headers['ETag']
+        self.client.patch(reverse('expense_detail', kwargs={'pk': self.expense1.pk}), {
+            'amount': 20,
+        }, 'application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['amount'], '20.00')
+        etag = response.headers['ETag']
+        self.client.post(reverse('expense_bulk_create'), [{
+            'name': 'Expense 2',
+            'timestamp': '2023-05-12T00:00:00Z',
+            'category': self.budget_category1.pk,
+            'amount': 7,
+        }], 'application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+        # Categories are part of the response
+        etag = response.headers['ETag']
+        self.budget_category1.name = 'renamed'
+        self.budget_category1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_not_modified(self):
+        url = reverse('expense_detail', kwargs={'pk': self.expense1.pk})
+        etag = self.client.get(url).headers['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Each expense has its own ETag
+        expense2 = Expense.objects.create(
+            name='Expense 2',
+            timestamp=datetime(2023, 5, 10, tzinfo=timezone.utc),
+            amount=10,
+            user=self.user1,
+        )
+        etag = self.client.get(url).headers['ETag']
+        other_url = reverse('expense_detail', kwargs={'pk': expense2.pk})
+        response = self.client.get(other_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.client.delete(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_checks_permissions_first(self):
+        url = reverse('expense_detail', kwargs={'pk': self.expense1.pk})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.login(username='user2', password='password2')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('expense_detail', kwargs={'pk': 0}), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_etag_is_per_user(self):
+        url = reverse('expense_list')
+        etag = self.client.get(url).headers['ETag']
+        self.client.login(username='user2', password='password2')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [])
+        # Other users' writes don't change the ETag
+        etag = response.headers['ETag']
+        Expense.objects.create(
+            name='Expense 3',
+            timestamp=datetime(2023, 5, 10, tzinfo=timezone.utc),
+            amount=3,
+            user=self.user1,
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_unauthorized(self):
+        self.client.logout()
+        response = self.client.get(reverse('expense_list'), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExpenseQueryCountTests(TestCase):
+    """
+    Makes sure the number of queries issued by the expense endpoints doesn't
+    grow with the number of expenses returned (no N+1 lookups of related objects)
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget_categories = [
+            BudgetCategory.objects.create(name=f'category{i}') for i in range(5)
+        ]
+
+    def create_expenses(self, count):
+        Expense.objects.bulk_create([
+            Expense(
+                name=f'Expense {i}',
+                category=self.budget_categories[i % len(self.budget_categories)],
+                timestamp=datetime.now(tz=timezone.utc),
+                amount=10 + i,
+                user=self.user1,
+            ) for i in range(count)
+        ])
+
+    def test_list_expenses_query_count_constant(self):
+        self.client.login(username='user1', password='password1')
+        created = 0
+        for page_size in (1, 5, 20):
+            self.create_expenses(page_size - created)
+            created = page_size
+            # session + user + count + page
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('expense_list'))
+            self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_csv_export_query_count_constant(self):
+        self.client.login(username='user1', password='password1')
+        created = 0
+        for expense_count in (1, 10, 50):
+            self.create_expenses(expense_count - created)
+            created = expense_count
+            # session + user + expenses
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('expenses_csv_export'))
+                rows = b''.join(response.streaming_content).decode().splitlines()
+            self.assertEqual(len(rows), expense_count + 1)
+
+    def test_retrieve_expense_query_count(self):
+        self.create_expenses(1)
+        expense = Expense.objects.get()
+        self.client.login(username='user1', password='password1')
+        # session + user + expense
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('expense_detail', kwargs={
+                'pk': expense.pk
+            }))
+        self.assertEqual(response.json()['category']['name'], 'category0')
+
+
+class ExpenseIndexTests(TestCase):
+    """
+    Runs EXPLAIN on the queries the expense endpoints issue (for each combination
+    of ExpensesFilter parameters) to make sure the composite indexes get used
+    """
+    FILTER_COMBINATIONS = [
+        {},
+        {'category': 'category1'},
+        {'category__in': 'category1,category2'},
+        {'timestamp__gte': '2023-01-01T00:00:00Z'},
+        {'timestamp__lte': '2023-12-31T23:59:59Z'},
+        {'timestamp__gte': '2023-01-01T00:00:00Z', 'timestamp__lte': '2023-12-31T23:59:59Z'},
+        {'category': 'category1', 'timestamp__gte': '2023-01-01T00:00:00Z', 'timestamp__lte': '2023-12-31T23:59:59Z'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+
+    def get_filtered_queryset(self, params):
+        # Filters take category primary keys, so substitute them for the names above
+        categories = {
+            'category1': str(self.budget_category1.pk),
+            'category2': str(self.budget_category2.pk),
+        }
+        data = {
+            key: ','.join(categories.get(value, value) for value in values.split(','))
+            for key, values in params.items()
+        }
+        return ExpensesFilter(data, queryset=Expense.objects.filter(user=self.user1)).qs
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables always favour a sequential scan, so rule that out
+            # to see whether the planner *can* use the indexes
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesExpenseIndex(self, queryset):
+        plan = self.explain(queryset)
+        self.assertTrue(
+            'expense_user_timestamp_idx' in plan or 'expense_user_cat_timestamp_idx' in plan,
+            plan
+        )
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('SCAN expenses_expense', plan)
+        return plan
+
+    def test_list_queries_use_index(self):
+        for params in self.FILTER_COMBINATIONS:
+            with self.subTest(params=params):
+                plan = self.assertUsesExpenseIndex(self.get_filtered_queryset(params))
+                if connection.vendor == 'sqlite':
+                    # Ordering by -timestamp should come straight from the index
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_category_aggregate_queries_use_index(self):
+        for params in self.FILTER_COMBINATIONS:
+            with self.subTest(params=params):
+                queryset = self.get_filtered_queryset(params)\
+                    .values('category_id')\
+                    .annotate(total=Sum('amount'))\
+                    .order_by()
+                self.assertUsesExpenseIndex(queryset)
+
+
+class ExpenseKeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create([
+            Expense(
+                name=f'Expense {i}',
+                # Pairs of expenses share a timestamp, so pages have to break ties by ID
+                timestamp=start + timedelta(hours=i // 2, microseconds=123),
+                amount=10 + i,
+                user=cls.user1,
+            ) for i in range(45)
+        ] + [
+            Expense(name='Other user', timestamp=start, amount=1, user=cls.user2)
+        ])
+
+    def get_all_pages(self, url):
+        ids = []
+        pages = 0
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertNotIn('count', data)
+            ids += [expense['id'] for expense in data['results']]
+            url = data['next']
+            pages += 1
+        return ids, pages
+
+    def test_keyset_pages_cover_all_expenses_in_order(self):
+        self.client.login(username='user1', password='password1')
+        ids, pages = self.get_all_pages(reverse('expense_list') + '?cursor=')
+        expected_ids = list(
+            Expense.objects.filter(user=self.user1).order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected_ids)
+        self.assertEqual(pages, 3)
+
+    def test_keyset_pages_keep_filters(self):
+        self.client.login(username='user1', password='password1')
+        ids, pages = self.get_all_pages(
+            reverse('expense_list') + '?cursor=&page_size=20&timestamp__gte=2023-01-01T10:00:00Z'
+        )
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(pages, 2)
+
+    def test_keyset_page_skips_count(self):
+        self.client.login(username='user1', password='password1')
+        # session + user + page (no count)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('expense_list') + '?cursor=')
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_page_number_pagination_by_default(self):
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('expense_list'), {'page': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 45)
+        self.assertIsNotNone(response.json()['previous'])
+
+    def test_invalid_cursor(self):
+        self.client.login(username='user1', password='password1')
+        for cursor in ('not-a-cursor', 'WzFd', 'WyJub3QgYSBkYXRlIiwgMV0='):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('expense_list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@benchmark
+class ExpensePaginationBenchmarkTests(TestCase):
+    """
+    Compares page 1 and page 5000 (of 20 expenses each) with page number and
+    keyset pagination
+    """
+    EXPENSE_COUNT = 100_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create((
+            Expense(
+                name=f'Expense {i}',
+                timestamp=start + timedelta(minutes=i),
+                amount=10,
+                user=cls.user1,
+            ) for i in range(cls.EXPENSE_COUNT)
+        ), batch_size=5000)
+
+    def test_benchmark_deep_pages(self):
+        self.client.login(username='user1', password='password1')
+        url = reverse('expense_list')
+        last_page = self.EXPENSE_COUNT // 20
+        # The cursor of the page 5000 starts after the last expense of page 4999
+        paginator = KeysetPagination()
+        paginator.ordering = ExpenseListCreateView.keyset_ordering
+        previous_expense = Expense.objects.order_by('-timestamp', '-id')[(last_page - 1) * 20 - 1]
+        last_page_cursor = paginator.encode_cursor(previous_expense)
+        self.assertEqual(len(self.client.get(url, {'cursor': last_page_cursor}).json()['results']), 20)
+
+        for name, params in [
+            ('page number, page 1', {'page': 1}),
+            (f'page number, page {last_page}', {'page': last_page}),
+            ('keyset, page 1', {'cursor': ''}),
+            (f'keyset, page {last_page}', {'cursor': last_page_cursor}),
+        ]:
+            seconds = time_call(self.client.get, url, params, repeat=10)
+            report(f'expense list, {name}', ms_per_request=f'{seconds * 1000:.2f}')
+
+
+class ExpenseSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        timestamp = datetime(2023, 5, 10, tzinfo=timezone.utc)
+        cls.groceries = Expense.objects.create(
+            name='Groceries',
+            description='Weekly shopping at the corner store',
+            timestamp=timestamp,
+            category=cls.budget_category1,
+            amount=50,
+            user=cls.user1,
+        )
+        cls.rent = Expense.objects.create(
+            name='Rent',
+            description=None,
+            timestamp=timestamp - timedelta(days=1),
+            amount=1000,
+            user=cls.user1,
+        )
+        cls.grocery_store = Expense.objects.create(
+            name='Grocery store',
+            description='Groceries, grocery bags',
+            timestamp=timestamp - timedelta(days=2),
+            category=cls.budget_category1,
+            amount=20,
+            user=cls.user1,
+        )
+        Expense.objects.create(
+            name='Groceries',
+            timestamp=timestamp,
+            amount=30,
+            user=cls.user2,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='user1', password='password1')
+
+    def search(self, search, **params):
+        response = self.client.get(reverse('expense_list'), {'search': search, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [expense['id'] for expense in response.json()['results']]
+
+    def test_search_matches_word_prefixes(self):
+        self.assertCountEqual(self.search('groc'), [self.groceries.pk, self.grocery_store.pk])
+        self.assertEqual(self.search('RENT'), [self.rent.pk])
+        # Middle of words
+        self.assertEqual(self.search('ocer'), [])
+
+    def test_search_requires_every_word(self):
+        # Words can be in the name or the description
+        self.assertCountEqual(self.search('groceries store'), [self.groceries.pk, self.grocery_store.pk])
+        self.assertEqual(self.search('weekly groc'), [self.groceries.pk])
+        self.assertEqual(self.search('weekly rent'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_search_ranked_by_relevance(self):
+        # "grocer" starts more words of the older one
+        self.assertEqual(self.search('grocer'), [self.grocery_store.pk, self.groceries.pk])
+        # Unless another ordering is requested
+        self.assertEqual(self.search('grocer', ordering='-amount'), [self.groceries.pk, self.grocery_store.pk])
+
+    def test_search_with_filters(self):
+        self.assertEqual(self.search('groc', amount=50, timestamp__gte='2023-05-09T00:00:00Z'), [self.groceries.pk])
+        self.assertCountEqual(self.search('groc', cursor=''), [self.groceries.pk, self.grocery_store.pk])
+
+    def test_search_index_kept_up_to_date(self):
+        self.rent.name = 'Mortgage'
+        self.rent.save()
+        self.assertEqual(self.search('rent'), [])
+        self.assertEqual(self.search('mortgage'), [self.rent.pk])
+        self.groceries.delete()
+        self.assertEqual(self.search('groc'), [self.grocery_store.pk])
+        self.client.post(reverse('expense_bulk_create'), [{
+            'name': 'Electricity',
+            'timestamp': '2023-05-11T00:00:00Z',
+            'amount': 70,
+        }], 'application/json')
+        self.assertEqual(len(self.search('electric')), 1)
+
+    def test_search_aggregates(self):
+        response = self.client.get(reverse('expenses_by_category'), {'search': 'groc'})
+        totals = {category['id']: category['total_amount'] for category in response.json()['results']}
+        self.assertEqual(totals[self.budget_category1.pk], 70)
+        response = self.client.get(reverse('expenses_timeseries'), {'search': 'groc'})
+        self.assertEqual(sum(bucket['total_amount'] for bucket in response.json()), 70)
+
+    def test_search_runs_full_text_query_once(self):
+        request = Request(RequestFactory().get('/', {'search': 'groc'}))
+        queryset = ExpenseSearchFilter().filter_queryset(request, Expense.objects.filter(user=self.user1), None)
+        if connection.vendor == 'sqlite':
+            # The index is scanned once to filter and once to rank the matches, rather
+            # than queried again for each expense (a lookup by rowid, "=" in the plan)
+            plan = queryset.explain()
+            self.assertEqual(plan.count('SCAN expenses_expense_fts VIRTUAL TABLE INDEX 0:M'), 2)
+            self.assertNotIn('0:=', plan)
+        self.assertCountEqual([expense.pk for expense in queryset], [self.groceries.pk, self.grocery_store.pk])
+
+    def test_search_index_triggers_exist(self):
+        # Migrations that make SQLite rebuild expenses_expense drop its triggers
+        # (see migration 0004), which would silently stop indexing new expenses
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expenses_expense'"
+            )
+            triggers = {row[0] for row in cursor.fetchall()}
+        self.assertEqual(triggers, {
+            'expenses_expense_fts_insert', 'expenses_expense_fts_delete', 'expenses_expense_fts_update',
+        })
+        self.assertEqual(check_expense_search_triggers(databases=['default']), [])
+
+    def test_search_index_triggers_check(self):
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            # As if a migration rebuilt the table (rolled back after this test)
+            cursor.execute('DROP TRIGGER expenses_expense_fts_update')
+        errors = check_expense_search_triggers(databases=['default'])
+        self.assertEqual([error.id for error in errors], ['expenses.E001'])
+        self.assertIn('expenses_expense_fts_update', errors[0].msg)
+
+
+@benchmark
+class ExpenseSearchBenchmarkTests(TestCase):
+    """
+    Compares searching with the full-text index and with the icontains scan
+    (DRF's SearchFilter) it replaced
+    """
+    EXPENSE_COUNT = 100_000
+    WORDS = [
+        'groceries', 'rent', 'coffee', 'restaurant', 'gas', 'electricity', 'movie', 'books', 'gym', 'pharmacy',
+        'taxi', 'flight', 'hotel', 'insurance', 'phone', 'internet', 'clothes', 'gift', 'parking', 'repairs',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        words = cls.WORDS
+        Expense.objects.bulk_create((
+            Expense(
+                name=f'{words[i % len(words)]} {i}',
+                description=f'{words[i * 7 % len(words)]} and {words[i * 13 % len(words)]}',
+                timestamp=start + timedelta(minutes=i),
+                amount=10,
+                user=cls.user1,
+            ) for i in range(cls.EXPENSE_COUNT)
+        ), batch_size=5000)
+
+    def test_benchmark_search(self):
+        request = RequestFactory().get('/', {'search': 'pharmacy hotel'})
+        request.user = self.user1
+        view = ExpenseListCreateView()
+        queryset = Expense.objects.filter(user=self.user1)
+        full_text_queryset = ExpenseSearchFilter().filter_queryset(Request(request), queryset, view)
+        scan_queryset = SearchFilter().filter_queryset(Request(request), queryset, view)
+        self.assertEqual(
+            set(full_text_queryset.values_list('id', flat=True)),
+            set(scan_queryset.values_list('id', flat=True)),
+        )
+
+        for name, search_queryset in [('full-text', full_text_queryset), ('icontains', scan_queryset)]:
+            first_page_seconds = time_call(lambda: list(search_queryset[:20]), repeat=10)
+            count_seconds = time_call(search_queryset.count, repeat=10)
+            report(
+                f'expense search, {name}',
+                first_page_ms=f'{first_page_seconds * 1000:.2f}',
+                count_ms=f'{count_seconds * 1000:.2f}',
+            )
+
+
+@shared_cache
+class AsyncExpenseViewTests(TestCase):
+    """
+    The async views serve the same responses as the sync ones (the test client
+    is routed to whichever settings.ASYNC_READ_VIEWS selects)
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.budget_category1 = BudgetCategory.objects.create(name='category1')
+        cls.budget_category2 = BudgetCategory.objects.create(name='category2')
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create([
+            Expense(
+                name=f'Expense {i}',
+                timestamp=start + timedelta(days=i),
+                category=cls.budget_category1 if i % 3 else cls.budget_category2,
+                amount=10 + i,
+                user=cls.user1,
+            ) for i in range(30)
+        ] + [
+            Expense(name='Other user', timestamp=start, amount=1, user=cls.user2)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.async_client.login(username='user1', password='password1')
+
+    async def get_async_response(self, view_class, url, params=None, headers=None, user=None):
+        request = AsyncRequestFactory().get(url, params or {}, headers=headers)
+        force_authenticate(request, user or self.user1)
+        response = await view_class.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    async def assertSameResponses(self, view_class, url, params=None):
+        response = await self.async_client.get(url, params or {})
+        async_response = await self.get_async_response(view_class, url, params)
+        self.assertEqual(async_response.status_code, response.status_code)
+        self.assertEqual(json.loads(async_response.content), response.json())
+        return async_response
+
+    async def test_async_expense_list(self):
+        self.assertTrue(asyncio.iscoroutinefunction(AsyncExpenseListCreateView.as_view()))
+        url = reverse('expense_list')
+        for params in [
+            {},
+            {'page': 2},
+            {'page': 3},
+            {'cursor': ''},
+            {'cursor': '', 'category': self.budget_category2.pk},
+            {'search': 'expense 2', 'ordering': 'amount'},
+            {'timestamp__gte': '2023-01-15T00:00:00Z'},
+        ]:
+            with self.subTest(params=params):
+                await self.assertSameResponses(AsyncExpenseListCreateView, url, params)
+        response = await self.get_async_response(AsyncExpenseListCreateView, url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_expense_list_not_modified(self):
+        url = reverse('expense_list')
+        response = await self.get_async_response(AsyncExpenseListCreateView, url)
+        response = await self.get_async_response(
+            AsyncExpenseListCreateView, url, headers={'If-None-Match': response.headers['ETag']}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_async_expense_list_create(self):
+        # Other methods go through the sync views
+        request = AsyncRequestFactory().post(reverse('expense_list'), {
+            'name': 'New expense',
+            'timestamp': '2023-05-11T00:00:00Z',
+            'amount': 5,
+        }, content_type='application/json')
+        force_authenticate(request, self.user1)
+        response = await AsyncExpenseListCreateView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(await Expense.objects.filter(name='New expense', user=self.user1).aexists())
+
+    async def test_async_expenses_by_category(self):
+        url = reverse('expenses_by_category')
+        for params in [
+            {},
+            # From rollups, or from the expenses
+            {'timestamp__gte': '2023-01-01T00:00:00Z', 'timestamp__lte': '2023-01-31T23:59:59Z'},
+            {'timestamp__gte': '2023-01-15T00:00:00Z'},
+            {'search': 'expense 1'},
+        ]:
+            with self.subTest(params=params):
+                await self.assertSameResponses(AsyncExpensesByCategoryView, url, params)
+        # Cached, even for the async view
+        response = await self.get_async_response(AsyncExpensesByCategoryView, url)
+        self.assertEqual(json.loads(response.content)['results'][0]['id'], self.budget_category1.pk)
+
+    async def test_async_view_unauthorized(self):
+        request = AsyncRequestFactory().get(reverse('expense_list'))
+        response = await AsyncExpenseListCreateView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExpenseCompiledSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.category1 = BudgetCategory.objects.create(
+            name='category1',
+            typical_percentage=15.50,
+        )
+        cls.expense1 = Expense.objects.create(
+            name='Expense 1',
+            description='Groceries',
+            timestamp=datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+            amount=Decimal('12.30'),
+            category=cls.category1,
+            user=cls.user1,
+        )
+        cls.expense2 = Expense.objects.create(
+            name=None,
+            timestamp=datetime(2023, 1, 3, tzinfo=timezone.utc),
+            amount=7,
+            user=cls.user1,
+        )
+
+    def test_same_json_as_serializer(self):
+        queryset = Expense.objects.select_related('user', 'category').order_by('id')
+        expected = JSONRenderer().render(ExpenseResponseSerializer(queryset, many=True).data)
+        rows = compiled_expense_response_serializer.get_values_queryset(queryset)
+        self.assertEqual(JSONRenderer().render(compiled_expense_response_serializer.serialize(rows)), expected)
+
+    def test_list_same_json_as_serializer(self):
+        self.client.login(username='user1', password='password1')
+        queryset = Expense.objects.select_related('user', 'category')
+        for params, expected_data in [
+            ({}, ExpenseResponseSerializer(queryset, many=True).data),
+            ({'cursor': ''}, ExpenseResponseSerializer(queryset.order_by('-timestamp', '-id'), many=True).data),
+            ({'ordering': 'category'}, ExpenseResponseSerializer(queryset.order_by('category'), many=True).data),
+        ]:
+            response = self.client.get(reverse('expense_list'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Decimals are rendered as strings, so the results can be rendered again as they were
+            self.assertEqual(JSONRenderer().render(response.json()['results']), JSONRenderer().render(expected_data))
+
+    def test_unsupported_field(self):
+        class ExpenseWithMethodSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = Expense
+                fields = [
+                    'name',
+                    'label',
+                ]
+
+            label = serializers.SerializerMethodField()
+
+        with self.assertRaises(ImproperlyConfigured):
+            CompiledSerializer(ExpenseWithMethodSerializer).get_values_queryset(Expense.objects.all())
+
+
+@benchmark
+class ExpenseSerializerBenchmarkTests(TestCase):
+    """
+    Compares serializing 100-expense pages with ExpenseResponseSerializer (from
+    model instances) and with its compiled fast path (from values())
+    """
+    PAGE_SIZE = 100
+    PAGE_COUNT = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        categories = BudgetCategory.objects.bulk_create(
+            BudgetCategory(name=f'category{i}', typical_percentage=i) for i in range(10)
+        )
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create(
+            Expense(
+                name=f'Expense {i}',
+                description=f'Description {i}',
+                timestamp=start + timedelta(minutes=i),
+                amount=Decimal(i) / 100,
+                category=categories[i % 10] if i % 7 else None,
+                user=cls.user1,
+            ) for i in range(cls.PAGE_SIZE * cls.PAGE_COUNT)
+        )
+
+    def test_benchmark_serialize(self):
+        queryset = Expense.objects.select_related('user', 'category').order_by('-timestamp', '-id')
+        pages = [
+            queryset[page * self.PAGE_SIZE:(page + 1) * self.PAGE_SIZE] for page in range(self.PAGE_COUNT)
+        ]
+        self.assertEqual(
+            JSONRenderer().render(ExpenseResponseSerializer(pages[0], many=True).data),
+            JSONRenderer().render(
+                compiled_expense_response_serializer.serialize(
+                    compiled_expense_response_serializer.get_values_queryset(pages[0])
+                )
+            ),
+        )
+        rows = self.PAGE_SIZE * self.PAGE_COUNT
+        instances = [list(page) for page in pages]
+        values = [list(compiled_expense_response_serializer.get_values_queryset(page)) for page in pages]
+
+        for name, serialize, fetch_and_serialize in [
+            (
+                'serializer',
+                lambda: [ExpenseResponseSerializer(page, many=True).data for page in instances],
+                # all() so each call queries the database again
+                lambda: [ExpenseResponseSerializer(page.all(), many=True).data for page in pages],
+            ),
+            (
+                'compiled',
+                lambda: [compiled_expense_response_serializer.serialize(page) for page in values],
+                lambda: [
+                    compiled_expense_response_serializer.serialize(
+                        compiled_expense_response_serializer.get_values_queryset(page)
+                    ) for page in pages
+                ],
+            ),
+        ]:
+            serialize_seconds = time_call(serialize)
+            fetch_and_serialize_seconds = time_call(fetch_and_serialize)
+            report(
+                f'expense response serializer, {name}',
+                serialize_rows_per_second=f'{rows / serialize_seconds:.0f}',
+                fetch_and_serialize_rows_per_second=f'{rows / fetch_and_serialize_seconds:.0f}',
+            )
+
+
+class ExpenseJSONExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        cls.user2 = User.objects.create_user(
+            username='user2',
+            email='user2@gmail.com',
+            password='password2',
+        )
+        cls.category1 = BudgetCategory.objects.create(name='category1')
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create(
+            Expense(
+                name=f'Expense {i}',
+                timestamp=start + timedelta(hours=i),
+                amount=Decimal(i) / 4,
+                category=cls.category1 if i % 2 else None,
+                user=cls.user1 if i % 5 else cls.user2,
+            ) for i in range(30)
+        )
+
+    def setUp(self):
+        self.client.login(username='user1', password='password1')
+
+    def get_export(self, params=None):
+        response = self.client.get(reverse('expenses_json_export'), params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return b''.join(response.streaming_content)
+
+    def test_export(self):
+        queryset = Expense.objects.filter(user=self.user1).select_related('user', 'category')
+        self.assertEqual(
+            self.get_export(),
+            JSONRenderer().render(ExpenseResponseSerializer(queryset, many=True).data),
+        )
+
+    def test_export_filtered_and_ordered(self):
+        queryset = Expense.objects.filter(user=self.user1, category=self.category1).order_by('amount')
+        self.assertEqual(
+            self.get_export({'category': self.category1.pk, 'ordering': 'amount'}),
+            JSONRenderer().render(ExpenseResponseSerializer(queryset, many=True).data),
+        )
+
+    def test_export_empty(self):
+        self.assertEqual(self.get_export({'search': 'nothing'}), b'[]')
+
+    def test_not_logged_in(self):
+        self.client.logout()
+        response = self.client.get(reverse('expenses_json_export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@benchmark
+class ExpenseRendererBenchmarkTests(TestCase):
+    """
+    Compares rendering and parsing 100-expense pages (as ExpenseResponseSerializer
+    gives them) with DRF's JSON renderer and parser and the orjson ones
+    """
+    PAGE_SIZE = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+        category = BudgetCategory.objects.create(name='Groceries', typical_percentage=12.5)
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        Expense.objects.bulk_create(
+            Expense(
+                name=f'Expense {i}',
+                description=f'Weekly shopping at the corner store, part {i}',
+                timestamp=start + timedelta(minutes=i, microseconds=i),
+                amount=Decimal(i) / 100,
+                category=category if i % 3 else None,
+                user=cls.user1,
+            ) for i in range(cls.PAGE_SIZE)
+        )
+
+    def test_benchmark_render_and_parse(self):
+        queryset = Expense.objects.select_related('user', 'category')
+        page = {
+            'count': self.PAGE_SIZE,
+            'next': None,
+            'previous': None,
+            'results': ExpenseResponseSerializer(queryset, many=True).data,
+        }
+        rendered = JSONRenderer().render(page)
+        self.assertEqual(ORJSONRenderer().render(page), rendered)
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(rendered)), JSONParser().parse(io.BytesIO(rendered)))
+
+        for name, renderer, parser in [
+            ('json', JSONRenderer(), JSONParser()),
+            ('orjson', ORJSONRenderer(), ORJSONParser()),
+        ]:
+            render_seconds = time_call(renderer.render, page, repeat=50)
+            parse_seconds = time_call(lambda: parser.parse(io.BytesIO(rendered)), repeat=50)
+            report(
+                f'expense page rendering, {name}',
+                render_us=f'{render_seconds * 1_000_000:.1f}',
+                parse_us=f'{parse_seconds * 1_000_000:.1f}',
+                render_rows_per_second=f'{self.PAGE_SIZE / render_seconds:.0f}',
+            )
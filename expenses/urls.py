@@ -1,10 +1,19 @@
+from django.conf import settings
 from django.urls import path
 
 from expenses.views import *
 
+if settings.ASYNC_READ_VIEWS:
+    ExpenseListCreateView = AsyncExpenseListCreateView
+    ExpensesByCategoryView = AsyncExpensesByCategoryView
+
 urlpatterns = [
     path('expenses', ExpenseListCreateView.as_view(), name='expense_list'),
+    path('expenses/bulk', ExpenseBulkCreateView.as_view(), name='expense_bulk_create'),
+    path('expenses/import', ExpenseImportView.as_view(), name='expense_import'),
     path('expenses/<int:pk>', ExpenseDetailView.as_view(), name='expense_detail'),
     path('expenses/by_category', ExpensesByCategoryView.as_view(), name='expenses_by_category'),
-    path('expenses/csv_export', ExpensesCSVExportView.as_view(), name='expenses_csv_export')
+    path('expenses/timeseries', ExpenseTimeSeriesView.as_view(), name='expenses_timeseries'),
+    path('expenses/csv_export', ExpensesCSVExportView.as_view(), name='expenses_csv_export'),
+    path('expenses/json_export', ExpensesJSONExportView.as_view(), name='expenses_json_export'),
 ]
@@ -1,18 +1,37 @@
 import csv
+import io
 
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Sum, F, FloatField, Subquery, OuterRef
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema
 from rest_framework import generics, permissions, status, views
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
 
-from expenses.filters import ExpensesFilter
+from expenses.filters import ExpenseSearchFilter, ExpensesFilter
+from expenses import rollups
+from expenses.importers import get_file_format, import_expenses
 from expenses.models import *
 from expenses.permissions import *
 from expenses.serializers import *
+from utils.caching import CachedResponseMixin, ConditionalGetMixin, bump_user_data_version
+from utils.pagination import KeysetPagination
+from utils.renderers import StreamingORJSONRenderer
 from utils.serializers import EmptySerializer
+from utils.views import AsyncReadMixin, CompiledListMixin
+
+
+class Echo:
+    """
+    File-like object whose write method just returns what it's given, so
+    csv.writer can be used to produce lines for a streaming response
+    """
+    def write(self, value):
+        return value
 
 
 @extend_schema(
@@ -20,13 +39,16 @@ from utils.serializers import EmptySerializer
     description='List/create expenses',
     responses=ExpenseResponseSerializer
 )
-class ExpenseListCreateView(generics.ListCreateAPIView):
+class ExpenseListCreateView(ConditionalGetMixin, CompiledListMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Expense.objects.all()
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
+    queryset = Expense.objects.select_related('user', 'category')
+    compiled_serializer = compiled_expense_response_serializer
+    filter_backends = (DjangoFilterBackend, ExpenseSearchFilter, OrderingFilter)
     filterset_class = ExpensesFilter
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'timestamp', 'description', 'category', 'amount']
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-timestamp', '-id')
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
@@ -48,14 +70,85 @@ class ExpenseListCreateView(generics.ListCreateAPIView):
         return views.Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
+class AsyncExpenseListCreateView(AsyncReadMixin, ExpenseListCreateView):
+    """
+    ExpenseListCreateView with an async GET, served instead under ASGI (see settings.ASYNC_READ_VIEWS)
+    """
+    def prepare_async_read(self, request, *args, **kwargs):
+        response = super().prepare_async_read(request, *args, **kwargs)
+        if response is None:
+            # Validating the filters may query the database
+            self.filtered_queryset = self.filter_queryset(self.get_queryset())
+        return response
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.compiled_serializer.get_values_queryset(self.filtered_queryset)
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        return self.get_paginated_response(self.compiled_serializer.serialize(page))
+
+
+@extend_schema(
+    tags=['Expenses'],
+    description='Create many expenses at once (e.g. imported from a bank). Either all of them are created, '
+                'or none are and the errors for each expense are returned (in the same order as the request).',
+    request=ExpenseBulkCreationSerializer(many=True),
+    responses={201: ExpenseBulkCreationResponseSerializer}
+)
+class ExpenseBulkCreateView(generics.CreateAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ExpenseBulkCreationSerializer
+
+    def create(self, request, *args, **kwargs):
+        request_serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            max_length=settings.EXPENSES_BULK_CREATE_MAX_COUNT,
+        )
+        request_serializer.is_valid(raise_exception=True)
+        expenses = [
+            Expense(**expense_data, user=request.user) for expense_data in request_serializer.validated_data
+        ]
+        with transaction.atomic():
+            Expense.objects.bulk_create(expenses, batch_size=settings.EXPENSES_BULK_CREATE_BATCH_SIZE)
+            # Bulk inserts don't send signals
+            rollups.add_expenses(expenses)
+            bump_user_data_version(request.user.pk)
+        response_serializer = ExpenseBulkCreationResponseSerializer({'count': len(expenses)})
+        return views.Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
+@extend_schema(
+    tags=['Expenses'],
+    description='Import expenses from a bank statement file (CSV, in the same format as the CSV export or a bank\'s '
+                'export, or OFX). Expenses that already exist are skipped, and invalid rows are reported.',
+    request={'multipart/form-data': ExpenseImportRequestSerializer},
+    responses={201: ExpenseImportResponseSerializer}
+)
+class ExpenseImportView(generics.CreateAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    parser_classes = (MultiPartParser,)
+    serializer_class = ExpenseImportRequestSerializer
+
+    def create(self, request, *args, **kwargs):
+        request_serializer = self.get_serializer(data=request.data)
+        request_serializer.is_valid(raise_exception=True)
+        uploaded_file = request_serializer.validated_data['file']
+        file_format = request_serializer.validated_data.get('format') or get_file_format(uploaded_file.name)
+        # Read the upload line by line rather than all at once
+        lines = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', errors='replace', newline='')
+        result = import_expenses(lines, request.user, file_format)
+        response_serializer = ExpenseImportResponseSerializer(result.as_dict())
+        return views.Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
 @extend_schema(
     tags=['Expenses'],
     description='Retrieve/update/delete expenses',
     responses=ExpenseResponseSerializer
 )
-class ExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ExpenseDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (permissions.IsAuthenticated, IsMyExpense)
-    queryset = Expense.objects.all()
+    queryset = Expense.objects.select_related('user', 'category')
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -67,11 +160,11 @@ class ExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
     tags=['Expenses'],
     description='Get total actual spending for each budget category'
 )
-class ExpensesByCategoryView(generics.ListAPIView):
+class ExpensesByCategoryView(ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ExpensesByCategorySerializer
     queryset = Expense.objects.all()
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
+    filter_backends = (DjangoFilterBackend, ExpenseSearchFilter, OrderingFilter)
     filterset_class = ExpensesFilter
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'timestamp', 'description', 'category', 'amount']
@@ -79,41 +172,140 @@ class ExpensesByCategoryView(generics.ListAPIView):
     def get_queryset(self):
         return Expense.objects.filter(user=self.request.user)
 
-    def get(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        categories_queryset = BudgetCategory.objects.get_actual_spending_by_category(queryset)
-        paginated_queryset = self.paginate_queryset(categories_queryset)
+    def get_rollup_queryset(self):
+        """
+        Gets the monthly rollups covering exactly the expenses the filters select,
+        or None if the filters can't be answered from rollups (searching, or
+        timestamp filters that don't line up with month boundaries)
+        """
+        if ExpenseSearchFilter().get_search_terms(self.request):
+            return None
+        filterset = self.filterset_class(self.request.query_params, queryset=self.get_queryset(), request=self.request)
+        if not filterset.is_valid() or filterset.form.cleaned_data.get('timestamp') is not None:
+            return None
+        month_range = rollups.get_month_range(
+            filterset.form.cleaned_data.get('timestamp__gte'),
+            filterset.form.cleaned_data.get('timestamp__lte'),
+        )
+        if month_range is None:
+            return None
+        first_month, last_month = month_range
+        queryset = ExpenseRollup.objects.filter(user=self.request.user)
+        if first_month is not None:
+            queryset = queryset.filter(month__gte=first_month)
+        if last_month is not None:
+            queryset = queryset.filter(month__lte=last_month)
+        for name in ('category', 'category__in'):
+            queryset = filterset.filters[name].filter(queryset, filterset.form.cleaned_data.get(name))
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        rollup_queryset = self.get_rollup_queryset()
+        if rollup_queryset is not None:
+            categories_spending = BudgetCategory.objects.get_actual_spending_by_category(
+                rollup_queryset,
+                amount_field='total_amount'
+            )
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            categories_spending = BudgetCategory.objects.get_actual_spending_by_category(queryset)
+        paginated_queryset = self.paginate_queryset(categories_spending)
+        serializer = self.get_serializer(paginated_queryset, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class AsyncExpensesByCategoryView(AsyncReadMixin, ExpensesByCategoryView):
+    """
+    ExpensesByCategoryView with an async GET, served instead under ASGI (see settings.ASYNC_READ_VIEWS)
+    """
+    def prepare_async_read(self, request, *args, **kwargs):
+        response = super().prepare_async_read(request, *args, **kwargs)
+        if response is None:
+            self.rollup_queryset = self.get_rollup_queryset()
+            if self.rollup_queryset is None:
+                self.filtered_queryset = self.filter_queryset(self.get_queryset())
+        return response
+
+    async def get(self, request, *args, **kwargs):
+        if self.rollup_queryset is not None:
+            categories_spending = await BudgetCategory.objects.aget_actual_spending_by_category(
+                self.rollup_queryset,
+                amount_field='total_amount'
+            )
+        else:
+            categories_spending = await BudgetCategory.objects.aget_actual_spending_by_category(
+                self.filtered_queryset
+            )
+        paginated_queryset = self.paginate_queryset(categories_spending)
         serializer = self.get_serializer(paginated_queryset, many=True)
         return self.get_paginated_response(serializer.data)
 
 
+@extend_schema(
+    tags=['Expenses'],
+    description='Get the total spending in each day, week or month (starting on the first day of the bucket, '
+                'in UTC), per budget category. Only buckets and categories with expenses are included.',
+    parameters=[ExpenseTimeSeriesRequestSerializer],
+    responses=ExpenseTimeSeriesSerializer(many=True)
+)
+class ExpenseTimeSeriesView(ConditionalGetMixin, generics.ListAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ExpenseTimeSeriesSerializer
+    queryset = Expense.objects.all()
+    filter_backends = (DjangoFilterBackend, ExpenseSearchFilter)
+    filterset_class = ExpensesFilter
+    search_fields = ['name', 'description']
+    pagination_class = None
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        request_serializer = ExpenseTimeSeriesRequestSerializer(data=request.query_params)
+        request_serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset())
+        time_series = queryset.get_spending_time_series(request_serializer.validated_data['bucket'])
+        serializer = self.get_serializer(time_series, many=True)
+        return views.Response(serializer.data)
+
+
 @extend_schema(
     tags=['Expenses'],
     description='Get a CSV file with the user\'s expenses (can be filtered)'
 )
-class ExpensesCSVExportView(generics.ListAPIView):
+class ExpensesCSVExportView(ConditionalGetMixin, generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = EmptySerializer
     queryset = Expense.objects.all()
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
+    filter_backends = (DjangoFilterBackend, ExpenseSearchFilter, OrderingFilter)
     filterset_class = ExpensesFilter
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'timestamp', 'description', 'category', 'amount']
+    chunk_size = 2000  # Number of expenses fetched from the database at a time
 
     def get_queryset(self):
-        return Expense.objects.filter(user=self.request.user)
+        return Expense.objects.filter(user=self.request.user).select_related('category')
 
     def get(self, request, *args, **kwargs):
-        response = HttpResponse(
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(
+            self.get_csv_rows(queryset),
             content_type="text/csv",
             headers={
                 'Content-Disposition': 'attachment;filename="expenses.csv"'
             }
         )
-        writer = csv.writer(response)
-        writer.writerow(['Name', 'Date', 'Time', 'Description', 'Category', 'Amount', 'ID'])
-        for expense in self.get_queryset():
-            writer.writerow([
+
+    def get_csv_rows(self, queryset):
+        """
+        Yields the CSV file line by line. Expenses are read in chunks (through a
+        server-side cursor where the database supports it), so memory use
+        doesn't grow with the number of expenses exported.
+        """
+        writer = csv.writer(Echo())
+        yield writer.writerow(['Name', 'Date', 'Time', 'Description', 'Category', 'Amount', 'ID'])
+        for expense in queryset.iterator(chunk_size=self.chunk_size):
+            yield writer.writerow([
                 expense.name or '-',
                 expense.timestamp.strftime('%m/%d/%Y'),
                 expense.timestamp.strftime('%I:%M %p'),
@@ -123,7 +315,33 @@ class ExpensesCSVExportView(generics.ListAPIView):
                 expense.pk
             ])
 
-        return response
 
+@extend_schema(
+    tags=['Expenses'],
+    description='Get all of the user\'s expenses (can be filtered) as one JSON array, streamed',
+    responses=ExpenseResponseSerializer(many=True)
+)
+class ExpensesJSONExportView(ConditionalGetMixin, generics.ListAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ExpenseResponseSerializer
+    queryset = Expense.objects.all()
+    filter_backends = (DjangoFilterBackend, ExpenseSearchFilter, OrderingFilter)
+    filterset_class = ExpensesFilter
+    search_fields = ['name', 'description']
+    ordering_fields = ['name', 'timestamp', 'description', 'category', 'amount']
+    pagination_class = None
+    chunk_size = 2000  # Number of expenses fetched from the database at a time
 
+    def get_queryset(self):
+        return Expense.objects.filter(user=self.request.user)
 
+    def get(self, request, *args, **kwargs):
+        queryset = compiled_expense_response_serializer.get_values_queryset(self.filter_queryset(self.get_queryset()))
+        renderer = StreamingORJSONRenderer()
+        return StreamingHttpResponse(
+            renderer.render_stream(
+                compiled_expense_response_serializer.to_representation(row)
+                for row in queryset.iterator(chunk_size=self.chunk_size)
+            ),
+            content_type=renderer.media_type,
+        )
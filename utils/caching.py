@@ -0,0 +1,198 @@
+"""
+Shared response cache and conditional GETs, backed by the default cache
+(see CACHES). Both are only used when the cache is shared by every instance
+(settings.SHARED_CACHE, i.e. with Redis): data versions kept per process
+would only be bumped by the writes of that process.
+
+Cached responses are never deleted. Instead, every key includes the current
+version of each scope of data the response depends on (everything a user
+owns, a budget and its category relations, or the category catalogue), and
+writes bump those versions (see the budgets and expenses signals), so stale
+responses are simply never read again. Versions are the time of the last
+change in nanoseconds, but they are only compared through ETags: as
+Last-Modified dates (in whole seconds), they would miss writes made in the
+same second as a client's last fetch.
+"""
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOGUE_SCOPE = 'budget_categories'
+
+
+def get_user_scope(user_id):
+    """
+    Scope of everything a user owns: expenses, budgets and their category relations
+    """
+    return f'user:{user_id}'
+
+
+def get_budget_scope(budget_id):
+    """
+    Scope of a budget and its category relations
+    """
+    return f'budget:{budget_id}'
+
+
+def get_data_version_key(scope):
+    return f'data_version:{scope}'
+
+
+def get_data_versions(scopes):
+    """
+    Gets the current version of each scope, in one round trip to the cache when they're all set
+    """
+    keys = [get_data_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock rather than 0, so a version that was evicted
+            # from the cache doesn't start over and match old cached responses
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump_data_version(scope):
+    key = get_data_version_key(scope)
+    # Always move forward, even if clocks don't
+    version = max(time.time_ns(), cache.get(key, 0) + 1)
+    cache.set(key, version, timeout=None)
+
+
+def bump_data_version(scope):
+    """
+    Invalidates every cached response that depends on the scope
+    """
+    _bump_data_version(scope)
+    # Bump again once the write is committed, in case a concurrent request
+    # cached data read before the commit under the first new version
+    transaction.on_commit(lambda: _bump_data_version(scope))
+
+
+def bump_user_data_version(user_id):
+    bump_data_version(get_user_scope(user_id))
+
+
+def get_request_digest(request):
+    """
+    Digest of the query parameters (in any order) and the response format
+    """
+    params = sorted(
+        (key, value) for key in request.query_params for value in request.query_params.getlist(key)
+    )
+    return hashlib.md5(f'{urlencode(params)}|{request.accepted_renderer.format}'.encode()).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+    Answers GETs with an If-None-Match header with 304 Not Modified while the
+    versions of the scopes returned by get_conditional_scopes() haven't
+    changed, without running the view's queries (apart from looking up the
+    object of detail views, so missing objects and other users' still get
+    404 and 403). Successful responses get the matching ETag header.
+    """
+    def get_conditional_scopes(self, request):
+        # Users' own data, and the categories it mentions
+        return [get_user_scope(request.user.pk), CATALOGUE_SCOPE]
+
+    def get_conditional_etag(self, request):
+        scopes = self.get_conditional_scopes(request)
+        versions = get_data_versions(scopes)
+        etag_digest = hashlib.md5(
+            f'{type(self).__name__}|{request.path}|{request.user.pk}|{versions}|{get_request_digest(request)}'.encode()
+        ).hexdigest()
+        # Weak, because only the data is guaranteed to be the same, not the bytes
+        return f'W/"{etag_digest}"'
+
+    def get_object(self):
+        # Detail views look the object up before checking the ETag, so keep it for the view
+        if getattr(self, 'conditional_object', None) is None:
+            self.conditional_object = super().get_object()
+        return self.conditional_object
+
+    def get_not_modified_response(self, request):
+        """
+        Gets a 304 response if the client's copy is current, otherwise None (and
+        the ETag is added to the response by add_validator_headers())
+        """
+        self.conditional_etag = None
+        if not settings.SHARED_CACHE or not request.user.is_authenticated:
+            return None
+        if (self.lookup_url_kwarg or self.lookup_field) in self.kwargs:
+            self.get_object()  # Raises 404 or 403 before anything is compared
+        self.conditional_etag = self.get_conditional_etag(request)
+        return get_conditional_response(request, etag=self.conditional_etag)
+
+    def add_validator_headers(self, response):
+        if self.conditional_etag is not None and \
+                response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response.headers['ETag'] = self.conditional_etag
+        return response
+
+    def get(self, request, *args, **kwargs):
+        response = self.get_not_modified_response(request)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.add_validator_headers(response)
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of successful GET responses (when settings.SHARED_CACHE is
+    set). Keys combine the view, the path, the versions of the scopes returned
+    by get_response_cache_scopes(), the normalized query parameters and the
+    response format.
+    """
+    response_cache_timeout = None  # Defaults to settings.RESPONSE_CACHE_TIMEOUT
+
+    def get_response_cache_scopes(self, request):
+        # Responses mention categories, and they're reference data shared by every user
+        return [get_user_scope(request.user.pk), CATALOGUE_SCOPE]
+
+    def get_response_cache_key(self, request):
+        scopes = self.get_response_cache_scopes(request)
+        versions = ','.join(
+            f'{scope}={version}' for scope, version in zip(scopes, get_data_versions(scopes))
+        )
+        return f'response:{type(self).__name__}:{request.path}:{versions}:{get_request_digest(request)}'
+
+    def get_cached_response(self, request):
+        """
+        Gets the cached response for the request, if any (otherwise the response
+        can be cached by cache_response())
+        """
+        self.response_cache_key = None
+        if not settings.SHARED_CACHE:
+            return None
+        self.response_cache_key = self.get_response_cache_key(request)
+        cached_response = cache.get(self.response_cache_key)
+        if cached_response is None:
+            return None
+        data, headers = cached_response
+        if 'ETag' in headers:
+            not_modified_response = get_conditional_response(request, etag=headers['ETag'])
+            if not_modified_response is not None:
+                return not_modified_response
+        return Response(data, headers=headers)
+
+    def cache_response(self, response):
+        if self.response_cache_key is not None and isinstance(response, Response) and \
+                response.status_code == status.HTTP_200_OK:
+            timeout = self.response_cache_timeout or settings.RESPONSE_CACHE_TIMEOUT
+            cache.set(self.response_cache_key, (response.data, dict(response.headers)), timeout)
+
+    def get(self, request, *args, **kwargs):
+        response = self.get_cached_response(request)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            self.cache_response(response)
+        return response
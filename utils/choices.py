@@ -10,3 +10,17 @@ class TimeInterval(models.TextChoices):
     YEARLY = 'yearly', gettext_lazy('Yearly')
     MONTHLY = 'monthly', gettext_lazy('Monthly')
     WEEKLY = 'weekly', gettext_lazy('Weekly')
+
+
+# Days in one of each interval (budget amounts are per interval)
+TIME_INTERVAL_DAYS = {
+    TimeInterval.YEARLY: 365,
+    TimeInterval.MONTHLY: 30,
+    TimeInterval.WEEKLY: 7,
+}
+
+
+class TimeBucket(models.TextChoices):
+    DAY = 'day', gettext_lazy('Day')
+    WEEK = 'week', gettext_lazy('Week')
+    MONTH = 'month', gettext_lazy('Month')
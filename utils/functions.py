@@ -0,0 +1,19 @@
+"""
+Database functions that Django doesn't provide
+"""
+
+from django.db.models import Func, IntegerField
+
+
+class DurationDays(Func):
+    """
+    Whole days in a duration, e.g. DurationDays(F('end_time') - F('start_time')).
+    Like timedelta.days for positive durations (negative ones are rounded towards zero).
+    """
+    arity = 1
+    output_field = IntegerField()
+    template = 'CAST(EXTRACT(DAY FROM %(expressions)s) AS INTEGER)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite durations are integers of microseconds, and integer division truncates
+        return self.as_sql(compiler, connection, template='(%(expressions)s / 86400000000)', **extra_context)
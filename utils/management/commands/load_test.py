@@ -0,0 +1,125 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = [
+    '/api/expenses/expenses?cursor=',
+    '/api/expenses/expenses/by_category',
+    '/api/budgets/budgets/{budget}',
+    '/api/budgets/budgets/{budget}/dashboard',
+]
+
+
+class Command(BaseCommand):
+    help = 'Load tests the hot read endpoints of a running server, e.g. to compare the WSGI deployment ' \
+           '(gunicorn FinancialAideBackend.wsgi:app) with an ASGI server, which serves them with async views ' \
+           '(uvicorn FinancialAideBackend.asgi:application)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='URL of the server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--user', required=True, help='Username to log in as')
+        parser.add_argument('--password', required=True, help='Password to log in with')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request (repeatable). {budget} is replaced by the ID of one of the '
+                                 'user\'s budgets. Defaults to the expense list, spending by category, and a '
+                                 'budget and its dashboard.')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests per path')
+        parser.add_argument('--concurrency', type=int, default=20, help='Number of requests in flight at once')
+        parser.add_argument('--label', default='', help='Name of the deployment, for the report')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['base_url'])
+        if url.scheme not in ('http', 'https') or not url.netloc:
+            raise CommandError(f'Invalid base URL "{options["base_url"]}"')
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = url.netloc
+        self.local = threading.local()
+
+        self.headers = {'Cookie': self.log_in(options['user'], options['password'])}
+        paths = options['paths'] or DEFAULT_PATHS
+        if any('{budget}' in path for path in paths):
+            budget_id = self.get_budget_id()
+            paths = [path.replace('{budget}', str(budget_id)) for path in paths]
+
+        label = f'[{options["label"]}] ' if options['label'] else ''
+        for path in paths:
+            self.request(path)  # Warm up (e.g. the category catalogue)
+            latencies, errors, elapsed = self.run(path, options['requests'], options['concurrency'])
+            self.report(f'{label}{path}', latencies, errors, elapsed)
+
+    def get_connection(self):
+        # One keep-alive connection per thread
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(self.netloc, timeout=30)
+        return self.local.connection
+
+    def request(self, path, method='GET', body=None, headers=None, retry=True):
+        connection = self.get_connection()
+        try:
+            connection.request(method, path, body=body, headers={**self.headers, **(headers or {})})
+            response = connection.getresponse()
+            return response, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            # The server may have closed the idle connection, so try again with a new one
+            if not retry:
+                raise
+            return self.request(path, method, body, headers, retry=False)
+
+    def log_in(self, username, password):
+        self.headers = {}
+        response, _ = self.request(
+            '/api/users/login',
+            method='POST',
+            body=json.dumps({'username': username, 'password': password}),
+            headers={'Content-Type': 'application/json'},
+        )
+        if response.status != 200:
+            raise CommandError(f'Could not log in as "{username}" (status {response.status})')
+        cookies = SimpleCookie()
+        for header in response.headers.get_all('Set-Cookie'):
+            cookies.load(header)
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())
+
+    def get_budget_id(self):
+        response, body = self.request('/api/budgets/budgets?cursor=&page_size=1')
+        budgets = json.loads(body)['results'] if response.status == 200 else []
+        if not budgets:
+            raise CommandError('The user has no budgets (or leave out the paths with {budget})')
+        return budgets[0]['id']
+
+    def timed_request(self, path):
+        start = time.perf_counter()
+        try:
+            response, _ = self.request(path)
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def run(self, path, count, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self.timed_request, [path] * count))
+        elapsed = time.perf_counter() - start
+        latencies = [latency for latency, ok in results if ok]
+        return latencies, len(results) - len(latencies), elapsed
+
+    def report(self, name, latencies, errors, elapsed):
+        if len(latencies) < 2:
+            self.stderr.write(f'{name}: {errors} errors')
+            return
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{name}: {len(latencies) / elapsed:.1f} req/s, '
+            f'p50={percentiles[49] * 1000:.1f}ms p95={percentiles[94] * 1000:.1f}ms '
+            f'p99={percentiles[98] * 1000:.1f}ms, {errors} errors'
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from utils.profiling import get_route_stats
+
+SORT_KEYS = {
+    'p95': lambda stats: stats.get_percentile_ms(95),
+    'mean': lambda stats: stats.mean_ms,
+    'max': lambda stats: stats.max_ms,
+    'total': lambda stats: stats.total_ms,
+    'queries': lambda stats: stats.query_count / stats.count,
+}
+
+
+class Command(BaseCommand):
+    help = 'Shows the slowest routes recorded by the profiling middleware (see settings.PROFILING_ENABLED), ' \
+           'from the timings each server process copies to the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Number of routes to show')
+        parser.add_argument('--sort', choices=list(SORT_KEYS), default='p95',
+                            help='What "slowest" means: p95 or mean wall time, the slowest request, total time '
+                                 'spent on the route, or mean number of queries')
+
+    def handle(self, *args, **options):
+        routes = get_route_stats()
+        if not routes:
+            self.stdout.write('No requests recorded (is PROFILING_ENABLED set, and is the cache shared?)')
+            return
+
+        sort_key = SORT_KEYS[options['sort']]
+        slowest_routes = sorted(routes.items(), key=lambda item: sort_key(item[1]), reverse=True)
+        self.stdout.write(
+            f'{"Route":<60} {"Requests":>8} {"Mean ms":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"Max ms":>8} {"Queries":>8} {"DB ms":>8} {"N+1":>6}'
+        )
+        for route, stats in slowest_routes[:options['limit']]:
+            # p50-p99 are the upper bounds of the histogram buckets they fall in
+            self.stdout.write(
+                f'{route:<60} {stats.count:>8} {stats.mean_ms:>8.1f} {stats.get_percentile_ms(50):>8.1f} '
+                f'{stats.get_percentile_ms(95):>8.1f} {stats.get_percentile_ms(99):>8.1f} {stats.max_ms:>8.1f} '
+                f'{stats.query_count / stats.count:>8.1f} {stats.query_ms / stats.count:>8.1f} '
+                f'{stats.duplicate_query_requests:>6}'
+            )
@@ -0,0 +1,200 @@
+import json
+import re
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from budgets.models import Budget, BudgetCategory, BudgetCategoryRelation
+from expenses.models import Expense
+
+DEFAULT_REQUEST_MIX = Path(__file__).resolve().parent.parent.parent / 'request_mix.jsonl'
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+
+class Command(BaseCommand):
+    help = 'Replays a recorded mix of requests in-process against the database (e.g. filled by seed_perf_data), ' \
+           'reports the latency percentiles and query count of each one, and fails if any of them got slower ' \
+           'or runs more queries than in a baseline saved by an earlier run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default=str(DEFAULT_REQUEST_MIX),
+                            help='JSONL file with one request per line: {"name", "method", "path", "body"}, '
+                                 'optionally with a "weight" (times it is sent per round, 1 by default), a "file" '
+                                 '({"name", "content"}, uploaded in a multipart POST with the body\'s fields), and '
+                                 'a "save" name for the ID in its response. In paths, bodies and files, {budget}, '
+                                 '{category_relation}, {expense} and {category} are replaced by the ID of one of '
+                                 'the user\'s (the most recent one, for budgets and expenses), saved names by the '
+                                 'last saved ID, and {n} by a number unique to each request.')
+        parser.add_argument('--user', default='perf_user_0', help='Username to make the requests as')
+        parser.add_argument('--rounds', type=int, default=20, help='Number of times to replay the mix')
+        parser.add_argument('--baseline', help='JSON file with the results of an earlier run to compare with')
+        parser.add_argument('--save-baseline', help='JSON file to save the results to')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Fraction by which a request\'s p95 latency can grow before it counts as a regression')
+        parser.add_argument('--min-regression-ms', type=float, default=5,
+                            help='Smallest p95 latency growth that counts as a regression, so requests that take '
+                                 'a few milliseconds don\'t fail on noise')
+
+    def handle(self, *args, **options):
+        mix = self.load_mix(options['mix'])
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist (see seed_perf_data)')
+        if options['rounds'] < 2:
+            raise CommandError('At least 2 rounds are needed for percentiles')
+
+        # Requests must come from an allowed host
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host not in ('', '*')), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        placeholders = self.get_placeholders(user)
+        requests = [request for request in mix for _ in range(request.get('weight', 1))]
+
+        for request in requests:
+            self.send(client, request, placeholders)  # Warm up (e.g. the category catalogue)
+        latencies = {request['name']: [] for request in requests}
+        query_counts = {request['name']: [] for request in requests}
+        errors = []
+        for _ in range(options['rounds']):
+            for request in requests:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = self.send(client, request, placeholders)
+                    latencies[request['name']].append((time.perf_counter() - start) * 1000)
+                query_counts[request['name']].append(len(queries))
+                if response.status_code >= 400:
+                    errors.append(f'{request["name"]}: status {response.status_code}')
+
+        results = {}
+        for name in latencies:
+            percentiles = statistics.quantiles(latencies[name], n=100)
+            results[name] = {
+                'p50_ms': round(percentiles[49], 2),
+                'p95_ms': round(percentiles[94], 2),
+                'p99_ms': round(percentiles[98], 2),
+                'queries': max(query_counts[name]),
+            }
+        self.report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+        regressions = []
+        if options['baseline']:
+            regressions = self.get_regressions(
+                self.load_baseline(options['baseline']),
+                results,
+                options['threshold'],
+                options['min_regression_ms'],
+            )
+        if errors or regressions:
+            raise CommandError('\n'.join(sorted(set(errors)) + regressions))
+
+    def load_mix(self, path):
+        try:
+            with open(path) as mix_file:
+                mix = [json.loads(line) for line in mix_file if line.strip()]
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read the request mix: {e}')
+        for request in mix:
+            if not isinstance(request, dict) or not {'name', 'method', 'path'} <= request.keys():
+                raise CommandError(f'Requests need a name, method and path: {request}')
+            weight = request.get('weight', 1)
+            if not isinstance(weight, int) or weight < 1:
+                raise CommandError(f'Weights must be positive integers: {request}')
+            if 'file' in request and request['method'] != 'POST':
+                raise CommandError(f'Files can only be uploaded with POST: {request}')
+        return mix
+
+    def load_baseline(self, path):
+        try:
+            with open(path) as baseline_file:
+                return json.load(baseline_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read the baseline: {e}')
+
+    def get_placeholders(self, user):
+        budget = Budget.objects.filter(user=user).order_by('-end_time').first()
+        expense = Expense.objects.filter(user=user).order_by('-timestamp').first()
+        if budget is None or expense is None:
+            raise CommandError(f'User "{user.username}" needs budgets and expenses (see seed_perf_data)')
+        category_relation = BudgetCategoryRelation.objects.filter(budget=budget).order_by('pk').first()
+        # Writes need a category, so uncategorized expenses fall back to the first one
+        category_id = expense.category_id or BudgetCategory.objects.order_by('pk').values_list('pk', flat=True).first()
+        return {
+            'budget': budget.pk,
+            'category_relation': category_relation.pk if category_relation is not None else 0,
+            'expense': expense.pk,
+            'category': category_id or '',
+            'n': 0,
+        }
+
+    def fill_placeholders(self, value, placeholders):
+        """
+        Fills in the placeholders of a path, or of every string in a body. Strings that
+        are just one placeholder are replaced by its value, so IDs stay numbers in JSON.
+        """
+        if isinstance(value, dict):
+            return {key: self.fill_placeholders(item, placeholders) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.fill_placeholders(item, placeholders) for item in value]
+        if not isinstance(value, str):
+            return value
+        try:
+            match = PLACEHOLDER_PATTERN.fullmatch(value)
+            if match is not None:
+                return placeholders[match.group(1)]
+            return value.format(**placeholders)
+        except KeyError as e:
+            raise CommandError(f'Unknown placeholder {e} (saved IDs can only be used after the request saving them)')
+
+    def send(self, client, request, placeholders):
+        placeholders['n'] += 1
+        path = self.fill_placeholders(request['path'], placeholders)
+        body = self.fill_placeholders(request.get('body'), placeholders)
+        if 'file' in request:
+            upload = self.fill_placeholders(request['file'], placeholders)
+            data = {**(body or {}), 'file': SimpleUploadedFile(upload['name'], upload['content'].encode())}
+            response = client.post(path, data)
+        else:
+            data = json.dumps(body) if body is not None else ''
+            response = client.generic(request['method'], path, data, content_type='application/json')
+        # Read streaming responses to the end, as a client would
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        # e.g. so a created expense can be deleted later in the round
+        if 'save' in request and response.status_code < 400:
+            placeholders[request['save']] = response.json()['id']
+        return response
+
+    def report(self, results):
+        self.stdout.write(f'{"Request":<40} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"Queries":>8}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<40} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                f'{result["queries"]:>8}'
+            )
+
+    def get_regressions(self, baseline, results, threshold, min_regression_ms):
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            baseline_p95_ms = baseline[name]['p95_ms']
+            if result['p95_ms'] > baseline_p95_ms * (1 + threshold) and \
+                    result['p95_ms'] - baseline_p95_ms >= min_regression_ms:
+                regressions.append(f'{name}: p95 went from {baseline_p95_ms:.2f}ms to {result["p95_ms"]:.2f}ms')
+            if result['queries'] > baseline[name]['queries']:
+                regressions.append(f'{name}: queries went from {baseline[name]["queries"]} to {result["queries"]}')
+        return regressions
@@ -0,0 +1,132 @@
+import random
+import re
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from budgets.models import Budget, BudgetCategory, BudgetCategoryRelation
+from expenses import rollups
+from expenses.models import Expense
+from utils.caching import bump_data_version, bump_user_data_version, get_budget_scope
+from utils.choices import TimeInterval
+
+EXPENSE_WORDS = [
+    'groceries', 'rent', 'coffee', 'restaurant', 'gas', 'electricity', 'movie', 'books', 'gym', 'pharmacy',
+    'taxi', 'flight', 'hotel', 'insurance', 'phone', 'internet', 'clothes', 'gift', 'parking', 'repairs',
+]
+
+
+class Command(BaseCommand):
+    help = 'Creates users with budgets and expenses (spread over the budget category catalogue) for load tests ' \
+           'and benchmarks (see load_test and run_benchmarks). The same seed always generates the same data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users')
+        parser.add_argument('--budgets', type=int, default=3, help='Number of budgets per user')
+        parser.add_argument('--expenses', type=int, default=1000, help='Number of expenses per user')
+        parser.add_argument('--prefix', default='perf_user', help='Usernames are the prefix followed by a number')
+        parser.add_argument('--password', default='perfpassword', help='Password of every user')
+        parser.add_argument('--seed', type=int, default=2204, help='Random seed')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete the users with the prefix (and everything they own) first')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of expenses inserted at a time')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        self.random = random.Random(options['seed'])
+        # Timestamps relative to midnight, so the data only depends on the day it's generated
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        with transaction.atomic():
+            categories = self.get_categories()
+            users = self.create_users(options['prefix'], options['users'], options['password'], options['replace'])
+            budgets = self.create_budgets(users, categories, options['budgets'])
+            for user in users:
+                self.create_expenses(user, categories, options['expenses'], options['batch_size'])
+            # Bulk inserts don't send signals, so do what their receivers would have
+            rollups.rebuild(users)
+            for budget in budgets:
+                bump_data_version(get_budget_scope(budget.pk))
+            for user in users:
+                bump_user_data_version(user.pk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users ({options["prefix"]}_0 to {options["prefix"]}_{len(users) - 1}), '
+            f'{len(budgets)} budgets and {len(users) * options["expenses"]} expenses '
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def get_categories(self):
+        if not BudgetCategory.objects.exists():
+            call_command('loaddata', settings.BASE_DIR / 'budgetcategories.json', verbosity=0)
+        return list(BudgetCategory.objects.order_by('pk'))
+
+    def create_users(self, prefix, count, password, replace):
+        User = get_user_model()
+        existing_users = User.objects.filter(username__regex=rf'^{re.escape(prefix)}_\d+$')
+        if existing_users.exists():
+            if not replace:
+                raise CommandError(f'Users named {prefix}_<number> already exist (use --replace to delete them)')
+            existing_users.delete()
+        # Hashing a password is slow on purpose, so only do it once
+        password = make_password(password)
+        return User.objects.bulk_create(
+            User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com', password=password)
+            for i in range(count)
+        )
+
+    def create_budgets(self, users, categories, count):
+        budgets = Budget.objects.bulk_create(
+            Budget(
+                name=f'Budget {i + 1}',
+                description=self.random.choice([None, f'Budget for quarter {i + 1}']),
+                # Consecutive (slightly overlapping) quarters, the first one current
+                start_time=self.now - timedelta(days=90 * (i + 1)),
+                end_time=self.now - timedelta(days=90 * i - 30),
+                interval=self.random.choice(TimeInterval.values),
+                income=Decimal(self.random.randrange(200000, 800000)) / 100,
+                user=user,
+            )
+            for user in users for i in range(count)
+        )
+        BudgetCategoryRelation.objects.bulk_create(
+            BudgetCategoryRelation(
+                budget=budget,
+                category=category,
+                amount=category.typical_percentage or Decimal(self.random.randrange(100, 1500)) / 100,
+                is_percentage=True,
+            ) if self.random.random() < 0.5 else BudgetCategoryRelation(
+                budget=budget,
+                category=category,
+                amount=category.typical_monthly_amount or Decimal(self.random.randrange(5000, 100000)) / 100,
+                is_percentage=False,
+            )
+            for budget in budgets
+            for category in self.random.sample(categories, min(len(categories), self.random.randint(4, 8)))
+        )
+        return budgets
+
+    def create_expenses(self, user, categories, count, batch_size):
+        # Some expenses are uncategorized
+        choices = categories + [None]
+        for batch_start in range(0, count, batch_size):
+            Expense.objects.bulk_create([
+                Expense(
+                    name=f'{self.random.choice(EXPENSE_WORDS).capitalize()} {i}',
+                    description=self.random.choice([
+                        None, f'{self.random.choice(EXPENSE_WORDS)} and {self.random.choice(EXPENSE_WORDS)}',
+                    ]),
+                    timestamp=self.now - timedelta(seconds=self.random.randrange(365 * 24 * 60 * 60)),
+                    category=self.random.choice(choices),
+                    amount=Decimal(self.random.randrange(100, 50000)) / 100,
+                    user=user,
+                ) for i in range(batch_start, min(batch_start + batch_size, count))
+            ])
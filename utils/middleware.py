@@ -0,0 +1,133 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from utils.profiling import request_histogram
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper (see connection.execute_wrapper()) counting and
+    timing the queries of a request
+    """
+    def __init__(self):
+        self.sql_counts = Counter()
+        self.total_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.total_ms += (time.perf_counter() - start) * 1000
+            self.sql_counts[sql] += 1
+
+    @property
+    def count(self):
+        return sum(self.sql_counts.values())
+
+    def get_duplicate_queries(self, threshold):
+        """
+        Gets the SQL run at least threshold times (with any parameters), which
+        usually means related objects are fetched one at a time (N+1 queries)
+        """
+        return {sql: count for sql, count in self.sql_counts.items() if count >= threshold}
+
+
+class RecordedStream:
+    """
+    Streaming response content that calls on_close when the response is closed
+    (servers close responses once they're sent), since the queries of streamed
+    responses run while their content is read
+    """
+    def __init__(self, content, on_close):
+        self.content = content
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class ProfilingMiddleware:
+    """
+    Times each request and its database queries when settings.PROFILING_ENABLED
+    is set. The times are sent back in a Server-Timing header (shown by
+    browsers' developer tools) and summed per route into an in-process
+    histogram (see utils.profiling and "manage.py perf_report"). SQL run
+    repeatedly in one request is logged as N+1 queries.
+
+    It's synchronous only, since execute wrappers belong to the connections of
+    the thread they're added in. Under ASGI, Django runs it in a thread and
+    calls the handlers after it through async_to_sync(), so async views (see
+    settings.ASYNC_READ_VIEWS) still run, and their sync_to_async() queries
+    run in that same thread and get recorded, at the cost of a thread switch
+    per request while profiling is enabled.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        streamed = False
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+            if response.streaming and not response.is_async:
+                # Keep recording until the content is read, and only then count the request
+                streamed = True
+                recording = stack.pop_all()
+
+                def finish():
+                    recording.close()
+                    self.record(request, recorder, (time.perf_counter() - start) * 1000)
+
+                response.streaming_content = RecordedStream(response.streaming_content, finish)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        # Headers go out before streamed content, so for streamed responses they only time the view
+        duplicate_queries = recorder.get_duplicate_queries(settings.PROFILING_DUPLICATE_QUERY_THRESHOLD)
+        server_timing = [
+            f'total;dur={total_ms:.1f}',
+            f'db;dur={recorder.total_ms:.1f};desc="{recorder.count} queries"',
+        ]
+        if duplicate_queries:
+            server_timing.append(f'duplicate-queries;desc="{sum(duplicate_queries.values())} duplicate queries"')
+        response.headers['Server-Timing'] = ', '.join(server_timing)
+
+        if not streamed:
+            self.record(request, recorder, total_ms)
+        return response
+
+    def record(self, request, recorder, total_ms):
+        duplicate_queries = recorder.get_duplicate_queries(settings.PROFILING_DUPLICATE_QUERY_THRESHOLD)
+        route = self.get_route(request)
+        for sql, count in duplicate_queries.items():
+            logger.warning('N+1 queries in %s: ran %d times: %s', route, count, sql)
+        request_histogram.add(route, total_ms, recorder.count, recorder.total_ms, bool(duplicate_queries))
+        request_histogram.flush(settings.PROFILING_FLUSH_INTERVAL)
+
+    def get_route(self, request):
+        # The URL pattern rather than the path, so e.g. every budget's detail is one route
+        if request.resolver_match is None:
+            return f'{request.method} <unresolved>'
+        return f'{request.method} /{request.resolver_match.route}'
@@ -0,0 +1,154 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.PageNumberPagination):
+    """
+    Page number pagination, unless the request has a "cursor" query parameter
+    (empty for the first page). Then pages are found by keyset instead: results
+    are ordered by the view's keyset_ordering (e.g. ('-timestamp', '-id'), which
+    must end with a unique field), and each page starts right after the last
+    result of the previous one, as encoded in the cursor. That skips the COUNT
+    and the OFFSET, so deep pages are as fast as the first one. Keyset pages
+    only link forwards, and ignore any ?ordering.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.keyset_mode = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+
+        queryset = self.get_keyset_queryset(queryset, request, view)
+        return self.set_keyset_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset()
+        """
+        if self.cursor_query_param in request.query_params:
+            queryset = self.get_keyset_queryset(queryset, request, view)
+            return self.set_keyset_page([result async for result in queryset])
+
+        # Same as PageNumberPagination.paginate_queryset(), with the count and the page fetched asynchronously
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.page.object_list = [result async for result in self.page.object_list]
+        return self.page.object_list
+
+    def get_keyset_queryset(self, queryset, request, view):
+        """
+        Gets the page of the queryset after the cursor's position, plus one more
+        result to know if there's a next page
+        """
+        self.keyset_mode = True
+        self.request = request
+        self.ordering = view.keyset_ordering
+        self.keyset_page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request.query_params[self.cursor_query_param], queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_after_position_filter(position))
+        return queryset[:self.keyset_page_size + 1]
+
+    def set_keyset_page(self, results):
+        self.has_next = len(results) > self.keyset_page_size
+        self.page = results[:self.keyset_page_size]
+        return self.page
+
+    def get_field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def get_after_position_filter(self, position):
+        """
+        Builds the filter for results after the position in the keyset ordering:
+        (a > x) OR (a = x AND b > y) OR ..., with < for descending fields
+        """
+        after_filter = Q()
+        equal_filter = Q()
+        for field, value in zip(self.ordering, position):
+            field_name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            after_filter |= equal_filter & Q(**{f'{field_name}__{lookup}': value})
+            equal_filter &= Q(**{field_name: value})
+        # Redundant, but a plain range on the first field lets the database seek
+        # straight to the position in an index instead of filtering every row before it
+        first_field = self.ordering[0]
+        first_lookup = 'lte' if first_field.startswith('-') else 'gte'
+        return Q(**{f'{first_field.lstrip("-")}__{first_lookup}': position[0]}) & after_filter
+
+    def encode_cursor(self, item):
+        if isinstance(item, dict):  # From a values() queryset
+            position = [item[field_name] for field_name in self.get_field_names()]
+        else:
+            position = [getattr(item, field_name) for field_name in self.get_field_names()]
+        # isoformat() keeps full (microsecond) precision, unlike DRF's JSON encoder
+        data = json.dumps(position, default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field_name).to_python(value)
+                for field_name, value in zip(self.get_field_names(), position)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+
+    def get_next_link(self):
+        if not self.keyset_mode:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        if not self.keyset_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Use keyset pagination: leave empty for the first page, then follow the "next" links. '
+                               'Responses then have no count or previous link.',
+                'schema': {
+                    'type': 'string',
+                },
+            },
+        ]
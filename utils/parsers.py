@@ -0,0 +1,26 @@
+import orjson
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from utils.renderers import ORJSONRenderer
+
+
+class ORJSONParser(parsers.JSONParser):
+    """
+    JSONParser using orjson. NaN and Infinity are always rejected, like
+    JSONParser does with STRICT_JSON.
+    """
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            data = stream.read()
+            if encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+                data = data.decode(encoding)
+            return orjson.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,131 @@
+"""
+Per-route request timings recorded by utils.middleware.ProfilingMiddleware.
+Each process sums its requests into an in-process histogram, and regularly
+copies it to the default cache under its own key, so "manage.py perf_report"
+can merge the histograms of every process (with Redis; without it, nothing is
+cached and there is nothing to report).
+"""
+
+import bisect
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+# Upper bounds of the histogram buckets, in milliseconds (the last bucket has no bound)
+BUCKET_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+PROCESSES_CACHE_KEY = 'profiling:processes'
+# Processes that stop reporting drop out of the report after this many seconds
+PROCESS_TIMEOUT = 24 * 60 * 60
+
+
+def get_process_cache_key(process_id):
+    return f'profiling:process:{process_id}'
+
+
+class RouteStats:
+    """
+    Totals and a histogram of the wall times of the requests to one route
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.duplicate_query_requests = 0  # Requests that ran the same SQL repeatedly (N+1 queries)
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+
+    def add(self, total_ms, query_count, query_ms, has_duplicate_queries):
+        self.count += 1
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        self.query_count += query_count
+        self.query_ms += query_ms
+        self.duplicate_query_requests += has_duplicate_queries
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, total_ms)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.query_count += other.query_count
+        self.query_ms += other.query_ms
+        self.duplicate_query_requests += other.duplicate_query_requests
+        self.buckets = [count + other_count for count, other_count in zip(self.buckets, other.buckets)]
+
+    def get_percentile_ms(self, percentile):
+        """
+        Estimates a percentile of the wall time as the upper bound of the bucket
+        it falls in (or the slowest request's time, for the last bucket)
+        """
+        if not self.count:
+            return 0.0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(float(bound), self.max_ms)
+        return self.max_ms
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+
+class RequestHistogram:
+    def __init__(self):
+        self.process_id = uuid.uuid4().hex
+        self.routes = {}
+        self.last_flush = None
+        self.lock = threading.Lock()
+
+    def add(self, route, total_ms, query_count, query_ms, has_duplicate_queries):
+        with self.lock:
+            if route not in self.routes:
+                self.routes[route] = RouteStats()
+            self.routes[route].add(total_ms, query_count, query_ms, has_duplicate_queries)
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def flush(self, interval):
+        """
+        Copies the histogram to the cache, if it wasn't in the last interval seconds
+        """
+        now = time.monotonic()
+        if self.last_flush is not None and now - self.last_flush < interval:
+            return
+        self.last_flush = now
+        with self.lock:
+            routes = {route: vars(stats).copy() for route, stats in self.routes.items()}
+        cache.set(get_process_cache_key(self.process_id), routes, timeout=PROCESS_TIMEOUT)
+        # Every cold start is a new process, so forget the ones whose histograms expired
+        process_ids = cache.get(PROCESSES_CACHE_KEY, set()) | {self.process_id}
+        live_keys = cache.get_many([get_process_cache_key(process_id) for process_id in process_ids]).keys()
+        process_ids = {process_id for process_id in process_ids if get_process_cache_key(process_id) in live_keys}
+        cache.set(PROCESSES_CACHE_KEY, process_ids, timeout=PROCESS_TIMEOUT)
+
+
+request_histogram = RequestHistogram()
+
+
+def get_route_stats():
+    """
+    Merges the histograms every process copied to the cache
+    """
+    process_ids = cache.get(PROCESSES_CACHE_KEY, set())
+    routes = {}
+    for process_routes in cache.get_many([get_process_cache_key(process_id) for process_id in process_ids]).values():
+        for route, values in process_routes.items():
+            stats = RouteStats()
+            vars(stats).update(values)
+            if route in routes:
+                routes[route].merge(stats)
+            else:
+                routes[route] = stats
+    return routes
@@ -0,0 +1,79 @@
+import csv
+import decimal
+import io
+from itertools import islice
+
+import orjson
+from rest_framework import renderers
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    """
+    Renders a list of rows (each a list of values) as a CSV file. Dictionaries
+    (e.g. error details) are rendered with one key/value pair per row.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if isinstance(data, dict):
+            data = data.items()
+        writer.writerows(data)
+        return output.getvalue().encode(self.charset)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer using orjson, with the same output: compact and UTF-8 (see
+    COMPACT_JSON and UNICODE_JSON). Values orjson doesn't handle itself
+    (e.g. Decimal, lazy translations) are converted by DRF's JSON encoder, and
+    so are datetimes, which DRF renders with milliseconds rather than
+    microseconds. Indented JSON is rendered by JSONRenderer.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def __init__(self):
+        self.encoder = self.encoder_class()
+
+    def default(self, value):
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return self.encoder.default(value)
+
+    def dumps(self, data):
+        rendered = orjson.dumps(data, default=self.default, option=self.options)
+        # Like JSONRenderer, escape U+2028 and U+2029 so the JSON is valid JavaScript
+        if b'\xe2\x80\xa8' in rendered or b'\xe2\x80\xa9' in rendered:
+            rendered = rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return rendered
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.dumps(data)
+
+
+class StreamingORJSONRenderer(ORJSONRenderer):
+    """
+    Renders a (possibly very long) iterable of items as a JSON array for a
+    StreamingHttpResponse, chunk_size items at a time, so the whole list is
+    never in memory at once
+    """
+    chunk_size = 500
+
+    def render_stream(self, items):
+        items = iter(items)
+        separator = b'['
+        while chunk := list(islice(items, self.chunk_size)):
+            # Render the chunk as an array and drop its brackets
+            yield separator + self.dumps(chunk)[1:-1]
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
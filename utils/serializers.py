@@ -1,5 +1,79 @@
+from functools import cached_property
+
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework import serializers
 
+# Fields whose to_representation() returns database values unchanged
+PASSTHROUGH_FIELDS = (serializers.BooleanField, serializers.CharField, serializers.IntegerField)
+
+
 class EmptySerializer(serializers.Serializer):
     class Meta:
-        fields = []
\ No newline at end of file
+        fields = []
+
+
+class CompiledSerializer:
+    """
+    Fast path for a read-only model serializer made of plain fields and nested
+    (non-many) model serializers, e.g. ExpenseResponseSerializer. The fields
+    are introspected once, then rows are read with values() (following the
+    nested serializers' relations) and turned into the same data the
+    serializer would give, without instantiating serializers or model
+    instances for each row.
+    """
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def plan(self):
+        """
+        (value paths, steps), where each step is (key, path, to_representation)
+        for a plain field, or (key, path of the relation if it's nullable, else
+        None, nested steps) for a nested serializer
+        """
+        value_paths = []
+        steps = self.compile(self.serializer_class(), self.serializer_class.Meta.model, '', value_paths)
+        return value_paths, steps
+
+    def compile(self, serializer, model, prefix, value_paths):
+        steps = []
+        for field in serializer._readable_fields:
+            if field.source == '*' or '.' in field.source or isinstance(field, serializers.SerializerMethodField):
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{field.field_name} can\'t be compiled')
+            path = prefix + field.source
+            if isinstance(field, serializers.ModelSerializer):
+                model_field = model._meta.get_field(field.source)
+                null_path = None
+                if model_field.null:
+                    null_path = path
+                    value_paths.append(path)
+                nested_steps = self.compile(field, model_field.related_model, f'{path}__', value_paths)
+                steps.append((field.field_name, null_path, nested_steps))
+            elif isinstance(field, serializers.BaseSerializer):
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{field.field_name} can\'t be compiled')
+            else:
+                value_paths.append(path)
+                to_representation = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                steps.append((field.field_name, path, to_representation))
+        return steps
+
+    def get_values_queryset(self, queryset):
+        value_paths, _ = self.plan
+        return queryset.values(*value_paths)
+
+    def to_representation(self, row, steps=None):
+        if steps is None:
+            _, steps = self.plan
+        data = {}
+        for key, path, step in steps:
+            if isinstance(step, list):
+                data[key] = None if path is not None and row[path] is None else self.to_representation(row, step)
+                continue
+            value = row[path]
+            # Like Serializer.to_representation(), None is never passed to the field
+            data[key] = value if value is None or step is None else step(value)
+        return data
+
+    def serialize(self, rows):
+        _, steps = self.plan
+        return [self.to_representation(row, steps) for row in rows]
@@ -0,0 +1,50 @@
+"""
+Helpers for tests. Benchmarks are slow, so they are skipped unless the
+RUN_BENCHMARKS environment variable is set, e.g.
+RUN_BENCHMARKS=1 python manage.py test budgets
+"""
+
+import os
+import time
+import unittest
+
+from django.test import override_settings
+
+
+def benchmark(test_item):
+    """
+    Marks a test (or test case) as a benchmark, only run when RUN_BENCHMARKS is set
+    """
+    return unittest.skipUnless(os.getenv('RUN_BENCHMARKS'), 'Set RUN_BENCHMARKS=1 to run benchmarks')(test_item)
+
+
+def shared_cache(test_item):
+    """
+    Runs a test (or test case) with a process-local cache standing in for the
+    shared one (Redis), so responses are cached and get ETags
+    """
+    return override_settings(
+        SHARED_CACHE=True,
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )(test_item)
+
+
+def time_call(func, *args, repeat=5, **kwargs):
+    """
+    Calls func repeatedly and returns the best time for one call, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, **measurements):
+    """
+    Prints one line of benchmark results
+    """
+    print(f'\n[benchmark] {name}: ' + ', '.join(f'{key}={value}' for key, value in measurements.items()))
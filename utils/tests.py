@@ -1,3 +1,298 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from budgets.models import Budget, BudgetCategory, BudgetCategoryRelation
+from expenses.models import Expense, ExpenseRollup
+from users.models import User
+from utils.caching import get_budget_scope, get_data_version_key, get_user_scope
+from utils.middleware import QueryRecorder
+from utils.parsers import ORJSONParser
+from utils.profiling import PROCESSES_CACHE_KEY, RouteStats, get_route_stats, request_histogram
+from utils.renderers import ORJSONRenderer, StreamingORJSONRenderer
+from utils.testing import shared_cache
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    data = {
+        'name': 'Café\u2028\u2029',
+        'amount': '12.30',
+        'total': Decimal('12.5'),
+        'timestamp': datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+        'date': date(2023, 1, 2),
+        'duration': timedelta(minutes=90),
+        'label': gettext_lazy('Monthly'),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'results': [OrderedDict([('id', 1), ('category', None), ('is_percentage', True)])],
+        1: 'integer key',
+        'ratio': 0.1,
+    }
+
+    def test_same_output_as_json_renderer(self):
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_indent(self):
+        self.assertEqual(
+            ORJSONRenderer().render(self.data, 'application/json; indent=4'),
+            JSONRenderer().render(self.data, 'application/json; indent=4'),
+        )
+
+    def test_none(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_streaming(self):
+        renderer = StreamingORJSONRenderer()
+        renderer.chunk_size = 2
+        for count in range(6):
+            items = [{'id': i, 'total': Decimal(i)} for i in range(count)]
+            self.assertEqual(b''.join(renderer.render_stream(iter(items))), JSONRenderer().render(items))
+
+
+class ORJSONParserTests(SimpleTestCase):
+    def parse(self, content, encoding='utf-8'):
+        return ORJSONParser().parse(io.BytesIO(content), parser_context={'encoding': encoding})
+
+    def test_same_output_as_json_parser(self):
+        content = '{"name": "Café", "amount": 12.5, "count": 3, "tags": [null, true]}'.encode()
+        self.assertEqual(self.parse(content), JSONParser().parse(io.BytesIO(content)))
+
+    def test_other_encoding(self):
+        self.assertEqual(self.parse('{"name": "Café"}'.encode('latin-1'), 'latin-1'), {'name': 'Café'})
+
+    def test_invalid(self):
+        for content in [b'{"name": ', b'{"amount": NaN}', b'\xff']:
+            with self.assertRaises(ParseError):
+                self.parse(content)
+
+
+@shared_cache
+@override_settings(PROFILING_ENABLED=True, PROFILING_FLUSH_INTERVAL=0)
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(
+            username='user1',
+            email='user1@gmail.com',
+            password='password1',
+        )
+
+    def setUp(self):
+        cache.clear()
+        request_histogram.reset()
+        self.client.login(username='user1', password='password1')
+
+    def tearDown(self):
+        request_histogram.reset()
+
+    def test_server_timing(self):
+        with self.assertNumQueries(3):  # Session, user, budgets
+            response = self.client.get(reverse('budget_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="3 queries"$',
+        )
+
+    def test_histogram(self):
+        for _ in range(3):
+            self.client.get(reverse('budget_list'))
+        self.client.get(reverse('budget_detail', args=[1234]))
+        routes = get_route_stats()
+        self.assertEqual(routes['GET /api/budgets/budgets'].count, 3)
+        self.assertEqual(routes['GET /api/budgets/budgets'].query_count, 9)
+        self.assertEqual(routes['GET /api/budgets/budgets/<int:pk>'].count, 1)
+
+    def test_streamed_response_queries(self):
+        Expense.objects.create(name='Expense 1', timestamp=timezone.now(), amount=10, user=self.user1)
+        response = self.client.get(reverse('expenses_json_export'))
+        # The expenses are only queried as the content is read
+        self.assertEqual(get_route_stats(), {})
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content)
+        self.assertEqual(len(json.loads(content)), 1)
+        stats = get_route_stats()['GET /api/expenses/expenses/json_export']
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.query_count, int(re.search(r'"(\d+) queries"', response['Server-Timing'])[1]) + 1)
+
+    def test_expired_processes_forgotten(self):
+        request_histogram.flush(0)
+        cache.set(PROCESSES_CACHE_KEY, cache.get(PROCESSES_CACHE_KEY) | {'expired'})
+        request_histogram.flush(0)
+        self.assertEqual(cache.get(PROCESSES_CACHE_KEY), {request_histogram.process_id})
+
+    @override_settings(PROFILING_DUPLICATE_QUERY_THRESHOLD=1)
+    def test_duplicate_queries(self):
+        with self.assertLogs('utils.middleware', 'WARNING') as logs:
+            response = self.client.get(reverse('budget_list'))
+        self.assertIn('duplicate-queries;desc="3 duplicate queries"', response['Server-Timing'])
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(get_route_stats()['GET /api/budgets/budgets'].duplicate_query_requests, 1)
+
+    def test_perf_report(self):
+        self.client.get(reverse('budget_list'))
+        self.client.get(reverse('expense_list'))
+        stdout = io.StringIO()
+        call_command('perf_report', sort='queries', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('GET /api/'))
+        self.assertTrue(lines[2].startswith('GET /api/'))
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('budget_list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(get_route_stats(), {})
+
+
+class QueryRecorderTests(TestCase):
+    def test_duplicate_queries(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pk in range(3):
+                User.objects.filter(pk=pk).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 4)
+        duplicate_queries = recorder.get_duplicate_queries(3)
+        self.assertEqual(list(duplicate_queries.values()), [3])
+        self.assertRegex(next(iter(duplicate_queries)), re.compile('WHERE .+ LIMIT 1', re.IGNORECASE))
+
+    def test_percentiles(self):
+        stats = RouteStats()
+        for total_ms in [1, 2, 3, 4, 7, 8, 20, 40, 90, 3000]:
+            stats.add(total_ms, 0, 0, False)
+        self.assertEqual(stats.get_percentile_ms(50), 10)
+        self.assertEqual(stats.get_percentile_ms(90), 100)
+        self.assertEqual(stats.get_percentile_ms(100), 3000)
+
+
+class SeedPerfDataTests(TestCase):
+    def seed(self, **options):
+        call_command('seed_perf_data', users=2, budgets=2, expenses=50, stdout=io.StringIO(), **options)
+
+    def test_seed(self):
+        self.seed()
+        self.assertEqual(BudgetCategory.objects.count(), 11)  # From budgetcategories.json
+        users = User.objects.filter(username__startswith='perf_user_')
+        self.assertEqual(users.count(), 2)
+        self.assertTrue(self.client.login(username='perf_user_1', password='perfpassword'))
+        self.assertEqual(Budget.objects.filter(user__in=users).count(), 4)
+        self.assertTrue(BudgetCategoryRelation.objects.filter(budget__user__in=users).exists())
+        self.assertEqual(Expense.objects.filter(user__in=users).count(), 100)
+        self.assertGreater(Expense.objects.filter(category__isnull=False).values('category').distinct().count(), 5)
+        self.assertTrue(ExpenseRollup.objects.filter(user__in=users).exists())
+
+    @shared_cache
+    def test_seed_invalidates_cached_responses(self):
+        cache.clear()
+        self.seed()
+        # Like the signals of regular writes, which bulk inserts don't send
+        for user in User.objects.filter(username__startswith='perf_user_'):
+            self.assertIsNotNone(cache.get(get_data_version_key(get_user_scope(user.pk))))
+            for budget in user.budgets.all():
+                self.assertIsNotNone(cache.get(get_data_version_key(get_budget_scope(budget.pk))))
+
+    def test_same_seed_same_data(self):
+        self.seed()
+        amounts = list(Expense.objects.order_by('user__username', 'name').values_list('name', 'amount'))
+        self.seed(replace=True)
+        self.assertEqual(list(Expense.objects.order_by('user__username', 'name').values_list('name', 'amount')), amounts)
+
+    def test_existing_users(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class RunBenchmarksTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_perf_data', users=1, budgets=1, expenses=30, stdout=io.StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.mix_path = os.path.join(self.directory.name, 'mix.jsonl')
+        with open(self.mix_path, 'w') as mix_file:
+            mix_file.write('{"name": "budget", "method": "GET", "path": "/api/budgets/budgets/{budget}"}\n')
+            mix_file.write('{"name": "expenses", "method": "GET", "path": "/api/expenses/expenses?cursor="}\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_benchmarks(self, **options):
+        stdout = io.StringIO()
+        call_command('run_benchmarks', mix=self.mix_path, rounds=2, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_report(self):
+        baseline_path = os.path.join(self.directory.name, 'baseline.json')
+        output = self.run_benchmarks(save_baseline=baseline_path)
+        self.assertRegex(output, r'budget +[\d.]+ +[\d.]+ +[\d.]+ +3\n')
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.assertEqual(set(baseline), {'budget', 'expenses'})
+        self.assertEqual(baseline['budget']['queries'], 3)
+
+    def test_regressions(self):
+        baseline_path = os.path.join(self.directory.name, 'baseline.json')
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump({
+                'budget': {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0, 'queries': 1},
+                'expenses': {'p50_ms': 10_000, 'p95_ms': 10_000, 'p99_ms': 10_000, 'queries': 100},
+            }, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'budget: queries went from 1 to 3'):
+            self.run_benchmarks(baseline=baseline_path)
+        with self.assertRaisesRegex(CommandError, r'^budget: queries[^\n]*$'):
+            # The budget request is too fast to regress by 1000 seconds, and the expenses are faster than before
+            self.run_benchmarks(baseline=baseline_path, min_regression_ms=1_000_000)
+
+    def test_errors(self):
+        with open(self.mix_path, 'a') as mix_file:
+            mix_file.write('{"name": "missing", "method": "GET", "path": "/api/budgets/budgets/0"}\n')
+        with self.assertRaisesMessage(CommandError, 'missing: status 404'):
+            self.run_benchmarks()
+
+    def test_weighted_writes(self):
+        with open(self.mix_path, 'a') as mix_file:
+            mix_file.write(json.dumps({
+                'name': 'create', 'method': 'POST', 'path': '/api/expenses/expenses', 'weight': 3, 'save': 'new',
+                'body': {'name': 'Benchmark {n}', 'timestamp': '2024-01-15T12:00:00Z', 'amount': '1.00'},
+            }) + '\n')
+            mix_file.write('{"name": "delete", "method": "DELETE", "path": "/api/expenses/expenses/{new}"}\n')
+        expense_count = Expense.objects.count()
+        self.run_benchmarks()
+        # Each of the 3 rounds (including the warm-up) creates 3 expenses and deletes the last one
+        self.assertEqual(Expense.objects.count(), expense_count + 6)
+        self.assertEqual(Expense.objects.filter(name__startswith='Benchmark ').count(), 6)
+
+    def test_unknown_placeholder(self):
+        with open(self.mix_path, 'a') as mix_file:
+            mix_file.write('{"name": "delete", "method": "DELETE", "path": "/api/expenses/expenses/{new}"}\n')
+        with self.assertRaisesMessage(CommandError, "Unknown placeholder 'new'"):
+            self.run_benchmarks()
+
+    def test_default_mix(self):
+        # Every request of the default mix, writes included, succeeds against seeded data
+        stdout = io.StringIO()
+        call_command('run_benchmarks', rounds=2, stdout=stdout)
+        self.assertIn('expense statement import', stdout.getvalue())
+        self.assertIn('budget delete', stdout.getvalue())
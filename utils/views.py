@@ -1,3 +1,92 @@
-from django.shortcuts import render
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.functional import classproperty
+from rest_framework.response import Response
 
-# Create your views here.
+from utils.caching import CachedResponseMixin, ConditionalGetMixin
+
+
+class AsyncReadMixin:
+    """
+    Serves GET (and HEAD) requests with the view's async get(), which can use
+    the async ORM, while other methods go through DRF's synchronous dispatch
+    in a thread. DRF's authentication, permission and throttling checks (and
+    conditional GETs and cached responses, for views with those mixins) only
+    exist synchronously, so they run in one hop to a thread, before get().
+    Async views only pay off under ASGI; under WSGI, Django runs each request
+    in its own event loop.
+    """
+    async_methods = ('GET', 'HEAD')
+
+    @classproperty
+    def view_is_async(cls):
+        return True
+
+    def prepare_async_read(self, request, *args, **kwargs):
+        """
+        Synchronous part of an async read, run in a thread. Returns the response
+        to send without calling get(), if any. Views can override this to do
+        other work that needs the synchronous ORM (e.g. validating filters).
+        """
+        self.initial(request, *args, **kwargs)
+        if isinstance(self, ConditionalGetMixin):
+            response = self.get_not_modified_response(request)
+            if response is not None:
+                return response
+        if isinstance(self, CachedResponseMixin):
+            return self.get_cached_response(request)
+        return None
+
+    async def aget_object(self):
+        """
+        Async version of get_object(), for views without filter backends
+        """
+        if getattr(self, 'conditional_object', None) is not None:
+            return self.conditional_object  # Already looked up for the ETag (see ConditionalGetMixin)
+        queryset = self.get_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in self.async_methods:
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+        # Same as APIView.dispatch(), but awaiting the handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            response = await sync_to_async(self.prepare_async_read)(request, *args, **kwargs)
+            if response is None:
+                response = await self.get(request, *args, **kwargs)
+                if isinstance(self, CachedResponseMixin):
+                    await sync_to_async(self.cache_response)(response)
+            if isinstance(self, ConditionalGetMixin):
+                response = self.add_validator_headers(response)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class CompiledListMixin:
+    """
+    Lists with compiled_serializer (a utils.serializers.CompiledSerializer of
+    the view's GET serializer), from values() rather than model instances
+    """
+    compiled_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.compiled_serializer.get_values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.compiled_serializer.serialize(page))
+        return Response(self.compiled_serializer.serialize(queryset))